@@ -0,0 +1,54 @@
+"""
+bench_codec.py - Compare JSON codec backends on chat traffic
+Times encode (dumps + framing) and decode (loads) for realistic
+'exchange' and 'incoming' payloads with every backend installed, plus
+the binary wire encoding from chat_wire.
+
+Usage: python bench_codec.py [iterations]
+"""
+import sys
+import timeit
+from chat_codec import CODECS
+from chat_utils import encode_frame
+import chat_wire
+
+def sample_payloads():
+    """Build the exchange/incoming messages a busy group chat produces"""
+    short = "ok see you at 8 👍"
+    medium = "Has anyone looked at the lab 3 handout? The select() part is confusing me " * 2
+    pasted = "Traceback (most recent call last):\n  File \"chat_server.py\", line 42\n" * 40
+
+    payloads = {}
+    for label, text in [('short', short), ('medium', medium), ('pasted', pasted)]:
+        payloads[f'exchange/{label}'] = {
+            'action': 'exchange',
+            'message': text,
+            'timestamp': '08:30 PM'
+        }
+        payloads[f'incoming/{label}'] = {
+            'action': 'incoming',
+            'from': 'alice',
+            'message': text,
+            'timestamp': '08:30 PM'
+        }
+    return payloads
+
+def bench(iterations):
+    """Print per-operation encode/decode cost for every backend"""
+    payloads = sample_payloads()
+    print(f"{'payload':<18} {'codec':<8} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+
+    codecs = dict(CODECS)
+    codecs['binary'] = (chat_wire.encode, chat_wire.decode)
+
+    for label, data in payloads.items():
+        for name, (dumps, loads) in codecs.items():
+            wire = dumps(data)
+            encode = timeit.timeit(lambda: encode_frame(dumps(data)), number=iterations)
+            decode = timeit.timeit(lambda: loads(wire), number=iterations)
+            print(f"{label:<18} {name:<8} {len(wire):>6} "
+                  f"{encode / iterations * 1e6:>10.2f} {decode / iterations * 1e6:>10.2f}")
+        print()
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
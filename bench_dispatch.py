@@ -0,0 +1,78 @@
+"""
+bench_dispatch.py - Measure per-action dispatch overhead
+Times Server.dispatch and ClientStateMachine.dispatch with no-op handlers,
+against the if/elif chain they replaced, and again after registering
+many extra actions to show the common path does not slow down.
+
+Usage: python bench_dispatch.py [iterations]
+"""
+import sys
+import timeit
+from chat_server import Server
+from client_state_machine import ClientStateMachine
+
+EXTRA_ACTIONS = 100
+
+def noop(*args):
+    pass
+
+def if_chain(action):
+    """The server's old routing, with the handler calls stripped out"""
+    if action == 'login':
+        noop()
+    elif action == 'connect':
+        noop()
+    elif action == 'create_group':
+        noop()
+    elif action == 'exchange':
+        noop()
+    elif action == 'disconnect':
+        noop()
+    elif action == 'who':
+        noop()
+    elif action == 'quit':
+        noop()
+
+def make_server():
+    """Server with no-op handlers and no listening socket"""
+    server = Server.__new__(Server)
+    server.handlers = {action: noop for action in Server.default_handlers(server)}
+    return server
+
+def make_client():
+    """ClientStateMachine with no-op handlers"""
+    client = ClientStateMachine()
+    client.handlers = {action: noop for action in client.handlers}
+    return client
+
+def time_ns(stmt, iterations):
+    return timeit.timeit(stmt, number=iterations) / iterations * 1e9
+
+def bench(iterations):
+    """Print dispatch cost per action, in nanoseconds"""
+    server = make_server()
+    client = make_client()
+    busy_server = make_server()
+    busy_client = make_client()
+    for i in range(EXTRA_ACTIONS):
+        busy_server.register_action(f'extra_{i}', noop)
+        busy_client.register_action(f'extra_{i}', noop)
+
+    print(f"{'action':<14} {'if/elif':>8} {'server':>8} {f'+{EXTRA_ACTIONS}':>8}")
+    for action in server.handlers:
+        data = {'action': action}
+        print(f"{action:<14} "
+              f"{time_ns(lambda: if_chain(action), iterations):>8.1f} "
+              f"{time_ns(lambda: server.dispatch(None, data), iterations):>8.1f} "
+              f"{time_ns(lambda: busy_server.dispatch(None, data), iterations):>8.1f}")
+
+    print()
+    print(f"{'action':<14} {'client':>8} {f'+{EXTRA_ACTIONS}':>8}")
+    for action in client.handlers:
+        data = {'action': action}
+        print(f"{action:<14} "
+              f"{time_ns(lambda: client.dispatch(data), iterations):>8.1f} "
+              f"{time_ns(lambda: busy_client.dispatch(data), iterations):>8.1f}")
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
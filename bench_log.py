@@ -0,0 +1,50 @@
+"""
+bench_log.py - Measure message log append and history read cost
+Appends exchange-sized records spread over many groups to a fresh log
+(with fsync on, as the server runs it) and then reads random pages of
+history, at growing log sizes, to show that appends stay cheap and
+reads do not slow down as the log grows.
+
+Usage: python bench_log.py [groups]
+"""
+import random
+import shutil
+import sys
+import tempfile
+import time
+from chat_log import MessageLog
+
+SIZES = (10000, 100000, 1000000)
+PAGE = 50
+READS = 2000
+
+def bench(groups):
+    """Print append and read cost per log size"""
+    print(f"{'records':>9} {'segments':>8} {'append us':>10} {'read page us':>13}")
+    for size in SIZES:
+        directory = tempfile.mkdtemp(prefix='chat_log_bench_')
+        try:
+            log = MessageLog(directory)
+            group_ids = [f'group_{i}' for i in range(groups)]
+            record = {'from': 'alice', 'message': 'see you at the lab at 8, bring the handout',
+                      'timestamp': '08:30 PM', 'time': 0}
+
+            began = time.perf_counter()
+            for i in range(size):
+                log.append(group_ids[i % groups], record)
+            append = (time.perf_counter() - began) / size * 1e6
+            log.sync()
+
+            began = time.perf_counter()
+            for _ in range(READS):
+                group_id = random.choice(group_ids)
+                log.read(group_id, random.randint(1, log.last(group_id)), PAGE)
+            read = (time.perf_counter() - began) / READS * 1e6
+
+            print(f"{size:>9} {len(log.segments):>8} {append:>10.2f} {read:>13.1f}")
+            log.close()
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
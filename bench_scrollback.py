@@ -0,0 +1,59 @@
+"""
+bench_scrollback.py - Measure the client's scroll-back memory and access cost
+Appends chat lines to a Scrollback and to a plain list at growing
+session lengths, and compares the memory each holds (tracemalloc), the
+append cost, a random read of an old line and a full scan as search
+does it.
+
+Usage: python bench_scrollback.py
+"""
+import random
+import time
+import tracemalloc
+from chat_scrollback import Scrollback
+
+SIZES = (10000, 100000, 1000000)
+READS = 2000
+
+def fill(lines, size):
+    """Append size lines; returns (seconds, bytes of memory kept)"""
+    tracemalloc.start()
+    began = time.perf_counter()
+    for i in range(size):
+        lines.append(f"[alice]: see you at the lab at 8, bring the handout #{i}")
+    elapsed = time.perf_counter() - began
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory
+
+def bench():
+    """Print memory and cost per session length"""
+    print(f"{'lines':>8} {'list KB':>9} {'scrollback KB':>14} {'append us':>10} "
+          f"{'old read us':>12} {'scan ms':>8}")
+    for size in SIZES:
+        _, list_memory = fill([], size)
+        lines = Scrollback()
+        elapsed, memory = fill(lines, size)
+        # tracemalloc slows appends down, so time them again without it
+        lines.close()
+        lines = Scrollback()
+        began = time.perf_counter()
+        for i in range(size):
+            lines.append(f"[alice]: see you at the lab at 8, bring the handout #{i}")
+        append_cost = (time.perf_counter() - began) / size * 1e6
+
+        began = time.perf_counter()
+        for _ in range(READS):
+            lines[random.randrange(size // 2)]
+        read_cost = (time.perf_counter() - began) / READS * 1e6
+
+        began = time.perf_counter()
+        hits = sum(1 for line in lines if 'lab' in line)
+        scan_cost = (time.perf_counter() - began) * 1e3
+        assert hits == size
+        lines.close()
+        print(f"{size:>8} {list_memory // 1024:>9} {memory // 1024:>14} {append_cost:>10.2f} "
+              f"{read_cost:>12.1f} {scan_cost:>8.1f}")
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,88 @@
+"""
+bench_search.py - Measure message search with the inverted index
+Indexes synthetic chat messages (words drawn with a skewed, chat-like
+frequency, a handful of senders) and times queries through SearchIndex
+against the linear scan the GUI used to do over every line. Each
+query's results are checked against a brute-force match.
+
+Usage: python bench_search.py [messages]
+"""
+import random
+import sys
+import time
+from chat_search import SearchIndex, tokenize
+
+WORDS = ("ok lol thanks hello help lab handout exam project deadline tonight "
+         "tomorrow meeting python socket server client thread queue select epoll "
+         "pizza coffee library homework grade midterm final review slides notes "
+         "bug crash fixed works broken test commit branch merge deploy").split()
+SENDERS = ('alice', 'bob', 'carol', 'dave', 'erin', 'Me')
+QUERIES = ('lab', 'exam tomorrow', 'hel', 'from:carol deadline', 'pyth sock serv',
+           'from:me merge deploy', 'zzz')
+LIMIT = 15
+RUNS = 200
+
+def message(rng):
+    """A random chat message: a few skewed words plus a rare numbered one"""
+    words = [WORDS[min(int(rng.paretovariate(1.2)) - 1, len(WORDS) - 1)]
+             for _ in range(rng.randint(2, 10))]
+    words.append(f"ticket{rng.randrange(100000)}")
+    rng.shuffle(words)
+    return ' '.join(words)
+
+def brute_force(lines, senders, texts, query, limit):
+    """Newest lines matching every term of the query, by scanning them all"""
+    found = []
+    terms = query.lower().split()
+    for doc in range(len(lines) - 1, -1, -1):
+        words = tokenize(texts[doc])
+        ok = True
+        for term in terms:
+            if term.startswith('from:'):
+                ok = senders[doc].lower() == term[5:]
+            else:
+                ok = any(word.startswith(term) for word in words)
+            if not ok:
+                break
+        if ok:
+            found.append(lines[doc])
+            if len(found) == limit:
+                break
+    return found
+
+def bench(count):
+    """Print indexing cost, then per-query cost for the index and a linear scan"""
+    rng = random.Random(7)
+    index = SearchIndex()
+    lines, senders, texts = [], [], []
+    began = time.perf_counter()
+    for _ in range(count):
+        sender, text = rng.choice(SENDERS), message(rng)
+        line = f"[{sender}]: {text}"
+        index.add(sender, text, line)
+        lines.append(line)
+        senders.append(sender)
+        texts.append(text)
+    add_cost = (time.perf_counter() - began) / count * 1e6
+    print(f"{count} messages indexed, {add_cost:.1f} us each, {len(index.vocabulary)} words")
+
+    print(f"{'query':>22} {'hits':>5} {'index us':>9} {'scan ms':>8}")
+    for query in QUERIES:
+        results, _ = index.search(query, LIMIT)
+        assert results == brute_force(lines, senders, texts, query, LIMIT), query
+
+        began = time.perf_counter()
+        for _ in range(RUNS):
+            index.search(query, LIMIT)
+        index_cost = (time.perf_counter() - began) / RUNS * 1e6
+
+        # What show_search used to do: every line, every query word
+        began = time.perf_counter()
+        words = query.lower().split()
+        scanned = [line for line in lines if all(word in line.lower() for word in words)]
+        scan_cost = (time.perf_counter() - began) * 1e3
+        print(f"{query:>22} {len(results):>5} {index_cost:>9.1f} {scan_cost:>8.1f}")
+    index.close()
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 300000)
@@ -0,0 +1,61 @@
+"""
+bench_sentiment.py - Measure what sentiment scoring costs the GUI thread
+Feeds a burst of chat messages (short repeats like "ok" and "lol" mixed
+with longer distinct ones) to FeatureManager, once scoring each message
+in place the way the GUI used to, and once handing it to the sentiment
+workers, and prints the time the calling thread spent per message and
+how long until every score was in.
+
+Usage: python bench_sentiment.py [messages]
+"""
+import random
+import sys
+import threading
+import time
+from feature_utils import FeatureManager
+
+REPEATS = ('ok', 'lol', 'thanks', 'haha', 'yes', 'no', 'ok!', 'Thanks', 'good night')
+REPEAT_SHARE = 0.5  # share of the burst that is a short repeat
+WORDS = ('great', 'awful', 'meeting', 'tomorrow', 'really', 'happy', 'sad', 'the',
+         'project', 'late', 'love', 'this', 'hate', 'lunch', 'was', 'not')
+
+def burst(count):
+    """A list of count messages"""
+    rng = random.Random(1)
+    return [rng.choice(REPEATS) if rng.random() < REPEAT_SHARE
+            else ' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))
+            for _ in range(count)]
+
+def bench(count):
+    """Print per-message caller time for synchronous and worker scoring"""
+    messages = burst(count)
+
+    # Every message through TextBlob, like the old code path
+    manager = FeatureManager(None)
+    began = time.perf_counter()
+    for message in messages:
+        manager.score_sentiment(message)
+    sync = time.perf_counter() - began
+
+    manager = FeatureManager(None)
+    done = threading.Semaphore(0)
+    def scored(result):
+        done.release()
+    began = time.perf_counter()
+    waiting = 0
+    for message in messages:
+        if manager.analyze_sentiment_async(message, scored) is None:
+            waiting += 1
+    caller = time.perf_counter() - began
+    for _ in range(waiting):
+        done.acquire()
+    total = time.perf_counter() - began
+
+    print(f"{count} messages, {len(set(messages))} distinct")
+    print(f"  in place:     {sync / count * 1e6:>9.1f} us/message on the GUI thread")
+    print(f"  workers:      {caller / count * 1e6:>9.1f} us/message on the GUI thread, "
+          f"all scored after {total * 1e3:.0f} ms (in place: {sync * 1e3:.0f} ms)")
+    print(f"  answered at once from the cache: {count - waiting}")
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,70 @@
+"""
+bench_sessions.py - Measure per-connection server memory
+Builds N idle, logged in connections two ways - the parallel dicts the
+server used to keep (clients, logged_name2sock, logged_sock2name,
+all_sockets, decoders, ...) and one Session per connection in a
+SessionTable - and reports the bytes each layout costs per client.
+Sockets are stood in for by plain objects so only bookkeeping counts.
+
+Usage: python bench_sessions.py [clients]
+"""
+import sys
+import tracemalloc
+from chat_session import Session, SessionTable
+from chat_utils import FrameDecoder
+
+class FakeSocket:
+    __slots__ = ('fd',)
+
+    def __init__(self, fd):
+        self.fd = fd
+
+def build_dicts(socks):
+    """The old layout: one dict (or list) entry per connection per concern"""
+    state = {
+        'clients': {}, 'logged_name2sock': {}, 'logged_sock2name': {},
+        'all_sockets': [], 'decoders': {}, 'wire_formats': {},
+        'compressors': {}, 'decompressors': {}, 'outbound': {}, 'over_limit': {},
+    }
+    for i, sock in enumerate(socks):
+        name = f'user{i}'
+        state['all_sockets'].append(sock)
+        state['decoders'][sock] = FrameDecoder()
+        state['clients'][name] = sock
+        state['logged_name2sock'][name] = sock
+        state['logged_sock2name'][sock] = name
+    return state
+
+def build_sessions(socks):
+    """The new layout: one Session per connection, indexed by fd and name"""
+    table = SessionTable()
+    for i, sock in enumerate(socks):
+        session = Session(sock, sock.fd, FrameDecoder())
+        table.add(session)
+        table.login(session, f'user{i}')
+    return table
+
+def measure(build, socks):
+    """Bytes allocated by build(socks), per connection"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = build(socks)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del state
+    return (after - before) / len(socks)
+
+def bench(count):
+    """Print per-client memory for both layouts"""
+    socks = [FakeSocket(fd) for fd in range(count)]
+    decoder = measure(lambda s: [FrameDecoder() for _ in s], socks)
+    dicts = measure(build_dicts, socks)
+    sessions = measure(build_sessions, socks)
+    print(f"{count} idle clients")
+    print(f"{'layout':<16} {'bytes/client':>12} {'total MB':>9}")
+    print(f"{'FrameDecoder':<16} {decoder:>12.0f} {decoder * count / 2**20:>9.1f}")
+    print(f"{'parallel dicts':<16} {dicts:>12.0f} {dicts * count / 2**20:>9.1f}")
+    print(f"{'sessions':<16} {sessions:>12.0f} {sessions * count / 2**20:>9.1f}")
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
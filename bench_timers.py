@@ -0,0 +1,71 @@
+"""
+bench_timers.py - Measure liveness timer cost against a per-tick scan
+Gives every simulated connection a heartbeat timer on a TimerWheel the
+way the server does (a check per interval, re-armed from last_active),
+with a small share of connections active each tick, and compares the
+time per tick with scanning every session's last_active instead. The
+cost of marking connections active is measured alone and subtracted.
+
+Usage: python bench_timers.py [seconds simulated]
+"""
+import random
+import sys
+import time
+from chat_timers import TimerWheel, TICK
+
+SIZES = (1000, 10000, 100000)
+INTERVAL = 30  # heartbeat interval, seconds
+ACTIVE = 0.01  # share of connections sending a frame per tick
+
+class Conn:
+    __slots__ = ('last_active',)
+
+    def __init__(self, now):
+        self.last_active = now
+
+def bench(seconds):
+    """Print microseconds per tick for the wheel and for a full scan"""
+    print(f"{'conns':>7} {'wheel us/tick':>14} {'scan us/tick':>13}")
+    ticks = int(seconds / TICK)
+    for size in SIZES:
+        start = 0.0
+        conns = [Conn(start) for _ in range(size)]
+        active = max(1, int(size * ACTIVE))
+
+        began = time.perf_counter()
+        for tick in range(1, ticks + 1):
+            now = start + tick * TICK
+            for conn in random.sample(conns, active):
+                conn.last_active = now
+        base = time.perf_counter() - began
+
+        wheel = TimerWheel(now=start)
+        def check(conn, now_box):
+            now = now_box[0]
+            quiet = now - conn.last_active
+            wheel.schedule(INTERVAL - quiet if quiet < INTERVAL else INTERVAL, check, conn, now_box)
+        now_box = [start]
+        for conn in conns:
+            wheel.schedule(random.uniform(0, INTERVAL), check, conn, now_box)
+        began = time.perf_counter()
+        for tick in range(1, ticks + 1):
+            now = now_box[0] = start + tick * TICK
+            for conn in random.sample(conns, active):
+                conn.last_active = now
+            wheel.advance(now)
+        wheel_cost = (time.perf_counter() - began - base) / ticks * 1e6
+
+        began = time.perf_counter()
+        for tick in range(1, ticks + 1):
+            now = start + tick * TICK
+            for conn in random.sample(conns, active):
+                conn.last_active = now
+            for conn in conns:
+                if now - conn.last_active >= INTERVAL:
+                    conn.last_active = now
+        scan_cost = (time.perf_counter() - began - base) / ticks * 1e6
+
+        print(f"{size:>7} {wheel_cost:>14.1f} {scan_cost:>13.1f}")
+
+if __name__ == '__main__':
+    bench(float(sys.argv[1]) if len(sys.argv) > 1 else 60)
@@ -0,0 +1,82 @@
+"""
+bench_workers.py - Measure message throughput against the worker count
+Starts the server with --workers 1, 2, 4, ... and drives it with client
+pairs in separate processes; each pair streams exchange messages one
+way and the receiver counts the incoming deliveries.
+
+Usage: python bench_workers.py [max_workers] [pairs] [messages_per_pair]
+"""
+import json
+import multiprocessing
+import socket
+import subprocess
+import sys
+import time
+from chat_utils import mysend, myrecv
+
+BENCH_PORT = 21112
+
+def run_pair(port, index, messages, start, results):
+    """Log a pair in, connect them and time one-way delivery"""
+    sender = socket.create_connection(('127.0.0.1', port))
+    receiver = socket.create_connection(('127.0.0.1', port))
+    names = (f'send{index}', f'recv{index}')
+    for sock, name in zip((sender, receiver), names):
+        mysend(sock, json.dumps({'action': 'login', 'name': name}))
+        myrecv(sock)
+    mysend(sender, json.dumps({'action': 'connect', 'to': names[1]}))
+    myrecv(sender)
+    myrecv(receiver)
+
+    start.wait()
+    began = time.perf_counter()
+    for i in range(messages):
+        mysend(sender, json.dumps({'action': 'exchange', 'message': f'message {i}',
+                                   'timestamp': ''}))
+    for _ in range(messages):
+        myrecv(receiver)
+    results.put(time.perf_counter() - began)
+    sender.close()
+    receiver.close()
+
+def bench_once(workers, pairs, messages):
+    """Messages delivered per second with the given number of workers"""
+    server = subprocess.Popen([sys.executable, 'chat_server.py', '--port', str(BENCH_PORT),
+                               '--workers', str(workers), '--no-rate-limit'],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1 + 0.2 * workers)
+    try:
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=run_pair,
+                                           args=(BENCH_PORT, i, messages, start, results))
+                   for i in range(pairs)]
+        for client in clients:
+            client.start()
+        time.sleep(1)
+        start.set()
+        elapsed = max(results.get() for _ in clients)
+        for client in clients:
+            client.join()
+        return pairs * messages / elapsed
+    finally:
+        server.terminate()
+        server.wait()
+        time.sleep(0.5)
+
+def bench(max_workers, pairs, messages):
+    """Print throughput for 1, 2, 4, ... workers"""
+    print(f"{'workers':>7} {'msgs/s':>10} {'speedup':>8}")
+    baseline = None
+    workers = 1
+    while workers <= max_workers:
+        rate = bench_once(workers, pairs, messages)
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:>10.0f} {rate / baseline:>7.2f}x")
+        workers *= 2
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    bench(args[0] if args else multiprocessing.cpu_count(),
+          args[1] if len(args) > 1 else 16,
+          args[2] if len(args) > 2 else 2000)
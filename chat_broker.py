@@ -0,0 +1,434 @@
+"""
+chat_broker.py - Broker for multi-process and multi-node server modes
+Worker processes share the chat port with SO_REUSEPORT, and cluster
+nodes run on separate ports or machines, so the users of one group may
+be connected to different servers. Every worker talks to the broker
+over its own Unix socket pair, every node over a TCP connection:
+
+- Presence and group changes are sent to the broker as ops. The broker
+  applies each op to its own ClusterState and relays it to every worker
+  in one global order, so all replicas of the state stay identical and
+  the worker that issued an op learns its result when the op comes back.
+- Messages for users on another worker travel as deliver frames, which
+  the broker forwards to the target worker without decoding them.
+- Chat messages of a group spread over several workers travel as
+  publish frames. The broker stamps each with the group's next sequence
+  number and sends it to every worker holding a member, so all of them
+  see the group's messages in the same order under the same seqs.
+
+Nodes join at any time: the first frame on a node's connection is a
+welcome carrying its id and a snapshot of the state, and every op after
+it follows in order. Run a standalone broker with:
+python chat_broker.py --port 1113
+"""
+import argparse
+import selectors
+import socket
+import struct
+from chat_utils import encode_frame, FrameDecoder
+from chat_group import Group
+from chat_server import OutboundQueue
+import chat_codec
+
+DELIVER_MARKER = 0xC3  # first byte of a deliver frame; op frames are JSON
+DELIVER_HEADER = struct.Struct('!BH')  # marker, target worker id
+PUBLISH_MARKER = 0xC4  # a chat message for the broker to number
+PUBLISH_HEADER = struct.Struct('!BHH')  # marker, origin worker id, group id length
+STAMPED_MARKER = 0xC5  # a numbered chat message, sent on to the workers
+STAMPED_HEADER = struct.Struct('!BHQH')  # marker, origin worker id, seq, group id length
+
+BROKER_ID = -1  # worker id on ops the broker issues itself
+BROKER_PORT = 1113  # default port nodes join on
+
+class ClusterState:
+    """
+    Presence directory and group table shared by every process
+
+    Each process holds a replica and changes it only through apply(),
+    called with ops in the order the broker relays them. Group is
+    deterministic, so equal op sequences give equal group ids.
+    """
+
+    OPS = ('sync', 'login', 'logout', 'connect', 'create_group', 'disconnect',
+           'reserve_group_ids')
+
+    def __init__(self):
+        self.group = Group()
+        self.presence = {}  # name -> id of the worker the user is connected to
+
+    def apply(self, call, args, worker):
+        """
+        Apply one op to the replica
+
+        Args:
+            call: op name, one of OPS
+            args: op arguments
+            worker: id of the worker that issued the op
+
+        Returns:
+            the op's result (same on every replica)
+        """
+        if call not in self.OPS:
+            raise ValueError(f"Unknown cluster op: {call}")
+        return getattr(self, 'op_' + call)(worker, *args)
+
+    def snapshot(self):
+        """
+        Copy the state into a JSON-friendly dict for a joining node
+
+        Returns:
+            dict accepted by load()
+        """
+        group = self.group
+        return {
+            'presence': self.presence,
+            'groups': group.groups,
+            'user_to_group': group.user_to_group,
+            'private_chats': [[*pair, group_id] for pair, group_id in group.private_chats.items()],
+            'users': list(group.users),
+            'next_group_id': group.next_group_id,
+        }
+
+    def load(self, snapshot):
+        """Replace the replica with a snapshot() taken by the broker"""
+        group = self.group = Group()
+        group.groups = snapshot['groups']
+        group.user_to_group = snapshot['user_to_group']
+        group.private_chats = {(user1, user2): group_id
+                               for user1, user2, group_id in snapshot['private_chats']}
+        group.users = set(snapshot['users'])
+        group.next_group_id = snapshot['next_group_id']
+        self.presence = snapshot['presence']
+
+    def op_sync(self, worker):
+        """No-op; waiting for it brings a replica up to date"""
+
+    def op_login(self, worker, name):
+        """Claim a name; False if it is already in use anywhere"""
+        if name in self.presence:
+            return False
+        self.presence[name] = worker
+        self.group.add_user(name)
+        return True
+
+    def op_logout(self, worker, name):
+        """Release a name"""
+        return self.presence.pop(name, None) is not None
+
+    def op_connect(self, worker, user1, user2):
+        """Group.connect"""
+        return self.group.connect(user1, user2)
+
+    def op_create_group(self, worker, members):
+        """Group.create_group"""
+        return self.group.create_group(members)
+
+    def op_disconnect(self, worker, name):
+        """Group.disconnect"""
+        return self.group.disconnect(name)
+
+    def op_reserve_group_ids(self, worker, next_group_id):
+        """Skip group ids a worker's message log already holds"""
+        group = self.group
+        group.next_group_id = max(group.next_group_id, next_group_id)
+
+    def workers_of(self, group_id):
+        """Ids of the workers holding a member of a group"""
+        return {self.presence[name] for name in self.group.get_group_members(group_id)
+                if name in self.presence}
+
+def encode_op(call, args, worker, req):
+    """Build an op frame payload"""
+    return chat_codec.dumps({'call': call, 'args': list(args), 'worker': worker, 'req': req})
+
+def encode_deliver(worker, names, data):
+    """Build a deliver frame payload for the users named on one worker"""
+    return DELIVER_HEADER.pack(DELIVER_MARKER, worker) + chat_codec.dumps({'names': names, 'data': data})
+
+def is_deliver(payload):
+    """True for deliver frames"""
+    return payload[0] == DELIVER_MARKER
+
+def decode_deliver(payload):
+    """
+    Split a deliver frame payload
+
+    Returns:
+        (target worker id, names, message dict)
+    """
+    target = DELIVER_HEADER.unpack_from(payload)[1]
+    body = chat_codec.loads(memoryview(payload)[DELIVER_HEADER.size:].tobytes())
+    return target, body['names'], body['data']
+
+def encode_publish(worker, group_id, record, floor=0):
+    """
+    Build a publish frame payload
+
+    Args:
+        worker: id of the worker the sender is on
+        group_id: chat group the message is for
+        record: message dict
+        floor: highest seq the worker already knows for the group, so
+            numbering resumes past it (e.g. after a restart)
+    """
+    group = group_id.encode()
+    return (PUBLISH_HEADER.pack(PUBLISH_MARKER, worker, len(group)) + group
+            + chat_codec.dumps({'floor': floor, 'record': record}))
+
+def is_stamped(payload):
+    """True for numbered chat messages coming back from the broker"""
+    return payload[0] == STAMPED_MARKER
+
+def decode_stamped(payload):
+    """
+    Split a stamped frame payload
+
+    Returns:
+        (origin worker id, group id, seq, message dict)
+    """
+    _, origin, seq, length = STAMPED_HEADER.unpack_from(payload)
+    end = STAMPED_HEADER.size + length
+    group_id = bytes(payload[STAMPED_HEADER.size:end]).decode()
+    body = chat_codec.loads(memoryview(payload)[end:].tobytes())
+    return origin, group_id, seq, body['record']
+
+class WorkerLink:
+    """The broker's end of one worker's socket pair"""
+
+    __slots__ = ('sock', 'worker_id', 'decoder', 'outbound', 'events')
+
+    def __init__(self, sock, worker_id):
+        self.sock = sock
+        self.worker_id = worker_id
+        self.decoder = FrameDecoder()
+        self.outbound = None
+        self.events = 0
+
+class Broker:
+    """
+    Sequencer and relay between worker processes or cluster nodes
+
+    Never blocks on a worker: frames a worker is not reading yet wait
+    in that link's outbound queue, so a busy worker cannot stall the
+    others (or deadlock against the broker).
+    """
+
+    def __init__(self, socks=(), address=None):
+        """
+        Args:
+            socks: broker ends of the worker socket pairs, indexed by worker id
+            address: (host, port) to accept cluster nodes on, if any
+        """
+        self.state = ClusterState()
+        self.seqs = {}  # group id -> last seq stamped
+        self.selector = selectors.DefaultSelector()
+        self.links = {}
+        for worker_id, sock in enumerate(socks):
+            sock.setblocking(False)
+            link = self.links[worker_id] = WorkerLink(sock, worker_id)
+            self.update_interest(link)
+        self.next_id = len(self.links)
+
+        self.listener = None
+        if address:
+            self.listener = socket.create_server(address, backlog=128)
+            self.listener.setblocking(False)
+            self.selector.register(self.listener, selectors.EVENT_READ, None)
+
+    def run(self):
+        """Relay frames until every worker has gone away (forever when listening)"""
+        if self.listener:
+            print(f"[BROKER] Accepting nodes on {self.listener.getsockname()}")
+        else:
+            print(f"[BROKER] Relaying for {len(self.links)} workers")
+        try:
+            while self.links or self.listener:
+                for key, mask in self.selector.select():
+                    link = key.data
+                    if link is None:
+                        self.handle_join()
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        self.flush(link)
+                    if mask & selectors.EVENT_READ and link.worker_id in self.links:
+                        self.handle_readable(link)
+        finally:
+            # Closing the links tells every remaining worker to stop
+            for link in list(self.links.values()):
+                self.close_link(link)
+            if self.listener:
+                self.listener.close()
+            self.selector.close()
+
+    def handle_join(self):
+        """Accept joining nodes and send each its id and the current state"""
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"[BROKER] Error accepting node: {e}")
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            link = self.links[self.next_id] = WorkerLink(sock, self.next_id)
+            self.next_id += 1
+            self.update_interest(link)
+            # Queued ahead of every later op, so the snapshot is never stale
+            self.send(link, encode_frame(chat_codec.dumps({
+                'call': 'welcome',
+                'node': link.worker_id,
+                'state': self.state.snapshot(),
+            })))
+            print(f"[BROKER] Node {link.worker_id} joined from {address}")
+
+    def handle_readable(self, link):
+        """Read from a worker and act on every complete frame"""
+        try:
+            received = link.decoder.recv_into(link.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            received = 0
+        if not received:
+            self.handle_worker_exit(link)
+            return
+
+        for payload in link.decoder.frames():
+            if is_deliver(payload):
+                target = self.links.get(DELIVER_HEADER.unpack_from(payload)[1])
+                if target:
+                    self.send(target, encode_frame(payload))
+                continue
+            if payload[0] == PUBLISH_MARKER:
+                self.stamp(payload)
+                continue
+            try:
+                op = chat_codec.loads(payload)
+            except chat_codec.DecodeError as e:
+                print(f"[BROKER] Bad op from worker {link.worker_id}: {e}")
+                continue
+            try:
+                self.state.apply(op['call'], op['args'], op['worker'])
+            except Exception as e:
+                # Still relayed: every replica fails the same way, and the
+                # worker that sent it is waiting for its turn
+                print(f"[BROKER] Op {op.get('call')} failed: {e}")
+            self.publish(encode_frame(payload))
+
+    def stamp(self, payload):
+        """
+        Number a published message and send it to its group's workers
+
+        Only the header is rewritten; the message body is passed on
+        undecoded except for the floor, which is read from its start.
+        """
+        _, origin, length = PUBLISH_HEADER.unpack_from(payload)
+        end = PUBLISH_HEADER.size + length
+        group_id = bytes(payload[PUBLISH_HEADER.size:end]).decode()
+        body = memoryview(payload)[end:]
+        seq = self.seqs.get(group_id, 0)
+        if not seq:
+            # First message since the broker started: the origin may
+            # know of older ones from its log
+            seq = chat_codec.loads(body.tobytes())['floor']
+        seq = self.seqs[group_id] = seq + 1
+        frame = encode_frame(STAMPED_HEADER.pack(STAMPED_MARKER, origin, seq, length)
+                             + payload[PUBLISH_HEADER.size:end] + body)
+        # The origin always gets it back, to confirm the seq to the sender
+        for worker in self.state.workers_of(group_id) | {origin}:
+            link = self.links.get(worker)
+            if link:
+                self.send(link, frame)
+
+    def publish(self, frame):
+        """Send one frame to every worker, sharing the bytes"""
+        for link in list(self.links.values()):
+            self.send(link, frame)
+
+    def issue(self, call, *args):
+        """Apply an op on the broker's own behalf and relay it"""
+        self.state.apply(call, args, BROKER_ID)
+        self.publish(encode_frame(encode_op(call, args, BROKER_ID, 0)))
+
+    def handle_worker_exit(self, link):
+        """Forget a worker and log its users out everywhere"""
+        print(f"[BROKER] {'Node' if self.listener else 'Worker'} {link.worker_id} left")
+        self.close_link(link)
+        for name, worker in list(self.state.presence.items()):
+            if worker == link.worker_id:
+                if self.state.group.is_in_group(name):
+                    self.issue('disconnect', name)
+                self.issue('logout', name)
+
+    def close_link(self, link):
+        """Stop watching a worker's socket and close it"""
+        self.links.pop(link.worker_id, None)
+        link.outbound = None
+        if link.events:
+            self.selector.unregister(link.sock)
+            link.events = 0
+        link.sock.close()
+
+    def send(self, link, frame):
+        """Write a frame to a worker now, or queue what does not fit"""
+        if link.outbound is None:
+            try:
+                sent = link.sock.send(frame)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                return  # Reported as EOF on the next read
+            if sent == len(frame):
+                return
+            link.outbound = OutboundQueue()
+            self.update_interest(link)
+            if sent:
+                frame = memoryview(frame)[sent:]
+        link.outbound.append(frame)
+
+    def flush(self, link):
+        """Write queued frames to a worker that became writable"""
+        queue = link.outbound
+        if queue:
+            try:
+                queue.write_to(link.sock)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+        if not queue:
+            link.outbound = None
+            self.update_interest(link)
+
+    def update_interest(self, link):
+        """Always read; watch for writability only while output is queued"""
+        events = selectors.EVENT_READ
+        if link.outbound is not None:
+            events |= selectors.EVENT_WRITE
+        if events == link.events:
+            return
+        if link.events:
+            self.selector.modify(link.sock, events, link)
+        else:
+            self.selector.register(link.sock, events, link)
+        link.events = events
+
+def main():
+    """Run a standalone broker for cluster nodes"""
+    parser = argparse.ArgumentParser(description="ICS chat cluster broker")
+    parser.add_argument('--host', default='0.0.0.0',
+                        help="address to accept nodes on (default all interfaces)")
+    parser.add_argument('--port', type=int, default=BROKER_PORT,
+                        help=f"port to accept nodes on (default {BROKER_PORT})")
+    args = parser.parse_args()
+
+    broker = Broker(address=(args.host, args.port))
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        print("\n[BROKER] Shutting down...")
+
+if __name__ == '__main__':
+    main()
@@ -3,32 +3,51 @@ chat_client_class.py - Chat Client Class
 Manages socket connection and integrates GUI with state machine
 """
 
+import select
 import socket
 import threading
+import time
 import sys
 from chat_utils import mysend, myrecv, SERVER_IP, SERVER_PORT
-from client_state_machine import ClientStateMachine, S_OFFLINE, S_LOGGEDIN
+import chat_wire
+from chat_compress import DEFLATE_CAPABILITY
+from chat_timers import HEARTBEAT_CAPABILITY, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT
+from client_state_machine import ClientStateMachine, S_OFFLINE, S_LOGGEDIN, ACK_INTERVAL
 from chat_gui import ChatGUI, LoginWindow
 
+# Seconds to wait before each reconnect attempt after the connection
+# drops - about as long as the server keeps a dropped session parked
+RECONNECT_DELAYS = (0.5, 1, 2, 4, 8, 8, 8)
+
 class ChatClient:
     """Main chat client class"""
     
-    def __init__(self, server_ip=SERVER_IP, server_port=SERVER_PORT):
+    def __init__(self, server_ip=SERVER_IP, server_port=SERVER_PORT,
+                 capabilities=(chat_wire.BINARY_CAPABILITY, DEFLATE_CAPABILITY,
+                               HEARTBEAT_CAPABILITY)):
         """
         Initialize chat client
         
         Args:
             server_ip: Server IP address
             server_port: Server port
+            capabilities: protocol features to request at login; servers
+                that do not know them simply keep using JSON
         """
         self.server_ip = server_ip
         self.server_port = server_port
+        self.capabilities = list(capabilities)
         self.socket = None
         self.state_machine = None
         self.gui = None
         self.client_name = None
         self.running = False
+        self.leaving = False  # set once the user quits, so a close is not a drop
         self.receive_thread = None
+        self.ack_thread = None
+        # The GUI, the receive thread and the ack timer all send; frames
+        # must reach the socket (and the deflate stream) one at a time
+        self.send_lock = threading.Lock()
     
     def connect_to_server(self):
         """Establish connection to server"""
@@ -48,19 +67,14 @@ class ChatClient:
         Args:
             nickname: User's nickname
         """
-        import json
-        
         self.client_name = nickname
         
         # Initialize state machine (no arguments!)
         self.state_machine = ClientStateMachine()
         self.state_machine.my_name = nickname
         
-        # Send login message
-        login_msg = json.dumps({
-            'action': 'login',
-            'name': nickname
-        })
+        # Send login message (JSON until the server accepts a capability)
+        login_msg = self.state_machine.format_login(nickname, self.capabilities)
         
         try:
             mysend(self.socket, login_msg)
@@ -70,26 +84,33 @@ class ChatClient:
             print(f"[✗] Login failed: {e}")
             return False
     
-    def send_message(self, message):
-
+    def send_message(self, message, ref=None):
+        """
+        Send what the user typed: a command, prepared JSON or a chat message
+        
+        Args:
+            message: text from the GUI
+            ref: optional number for a chat message; the server answers
+                with its seq so delivery/read receipts can be shown on it
+        """
         try:
-            import json
             print(f"[DEBUG] send_message called with: '{message}'") 
         # Check if it's a command
             if message.startswith('connect '):
             # Extract peer name
                 peer_name = message.split(' ', 1)[1].strip()
-                formatted_msg = json.dumps({
+                formatted_msg = self.state_machine.encode({
                     'action': 'connect',
                     'to': peer_name
                 })
             elif 'who' in message.lower() or message.strip() == 'who':
-                formatted_msg = json.dumps({
+                formatted_msg = self.state_machine.encode({
                     'action': 'who'
                 })
                 print(f"[DEBUG] Sending who request: {formatted_msg}")
             elif message.startswith('q'):
-                formatted_msg = json.dumps({
+                self.leaving = True
+                formatted_msg = self.state_machine.encode({
                     'action': 'quit'
                 })
             elif isinstance(message, str) and message.startswith('{'):
@@ -99,32 +120,67 @@ class ChatClient:
             # Regular message - format with timestamp
                 from datetime import datetime
                 timestamp = datetime.now().strftime("%I:%M %p")
-                formatted_msg = json.dumps({
-                    'action': 'exchange',
-                    'message': message,
-                    'timestamp': timestamp
-                })
+                formatted_msg = self.state_machine.format_message(message, timestamp, ref)
         
-            mysend(self.socket, formatted_msg)
+            self.send_raw(formatted_msg)
         
         except Exception as e:
             print(f"[✗] Error sending message: {e}")
             if self.gui:
                 self.gui.display_system_message(f"Failed to send message: {e}")
     
+    def send_request(self, data):
+        """
+        Encode and send a request dict built by the GUI
+        
+        Args:
+            data: message dict with an 'action' (e.g. history, who)
+        """
+        try:
+            self.send_raw(self.state_machine.encode(data))
+        except Exception as e:
+            print(f"[✗] Error sending {data.get('action')} request: {e}")
+            if self.gui:
+                self.gui.display_system_message(f"Failed to send request: {e}")
+    
+    def send_raw(self, payload):
+        """Compress (if negotiated) and send one encoded payload"""
+        with self.send_lock:
+            mysend(self.socket, self.state_machine.compress(payload))
+    
+    def flush_acks(self):
+        """Send the cumulative acks collected since the last flush"""
+        for payload in self.state_machine.take_acks():
+            self.send_raw(payload)
+    
+    def send_acks(self):
+        """Ack timer (runs in separate thread): flush acks every ACK_INTERVAL"""
+        while self.running:
+            time.sleep(ACK_INTERVAL)
+            try:
+                self.flush_acks()
+            except Exception as e:
+                if self.running:
+                    print(f"[✗] Error sending acks: {e}")
+    
     def receive_messages(self):
         """Receive messages from server (runs in separate thread)"""
         print("[DEBUG] Receive thread started")
         while self.running:
             try:
-                msg = myrecv(self.socket)
+                if HEARTBEAT_CAPABILITY in self.state_machine.capabilities and not self.wait_for_server():
+                    msg = None  # Silent through a ping - the connection is dead
+                else:
+                    msg = myrecv(self.socket, decode=False)
                 
                 if not msg:
                     print("[!] Server closed connection")
+                    if self.running and not self.leaving and self.reconnect():
+                        continue
                     self.running = False
                     if self.gui:
                         try:
-                            self.gui.display_system_message("Server disconnected")
+                            self.gui.events.display_system_message("Server disconnected")
                         except:
                             pass
                     break
@@ -133,6 +189,15 @@ class ChatClient:
                 
                 # Process message through state machine
                 self.state_machine.process_message(msg)
+                if self.state_machine.pong_due:
+                    self.state_machine.pong_due = False
+                    self.send_raw(self.state_machine.format_pong())
+                if self.state_machine.login_needed:
+                    # The server no longer holds our session - start a new one
+                    self.state_machine.login_needed = False
+                    self.send_raw(self.state_machine.format_login(self.client_name, self.capabilities))
+                if self.state_machine.ack_due:
+                    self.flush_acks()  # Enough waiting - don't wait for the timer
                 
             except Exception as e:
                 if self.running:
@@ -150,6 +215,67 @@ class ChatClient:
         
         print("[!] Receive thread terminated")
     
+    def wait_for_server(self):
+        """
+        Wait for the server to send something, pinging it once it goes quiet
+        
+        A dead peer (say, after the network changed) never closes the
+        connection, so without this the client would wait forever.
+        
+        Returns:
+            True when data is ready, False if the server did not answer
+            a ping within HEARTBEAT_TIMEOUT
+        """
+        if select.select([self.socket], [], [], HEARTBEAT_INTERVAL)[0]:
+            return True
+        try:
+            self.send_raw(self.state_machine.format_ping())
+        except OSError:
+            return False
+        return bool(select.select([self.socket], [], [], HEARTBEAT_TIMEOUT)[0])
+    
+    def reconnect(self):
+        """
+        Get back on the server after the connection dropped
+        
+        Retries for about as long as the server parks a dropped session,
+        then sends a resume with the last seq received, so only the
+        missed messages are replayed and the chat is kept. The replies
+        arrive on the normal receive loop.
+        
+        Returns:
+            True once a new connection is up and the request is sent
+        """
+        if self.gui:
+            self.gui.events.display_system_message("Connection lost - reconnecting...")
+        for delay in RECONNECT_DELAYS:
+            time.sleep(delay)
+            if not self.running or self.leaving:
+                return False
+            try:
+                sock = socket.create_connection((self.server_ip, self.server_port), timeout=5)
+                sock.settimeout(None)
+            except OSError as e:
+                print(f"[!] Reconnect failed: {e}")
+                continue
+            
+            with self.send_lock:
+                try:
+                    self.socket.close()
+                except OSError:
+                    pass
+                self.socket = sock
+                self.state_machine.reset_connection()  # New deflate streams, if any
+                request = (self.state_machine.format_resume(self.capabilities)
+                           or self.state_machine.format_login(self.client_name, self.capabilities))
+                try:
+                    mysend(sock, request)
+                except OSError:
+                    continue
+            print(f"[✓] Reconnected to {self.server_ip}:{self.server_port}")
+            return True
+        return False
+    
     def start(self):
         """Start the client"""
         # Show login window
@@ -175,10 +301,16 @@ class ChatClient:
         self.receive_thread = threading.Thread(target=self.receive_messages)
         self.receive_thread.daemon = True
         self.receive_thread.start()
+        self.ack_thread = threading.Thread(target=self.send_acks, daemon=True)
+        self.ack_thread.start()
         
         # Create and start GUI
         self.gui = ChatGUI(self.send_message, nickname)
-        self.state_machine.gui = self.gui
+        self.gui.seen_callback = self.state_machine.mark_seen
+        self.gui.request_callback = self.send_request
+        # The state machine runs on the receive thread: its calls are
+        # queued and handled on the Tk thread
+        self.state_machine.gui = self.gui.events
         
         # Run GUI (blocks until window is closed)
         self.gui.run()
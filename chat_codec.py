@@ -0,0 +1,70 @@
+"""
+chat_codec.py - JSON codec shared by server, client and state machine
+Uses orjson or ujson when installed and falls back to the stdlib json
+module. dumps() always returns UTF-8 bytes, ready for encode_frame.
+
+Set CHAT_JSON_CODEC=json|ujson|orjson to force a particular backend.
+"""
+import json
+import os
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _stdlib_loads(data):
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
+
+# name -> (dumps, loads) for every backend importable here, fastest first
+CODECS = {}
+
+try:
+    import orjson
+
+    def _orjson_loads(data):
+        return orjson.loads(data)
+
+    CODECS['orjson'] = (orjson.dumps, _orjson_loads)
+except ImportError:
+    pass
+
+try:
+    import ujson
+
+    def _ujson_dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def _ujson_loads(data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return ujson.loads(data)
+
+    CODECS['ujson'] = (_ujson_dumps, _ujson_loads)
+except ImportError:
+    pass
+
+CODECS['json'] = (_stdlib_dumps, _stdlib_loads)
+
+def get_codec(name=None):
+    """
+    Look up a codec backend
+
+    Args:
+        name: 'orjson', 'ujson' or 'json'; None picks the fastest installed
+
+    Returns:
+        (name, dumps, loads)
+    """
+    if name is None:
+        name = next(iter(CODECS))
+    if name not in CODECS:
+        print(f"[WARN] JSON codec '{name}' not installed, using stdlib json")
+        name = 'json'
+    dumps, loads = CODECS[name]
+    return name, dumps, loads
+
+BACKEND, dumps, loads = get_codec(os.environ.get('CHAT_JSON_CODEC') or None)
+
+# Every backend raises a ValueError subclass on malformed input
+DecodeError = ValueError
@@ -0,0 +1,107 @@
+"""
+chat_compress.py - Per-connection streaming deflate for chat frames
+Clients opt in by listing 'deflate' in the capabilities field of their
+login. Each direction of the connection then keeps one zlib stream for
+its whole lifetime: frames are sync-flushed rather than finished, so the
+compression window (seeded with a preset dictionary of common protocol
+strings) carries over from one frame to the next.
+
+Frames smaller than the threshold are sent as-is; compressed payloads
+start with COMPRESSED_MARKER so the receiver can tell them apart.
+"""
+import zlib
+from chat_utils import MAX_FRAME_SIZE
+
+DEFLATE_CAPABILITY = 'deflate'
+COMPRESSED_MARKER = 0xC2  # like 0xC1, never the first byte of valid UTF-8
+COMPRESS_THRESHOLD = 256  # payload bytes below which compression is skipped
+COMPRESS_LEVEL = 6
+
+# Seeds the window so even the first frames compress well
+PRESET_DICTIONARY = (
+    b'{"action":"login","status":"success","message":"Welcome '
+    b'{"action":"connect","status":"error","message":"Connected to '
+    b'{"action":"group_created","group_id":"group_","members":['
+    b'{"action":"disconnect","message":" left the chat"}'
+    b'{"action":"who","users":['
+    b'{"action":"exchange","message":"","timestamp":" AM PM'
+    b'{"action":"incoming","from":"","message":"","timestamp":"'
+)
+
+def is_compressed(payload):
+    """True if a frame payload was produced by StreamCompressor"""
+    return len(payload) > 0 and payload[0] == COMPRESSED_MARKER
+
+class StreamCompressor:
+    """Outbound half of a connection's deflate stream"""
+
+    def __init__(self, threshold=COMPRESS_THRESHOLD, level=COMPRESS_LEVEL):
+        """
+        Args:
+            threshold: payloads shorter than this are sent uncompressed
+            level: zlib compression level
+        """
+        self.threshold = threshold
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                           zdict=PRESET_DICTIONARY)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, payload):
+        """
+        Compress one frame payload, keeping the stream context
+
+        Frames must go out in the order they were compressed.
+
+        Args:
+            payload: bytes to send
+
+        Returns:
+            bytes - marker plus deflate data, or payload unchanged if small
+        """
+        if len(payload) < self.threshold:
+            return payload
+
+        body = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_in += len(payload)
+        self.bytes_out += len(body) + 1
+        return bytes((COMPRESSED_MARKER,)) + body
+
+    def ratio(self):
+        """Compressed size as a fraction of the original (1.0 if unused)"""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+class StreamDecompressor:
+    """Inbound half of a connection's deflate stream"""
+
+    def __init__(self, max_size=MAX_FRAME_SIZE):
+        """
+        Args:
+            max_size: largest inflated payload accepted
+        """
+        self.max_size = max_size
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+
+    def decompress(self, payload):
+        """
+        Inflate one frame payload; uncompressed payloads pass through
+
+        Args:
+            payload: frame payload as received
+
+        Returns:
+            bytes - the original payload
+
+        Raises:
+            ValueError: on corrupt data or if it inflates past max_size
+        """
+        if not is_compressed(payload):
+            return payload
+
+        try:
+            data = self.decompressor.decompress(memoryview(payload)[1:], self.max_size)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt compressed frame: {e}")
+        if self.decompressor.unconsumed_tail:
+            raise ValueError("Compressed frame inflates past the size limit")
+        return data
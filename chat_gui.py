@@ -2,10 +2,16 @@
 chat_gui.py - COMPLETE VERSION WITH OPTIMIZED TRACKPAD SCROLLING
 Optimized for Mac trackpad - smooth scrolling already works!
 """
+from collections import OrderedDict, deque
 from datetime import datetime
+import functools
 import tkinter as tk
 from tkinter import messagebox, simpledialog, font
 import sys
+import time
+import chat_codec
+from chat_scrollback import Scrollback
+from chat_search import SearchIndex, SEARCH_LIMIT, SENDER_PREFIX
 
 # --- IMPORTS FOR FEATURES ---
 try:
@@ -38,6 +44,29 @@ COLORS = {
     'neutral': '#8E8E93'    # Gray
 }
 
+# Own messages whose receipt line is still kept up to date
+MAX_RECEIPTS = 200
+
+# Live rows of the transcript, and how many items scrolling to one end of
+# them pages in (see Transcript)
+TRANSCRIPT_ROWS = 60
+TRANSCRIPT_PAGE = 20
+
+# Shown on incoming messages until their sentiment is scored
+NEUTRAL_SENTIMENT = {'polarity': 0.0, 'color': 'black', 'label': 'neutral'}
+
+SENTIMENT_EMOJI = {
+    'positive': '😊',
+    'negative': '😞',
+    'neutral': '😐'
+}
+
+# Events from the receive thread are handled every FRAME_INTERVAL ms, for
+# at most FRAME_BUDGET seconds per frame, so a burst never freezes the UI
+FRAME_INTERVAL = 16
+FRAME_BUDGET = 0.03
+
+@functools.lru_cache(maxsize=None)
 def get_font(size, weight="normal"):
     families = font.families()
     for f in ["SF Pro Display", "SF Pro Text", "Helvetica Neue", "Segoe UI", "Arial"]:
@@ -93,6 +122,307 @@ class RoundedFrame(tk.Canvas):
         self.create_text(self.width/2, self.height/2, text=text, fill=color, 
                         font=get_font(size, weight), tags="text")
 
+# --- TRANSCRIPT ---
+class TranscriptItem:
+    """One row of the transcript: a chat message, an image or a system line"""
+    
+    __slots__ = ('kind', 'text', 'is_mine', 'timestamp', 'sender', 'sentiment',
+                 'image', 'receipt', 'bubble')
+    
+    def __init__(self, kind, text='', is_mine=False, timestamp=None, sender=None,
+                 sentiment=None, image=None):
+        self.kind = kind  # 'message', 'image' or 'system'
+        self.text = text
+        self.is_mine = is_mine
+        self.timestamp = timestamp
+        self.sender = sender
+        self.sentiment = sentiment
+        self.image = image  # PhotoImage of an image row
+        self.receipt = None  # Sent / Delivered / Seen by ... under our own messages
+        self.bubble = None  # Bubble showing the item, None while off screen
+    
+    def to_record(self):
+        """The item as a list for the scroll-back spill file; images become a line"""
+        if self.kind == 'image':
+            return ['system', f"[Image from {self.sender}]", False, None, None, None, None]
+        return [self.kind, self.text, self.is_mine, self.timestamp, self.sender,
+                self.sentiment, self.receipt]
+    
+    @classmethod
+    def from_record(cls, record):
+        """An item read back from the spill file"""
+        kind, text, is_mine, timestamp, sender, sentiment, receipt = record
+        item = cls(kind, text, is_mine, timestamp, sender, sentiment)
+        item.receipt = receipt
+        return item
+    
+    def info(self):
+        """The small line under the bubble: sender, time, sentiment"""
+        parts = []
+        if self.sender and not self.is_mine:
+            parts.append(self.sender)
+        if self.timestamp:
+            parts.append(self.timestamp)
+        if self.sentiment and not self.is_mine:
+            emoji = SENTIMENT_EMOJI.get(self.sentiment['label'], '')
+            if emoji:
+                parts.append(emoji)
+        return " • ".join(parts)
+
+class Bubble:
+    """The widgets of one transcript row, reused for whichever item it shows"""
+    
+    def __init__(self, parent):
+        self.wrapper = tk.Frame(parent, bg=COLORS['bg'])
+        self.inner = tk.Frame(self.wrapper, bg=COLORS['bg'])
+        self.inner.pack()
+        self.label = tk.Label(self.inner, fg='white', justify=tk.LEFT)
+        self.label.pack()
+        self.info = tk.Label(self.inner, font=get_font(9), bg=COLORS['bg'], fg=COLORS['text_sec'])
+        self.receipt = tk.Label(self.inner, font=get_font(9), bg=COLORS['bg'], fg=COLORS['text_sec'])
+        self.item = None
+    
+    def show(self, item):
+        """Display an item in this row's widgets"""
+        if self.item is not None and self.item.bubble is self:
+            self.item.bubble = None
+        self.item = item
+        item.bubble = self
+        
+        if item.kind == 'system':
+            anchor = 'center'
+            self.wrapper.pack_configure(padx=0, pady=10)
+            self.inner.pack_configure(side=tk.TOP)
+            self.label.config(text=item.text, image='', font=get_font(10, "bold"),
+                              bg=COLORS['bg'], fg=COLORS['text_sec'], padx=0, pady=0,
+                              bd=0, wraplength=600)
+        else:
+            anchor = 'e' if item.is_mine else 'w'
+            if item.is_mine:
+                bg_col = COLORS['bubble_mine']
+            elif item.sentiment:
+                bg_col = COLORS.get(item.sentiment['label'], COLORS['bubble_theirs'])
+            else:
+                bg_col = COLORS['bubble_theirs']
+            self.inner.pack_configure(side=tk.RIGHT if item.is_mine else tk.LEFT)
+            if item.kind == 'image':
+                self.wrapper.pack_configure(padx=20, pady=8)
+                self.label.config(text='', image=item.image, bg=bg_col, padx=0, pady=0, bd=4)
+            else:
+                self.wrapper.pack_configure(padx=20, pady=4)
+                self.label.config(text=item.text, image='', font=get_font(13), bg=bg_col,
+                                  fg='white', padx=16, pady=10, bd=0, wraplength=450)
+        self.label.pack_configure(anchor=anchor)
+        
+        info = item.info() if item.kind != 'system' else ''
+        if info:
+            self.info.config(text=info)
+            self.info.pack(anchor=anchor, pady=(2, 0), after=self.label)
+        else:
+            self.info.pack_forget()
+        self.show_receipt()
+    
+    def show_receipt(self):
+        """Refresh the receipt line from the item"""
+        if self.item.receipt:
+            self.receipt.config(text=self.item.receipt)
+            self.receipt.pack(anchor='e')
+        else:
+            self.receipt.pack_forget()
+    
+    def release(self):
+        """Stop showing the item, before the row is put aside"""
+        if self.item is not None and self.item.bubble is self:
+            self.item.bubble = None
+        self.item = None
+
+class Transcript:
+    """
+    The chat transcript: every item in a model, a window of them on screen
+    
+    The model is a Scrollback, so only its newer items stay in memory and
+    older ones are read back from disk when scrolling reaches them.
+    
+    Only up to `rows` consecutive items have widgets, packed top to bottom
+    in `frame`. The rows are recycled: a new message at the bottom reuses
+    the top row once the window is full, and when the view is scrolled to
+    either end of the window, `page` more items are shown on that side
+    by moving the window and showing other items in the same rows. Widget
+    count and layout cost stay the same however long the chat gets.
+    
+    An item read back from disk is a new object, so items that may still
+    change (receipts, sentiment) are tracked by key and index instead of
+    being held on to: see track() and update().
+    """
+    
+    def __init__(self, canvas, frame, rows=TRANSCRIPT_ROWS, page=TRANSCRIPT_PAGE):
+        """
+        Args:
+            canvas: Canvas that scrolls `frame`
+            frame: Frame the rows are packed into
+            rows: most items shown at once
+            page: items paged in when the view reaches an end of the window
+        """
+        self.canvas = canvas
+        self.frame = frame
+        self.rows = rows
+        self.page_size = page
+        self.items = Scrollback(encode=TranscriptItem.to_record,
+                                decode=TranscriptItem.from_record)
+        self.bubbles = []  # packed rows, top to bottom
+        self.spare = []  # unpacked rows ready for reuse
+        self.start = 0  # index of the item in bubbles[0]
+        self.tracked = {}  # key -> index of an item updates may still arrive for
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def end(self):
+        """Index just past the last item on screen"""
+        return self.start + len(self.bubbles)
+    
+    def add_row(self):
+        """Pack a row below the others"""
+        bubble = self.spare.pop() if self.spare else Bubble(self.frame)
+        bubble.wrapper.pack(fill=tk.X)
+        self.bubbles.append(bubble)
+        return bubble
+    
+    def render(self, start):
+        """Show the window of items beginning at `start` (clamped)"""
+        start = max(0, min(start, len(self.items) - self.rows))
+        count = min(self.rows, len(self.items) - start)
+        while len(self.bubbles) > count:
+            bubble = self.bubbles.pop()
+            bubble.wrapper.pack_forget()
+            bubble.release()
+            self.spare.append(bubble)
+        while len(self.bubbles) < count:
+            self.add_row()
+        self.start = start
+        for offset, bubble in enumerate(self.bubbles):
+            bubble.show(self.items[start + offset])
+    
+    def append(self, item):
+        """Add an item at the bottom; the window moves down to show it"""
+        self.items.append(item)
+        if self.end() < len(self.items) - 1:
+            self.render(len(self.items))  # Scrolled away: jump to the newest
+            return
+        if len(self.bubbles) < self.rows:
+            bubble = self.add_row()
+        else:
+            # Recycle the top row as the new bottom one
+            bubble = self.bubbles.pop(0)
+            bubble.wrapper.pack_forget()
+            bubble.release()
+            self.start += 1
+            bubble.wrapper.pack(fill=tk.X)
+            self.bubbles.append(bubble)
+        bubble.show(item)
+    
+    def insert(self, index, items):
+        """Add items before items[index], leaving the rows on screen where they are"""
+        self.items.insert_many(index, items)
+        for key, at in self.tracked.items():
+            if at >= index:
+                self.tracked[key] = at + len(items)
+        if not self.bubbles:
+            self.render(len(self.items))
+        elif index <= self.start:
+            self.start += len(items)
+        elif index < self.end():
+            self.render(self.start)
+    
+    def track(self, key, index=None):
+        """
+        Remember where an item is, for update() to find it later
+        
+        Args:
+            key: any hashable the caller will know the item by
+            index: the item's index (default: the last item)
+        """
+        self.tracked[key] = len(self.items) - 1 if index is None else index
+    
+    def untrack(self, key):
+        """Forget a tracked item once no more updates will come for it"""
+        self.tracked.pop(key, None)
+    
+    def update(self, key, **changes):
+        """
+        Change attributes of a tracked item and redraw it if it is on screen
+        
+        The item is looked up where it is now, read back from disk if it
+        was spilled, and stored again so the change survives the next
+        spill.
+        
+        Returns:
+            False if nothing is tracked under key
+        """
+        index = self.tracked.get(key)
+        if index is None:
+            return False
+        item = self.items[index]
+        for name, value in changes.items():
+            setattr(item, name, value)
+        self.items[index] = item
+        if self.start <= index < self.end():
+            self.bubbles[index - self.start].show(item)
+        return True
+    
+    def page(self):
+        """
+        Move the window when the view is at one of its ends
+        
+        The item that was at that edge stays where it was on screen, so
+        scrolling simply carries on into the items paged in.
+        """
+        if not self.bubbles:
+            return
+        top, bottom = self.canvas.yview()
+        if top <= 0 and self.start > 0:
+            edge = self.items[self.start]
+            self.render(self.start - self.page_size)
+            self.scroll_to(edge, top=True)
+        elif bottom >= 1 and self.end() < len(self.items):
+            edge = self.items[self.end() - 1]
+            self.render(self.start + self.page_size)
+            self.scroll_to(edge, top=False)
+    
+    def scroll_to(self, item, top):
+        """Scroll so an on-screen item is at the top (or bottom) of the view"""
+        self.canvas.update_idletasks()
+        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+        height = self.frame.winfo_height()
+        if item.bubble is None or height <= 0:
+            return
+        wrapper = item.bubble.wrapper
+        y = wrapper.winfo_y()
+        if not top:
+            y += wrapper.winfo_height() - self.canvas.winfo_height()
+        self.canvas.yview_moveto(max(0, y) / height)
+
+class GuiEvents:
+    """
+    Calls on the GUI made from other threads, run later on the Tk thread
+    
+    Stands in for the ChatGUI: gui_events.handle_incoming_message(...)
+    only appends the call to a deque (append and popleft are atomic, so
+    no lock is needed); ChatGUI.drain_events runs it.
+    """
+    
+    def __init__(self, gui):
+        self.gui = gui
+        self.queue = deque()  # (bound method, args)
+    
+    def __getattr__(self, name):
+        method = getattr(self.gui, name)
+        queue = self.queue
+        def post(*args):
+            queue.append((method, args))
+        self.__dict__[name] = post  # Looked up once per method
+        return post
+
 # --- MOCKS ---
 try:
     from game_client_multiplayer import TetrisGame
@@ -112,6 +442,8 @@ except ImportError:
         def __init__(self, *args): pass
         def analyze_sentiment(self, text): 
             return {'color': 'neutral', 'label': 'neutral', 'polarity': 0.0}
+        def analyze_sentiment_async(self, text, callback):
+            return self.analyze_sentiment(text)
 
 # --- LOGIN WINDOW ---
 class LoginWindow:
@@ -181,9 +513,34 @@ class ChatGUI:
         self.peer_name = None
         self.game_window = None
         self.messages = []
-        self.chat_history_text = []
+        # "[sender]: text" lines for /summary, /keywords and search; only
+        # the newest stay in memory
+        self.chat_history_text = Scrollback()
+        self.search_index = SearchIndex()  # the same lines, by word and sender
         self.message_widgets = {}
         
+        # Server-side history paging for the current chat
+        self.history_loaded = False
+        self.history_cursor = None  # 'before' for the next page up, None at the start
+        self.first_live_seq = None  # seq of the first message shown live in this chat
+        self.history_start = 0  # transcript index the next page up goes to
+        self.history_text_start = 0  # its line in chat_history_text
+        
+        # Receipts: seq -> our own message, newest last
+        self.next_ref = 0
+        self.pending_sent = OrderedDict()  # refs of our messages waiting for their seq, oldest first
+        self.own_messages = OrderedDict()  # seq -> [ref it is tracked under, receipt shown]
+        self.next_sentiment_key = 0  # incoming messages waiting for a score are tracked by it
+        self.receipt_positions = {}  # member -> [delivered seq, seen seq]
+        self.unseen = []  # msg ids shown while the window was in the background
+        self.seen_callback = None  # set by the client: called with each msg id seen
+        self.request_callback = None  # set by the client: encodes and sends a request dict
+        
+        # Calls from the receive thread, drained once per frame
+        self.events = GuiEvents(self)
+        self.draining = False  # inside drain_events: scroll once at the end
+        self.scroll_due = False
+        
         # Initialize feature manager
         try:
             from chat_bot_client import ChatBotClient
@@ -220,6 +577,8 @@ class ChatGUI:
         
         self._build_ui()
         self._setup_trackpad_scrolling()  # Setup smooth scrolling
+        self.window.bind('<FocusIn>', self._on_focus_in)
+        self.window.after(FRAME_INTERVAL, self.drain_events)
     
     def _build_ui(self):
         # Header
@@ -251,8 +610,8 @@ class ChatGUI:
         msg_area.pack(fill=tk.BOTH, expand=True)
         
         self.canvas = tk.Canvas(msg_area, bg=COLORS['bg'], highlightthickness=0)
-        scrollbar = tk.Scrollbar(msg_area, orient="vertical", 
-                                command=self.canvas.yview, bg=COLORS['bg'])
+        self.scrollbar = scrollbar = tk.Scrollbar(msg_area, orient="vertical", 
+                                                  command=self.canvas.yview, bg=COLORS['bg'])
         self.scroll_frame = tk.Frame(self.canvas, bg=COLORS['bg'])
         
         self.scroll_frame.bind("<Configure>", 
@@ -262,7 +621,9 @@ class ChatGUI:
                                                        window=self.scroll_frame, 
                                                        anchor="nw")
         
-        self.canvas.configure(yscrollcommand=scrollbar.set)
+        self.canvas.configure(yscrollcommand=self._on_view_moved)
+        self.transcript = Transcript(self.canvas, self.scroll_frame)
+        self.paging_due = False
         self.canvas.bind('<Configure>', 
                         lambda e: self.canvas.itemconfig(self.canvas_window, 
                                                          width=e.width))
@@ -340,6 +701,7 @@ class ChatGUI:
                                "• Connect to chat\n" +
                                "• @bot <question> - Ask AI\n" +
                                "• /summary - Analyze chat\n" +
+                               "• /history - Load earlier messages\n" +
                                "• /keywords - Extract keywords\n" +
                                "• /aipic: <prompt> - Generate image\n" +
                                "• 🔍 Search - Find messages\n" +
@@ -364,8 +726,8 @@ class ChatGUI:
         self.scroll_frame.bind('<MouseWheel>', self._on_scroll)
         
         # For Linux (if needed)
-        self.canvas.bind('<Button-4>', lambda e: self.canvas.yview_scroll(-1, "units"))
-        self.canvas.bind('<Button-5>', lambda e: self.canvas.yview_scroll(1, "units"))
+        self.canvas.bind('<Button-4>', lambda e: self._scroll_units(-1))
+        self.canvas.bind('<Button-5>', lambda e: self._scroll_units(1))
         
         # CRITICAL: Make sure canvas can receive focus
         self.canvas.focus_set()
@@ -378,11 +740,27 @@ class ChatGUI:
         # On Mac, event.delta is the scroll amount
         # Positive = scroll up, Negative = scroll down
         if event.delta > 0:
-            self.canvas.yview_scroll(-1, "units")
+            self._scroll_units(-1)
         else:
-            self.canvas.yview_scroll(1, "units")
+            self._scroll_units(1)
         
         return "break"  # Prevent event propagation
+    
+    def _scroll_units(self, units):
+        """Scroll the transcript, paging in items at either end"""
+        self.canvas.yview_scroll(units, "units")
+        self.transcript.page()
+    
+    def _on_view_moved(self, first, last):
+        """yscrollcommand: update the scrollbar, and page once the view hits an end"""
+        self.scrollbar.set(first, last)
+        if (float(first) <= 0 or float(last) >= 1) and not self.paging_due:
+            self.paging_due = True
+            self.window.after_idle(self._page_transcript)
+    
+    def _page_transcript(self):
+        self.paging_due = False
+        self.transcript.page()
 
     def _draw_chat_input_bg(self, event):
         w, h = event.width, event.height
@@ -401,97 +779,72 @@ class ChatGUI:
     
     def add_message_bubble(self, message, is_mine=True, timestamp=None, 
                           sender_name=None, sentiment=None):
-        """Add message bubble with sentiment analysis"""
-        wrapper = tk.Frame(self.scroll_frame, bg=COLORS['bg'])
-        wrapper.pack(fill=tk.X, padx=20, pady=4)
-        
-        if sentiment and not is_mine:
-            sentiment_color = COLORS.get(sentiment['label'], COLORS['bubble_theirs'])
-            bg_col = sentiment_color
-        else:
-            bg_col = COLORS['bubble_mine'] if is_mine else COLORS['bubble_theirs']
+        """
+        Add message bubble with sentiment analysis
         
-        if is_mine:
-            inner = tk.Frame(wrapper, bg=COLORS['bg'])
-            inner.pack(side=tk.RIGHT)
-            justify = tk.LEFT
-            anchor = 'e'
-        else:
-            inner = tk.Frame(wrapper, bg=COLORS['bg'])
-            inner.pack(side=tk.LEFT)
-            justify = tk.LEFT
-            anchor = 'w'
-            
-        bubble = tk.Label(inner, text=message, font=get_font(13), 
-                         bg=bg_col, fg='white',
-                         padx=16, pady=10, wraplength=450, justify=justify)
-        bubble.pack(anchor=anchor)
-        
-        info_parts = []
-        if sender_name and not is_mine:
-            info_parts.append(sender_name)
-        if timestamp:
-            info_parts.append(timestamp)
-        if sentiment and not is_mine:
-            emoji_map = {
-                'positive': '😊',
-                'negative': '😞',
-                'neutral': '😐'
-            }
-            sentiment_emoji = emoji_map.get(sentiment['label'], '')
-            if sentiment_emoji:
-                info_parts.append(sentiment_emoji)
-        
-        if info_parts:
-            info_text = " • ".join(info_parts)
-            tk.Label(inner, text=info_text, font=get_font(9), 
-                    bg=COLORS['bg'], fg=COLORS['text_sec']).pack(anchor=anchor, pady=(2,0))
+        Returns:
+            its TranscriptItem
+        """
+        item = TranscriptItem('message', message, is_mine, timestamp, sender_name, sentiment)
+        self.transcript.append(item)
         
         real_sender = "Me" if is_mine else (sender_name if sender_name else "Peer")
         if not message.startswith("/") and not message.startswith("@bot"):
-             self.chat_history_text.append(f"[{real_sender}]: {message}")
+             line = f"[{real_sender}]: {message}"
+             self.chat_history_text.append(line)
+             self.search_index.add(real_sender, message, line)
         
-        self.canvas.update_idletasks()
-        self.canvas.yview_moveto(1.0)
+        self.scroll_to_bottom()
+        return item
 
     def add_image_bubble(self, tk_image, is_mine=True, timestamp=None, sender="AI"):
         """Add image bubble"""
         if not PILLOW_AVAILABLE:
             self.add_system_message("Image display requires Pillow")
             return
-            
-        wrapper = tk.Frame(self.scroll_frame, bg=COLORS['bg'])
-        wrapper.pack(fill=tk.X, padx=20, pady=8)
         
-        if is_mine:
-            inner = tk.Frame(wrapper, bg=COLORS['bg'])
-            inner.pack(side=tk.RIGHT)
-            anchor = 'e'
-        else:
-            inner = tk.Frame(wrapper, bg=COLORS['bg'])
-            inner.pack(side=tk.LEFT)
-            anchor = 'w'
-            
-        bg_col = COLORS['bubble_mine'] if is_mine else COLORS['bubble_theirs']
-        img_label = tk.Label(inner, image=tk_image, bg=bg_col, bd=4, relief=tk.FLAT)
-        img_label.image = tk_image
-        img_label.pack(anchor=anchor)
-        
-        if timestamp:
-            tk.Label(inner, text=f"{sender} • {timestamp}", font=get_font(9), 
-                    bg=COLORS['bg'], fg=COLORS['text_sec']).pack(anchor=anchor, pady=(2,0))
-
-        self.canvas.update_idletasks()
-        self.canvas.yview_moveto(1.0)
+        self.transcript.append(TranscriptItem('image', '', is_mine, timestamp, sender,
+                                              image=tk_image))
+        self.scroll_to_bottom()
 
     def add_system_message(self, message, timestamp=None):
         """Add system message"""
-        f = tk.Frame(self.scroll_frame, bg=COLORS['bg'])
-        f.pack(fill=tk.X, pady=10)
-        tk.Label(f, text=message, font=get_font(10, "bold"), 
-                bg=COLORS['bg'], fg=COLORS['text_sec'], 
-                wraplength=600, justify=tk.LEFT).pack()
+        self.transcript.append(TranscriptItem('system', message))
+        self.scroll_to_bottom()
+    
+    def scroll_to_bottom(self):
+        """Show the newest message; only once per frame while events are drained"""
+        if self.draining:
+            self.scroll_due = True
+            return
+        self.canvas.update_idletasks()
         self.canvas.yview_moveto(1.0)
+    
+    def drain_events(self):
+        """
+        Run the calls other threads queued on self.events
+        
+        Runs every FRAME_INTERVAL ms on the Tk thread and stops after
+        FRAME_BUDGET seconds, leaving the rest for the next frame. Layout
+        and scrolling happen once per frame instead of once per message.
+        """
+        queue = self.events.queue
+        if queue:
+            deadline = time.perf_counter() + FRAME_BUDGET
+            self.draining = True
+            try:
+                while queue and time.perf_counter() < deadline:
+                    method, args = queue.popleft()
+                    try:
+                        method(*args)
+                    except Exception as e:
+                        print(f"[GUI] Event {method.__name__} failed: {e}")
+            finally:
+                self.draining = False
+            if self.scroll_due:
+                self.scroll_due = False
+                self.scroll_to_bottom()
+        self.window.after(FRAME_INTERVAL, self.drain_events)
 
     # ============================================
     # MESSAGE SENDING
@@ -525,6 +878,13 @@ class ChatGUI:
                 self.add_system_message(f"Error: {e}")
             return
 
+        if msg == "/history":
+            if self.history_loaded and self.history_cursor is None:
+                self.add_system_message("No earlier messages.")
+            else:
+                self.request_history(self.history_cursor)
+            return
+
         if msg.startswith("/aipic:"):
             if not self.image_client:
                 self.add_system_message("Image generation not available")
@@ -569,7 +929,14 @@ class ChatGUI:
             return
 
         self.add_message_bubble(msg, True, ts)
-        self.send_callback(msg)
+        self.next_ref += 1
+        self.transcript.track(self.next_ref)
+        self.pending_sent[self.next_ref] = None
+        while len(self.pending_sent) > MAX_RECEIPTS:
+            # Never numbered (e.g. sent outside a chat)
+            old_ref, _ = self.pending_sent.popitem(last=False)
+            self.transcript.untrack(old_ref)
+        self.send_callback(msg, self.next_ref)
 
     # ============================================
     # SEARCH, EMOJI, CONNECTIONS
@@ -578,21 +945,20 @@ class ChatGUI:
     def show_search(self):
         """Search messages"""
         query = simpledialog.askstring("Search Messages", 
-                                      "Enter search terms:", parent=self.window)
+                                      "Enter search terms (words match by prefix, "
+                                      f"{SENDER_PREFIX}name for a sender):", parent=self.window)
         if not query: return
         
-        results = []
-        query_words = query.lower().split()
-        
-        for line in self.chat_history_text:
-            if all(word in line.lower() for word in query_words):
-                results.append(line)
+        results, more = self.search_index.search(query, SEARCH_LIMIT)
         
         if results:
-            result_msg = f"Found {len(results)} message(s):\n\n"
-            result_msg += "\n".join(results[:15])
-            if len(results) > 15:
-                result_msg += f"\n\n... and {len(results) - 15} more"
+            if more:
+                result_msg = f"Newest {len(results)} matching messages:\n\n"
+            else:
+                result_msg = f"Found {len(results)} message(s):\n\n"
+            result_msg += "\n".join(results)
+            if more:
+                result_msg += "\n\n... and more - add words to narrow it down"
             messagebox.showinfo("Search Results", result_msg)
         else:
             messagebox.showinfo("Search Results", f"No messages found for: '{query}'")
@@ -678,12 +1044,10 @@ class ChatGUI:
             return
         
         # Send create_group command
-        import json
-        create_msg = json.dumps({
+        self.send_request({
             'action': 'create_group',
             'members': members
         })
-        self.send_callback(create_msg)
         
         self.add_system_message(
             f"Creating group with: {', '.join(members)}...",
@@ -740,10 +1104,8 @@ class ChatGUI:
     def on_who(self):
         try:
             self.add_system_message("Checking users...")
-            import json
-            who_msg = json.dumps({'action': 'who'})
-            self.send_callback(who_msg)
-            print(f"[DEBUG] Sent who request: {who_msg}")
+            self.send_request({'action': 'who'})
+            print(f"[DEBUG] Sent who request")
         except Exception as e:
             print(f"[DEBUG] Error in on_who: {e}")
             import traceback
@@ -755,6 +1117,9 @@ class ChatGUI:
         if messagebox.askokcancel("Quit", "Quit Messages?"):
             self.send_callback("q")
             self.window.destroy()
+            self.transcript.items.close()
+            self.chat_history_text.close()
+            self.search_index.close()
 
     # ============================================
     # INCOMING HANDLERS
@@ -801,24 +1166,174 @@ class ChatGUI:
                         messagebox.showerror("Game Error", f"Failed to join: {e}")
             return
         
-        # Analyze sentiment (works for all recipients)
-        sentiment = self.feature_manager.analyze_sentiment(message)
-        
-        # DEBUG: Print sentiment analysis result
-        client_name = getattr(self, 'client_name', 'Unknown')
-        print(f"[SENTIMENT {client_name}] '{message}' from {sender} → {sentiment}")
-        
         # Set timestamp if not provided
         if not timestamp: 
             timestamp = datetime.now().strftime("%I:%M %p")
         
-        # Display message with sentiment colors
-        self.add_message_bubble(message, False, timestamp, sender, sentiment)
+        # Analyze sentiment (works for all recipients) without waiting for
+        # it: a neutral bubble now, recolored once the score arrives
+        key = ('sentiment', self.next_sentiment_key)
+        self.next_sentiment_key += 1
+        sentiment = self.feature_manager.analyze_sentiment_async(
+            message, lambda result: self.events.apply_sentiment(key, message, sender, result))
+        if sentiment is None:
+            self.add_message_bubble(message, False, timestamp, sender, dict(NEUTRAL_SENTIMENT))
+            self.transcript.track(key)
+        else:
+            self.add_message_bubble(message, False, timestamp, sender, sentiment)
+            self.apply_sentiment(key, message, sender, sentiment)
+        
+        if msg_id and self.first_live_seq is None:
+            # Shown already - the first history page must stop short of it
+            self.first_live_seq = int(msg_id.rpartition(':')[2])
+        
+        if msg_id:
+            if self.window.focus_displayof() is not None:
+                self.mark_message_as_seen(msg_id)
+            else:
+                self.unseen.append(msg_id)
 
 
+    def handle_history(self, messages, cursor):
+        """
+        Show a page of earlier messages from the server
+        
+        The first page after joining a chat is added below what is on
+        screen, without the messages that already arrived live; every
+        later page (/history) goes above the oldest message shown so far.
+        
+        Args:
+            messages: message dicts, oldest first
+            cursor: 'before' for the next page up, None at the start of the chat
+        """
+        first_page = not self.history_loaded
+        self.history_loaded = True
+        self.history_cursor = cursor
+        messages = [m for m in messages if not m.get('message', '').startswith("GAME_")]
+        if first_page and self.first_live_seq is not None:
+            messages = [m for m in messages if m.get('seq', 0) < self.first_live_seq]
+        if not messages:
+            if not first_page:
+                self.add_system_message("No earlier messages.")
+            return
+        
+        if first_page:
+            self.history_text_start = len(self.chat_history_text)
+            self.add_system_message("Earlier messages (/history for more)")
+            self.history_start = len(self.transcript)
+            for m in messages:
+                sender = m.get('from', 'Unknown')
+                self.add_message_bubble(m.get('message', ''), sender == self.client_name,
+                                        m.get('timestamp') or None, sender)
+            return
+        
+        items = []
+        lines = []
+        indexed = []
+        for m in messages:
+            sender = m.get('from', 'Unknown')
+            is_mine = sender == self.client_name
+            items.append(TranscriptItem('message', m.get('message', ''), is_mine,
+                                        m.get('timestamp') or None, sender))
+            real_sender = 'Me' if is_mine else sender
+            lines.append(f"[{real_sender}]: {m.get('message', '')}")
+            indexed.append((real_sender, m.get('message', ''), lines[-1]))
+        # Older than anything indexed, so they rank below it in searches
+        self.search_index.add_older(indexed)
+        # Above the oldest message shown so far; scroll up to see them
+        self.transcript.insert(self.history_start, items)
+        self.chat_history_text.insert_many(self.history_text_start, lines)
+    
+    def apply_sentiment(self, key, message, sender, sentiment):
+        """Recolor an incoming message once its sentiment is known"""
+        # DEBUG: Print sentiment analysis result
+        client_name = getattr(self, 'client_name', 'Unknown')
+        print(f"[SENTIMENT {client_name}] '{message}' from {sender} → {sentiment}")
+        self.transcript.update(key, sentiment=sentiment)
+        self.transcript.untrack(key)
+    
+    def request_history(self, before=None):
+        """Ask the server for earlier messages of the current chat"""
+        request = {'action': 'history'}
+        if before is not None:
+            request['before'] = before
+        self.send_request(request)
+    
+    def send_request(self, data):
+        """
+        Send a request dict, encoded the way the client's state machine
+        encodes its own (binary wire format once negotiated)
+        
+        Args:
+            data: message dict with an 'action'
+        """
+        if self.request_callback:
+            self.request_callback(data)
+        else:
+            # Not started by ChatClient (the demo at the bottom of this file)
+            self.send_callback(chat_codec.dumps(data).decode('utf-8'))
+    
+    def reset_history(self):
+        """Forget per-chat paging and receipt state when joining another chat"""
+        self.history_loaded = False
+        self.history_cursor = None
+        self.first_live_seq = None
+        for ref, _ in self.own_messages.values():
+            self.transcript.untrack(ref)
+        self.own_messages.clear()
+        self.receipt_positions.clear()
+    
+    def handle_sent(self, ref, seq):
+        """
+        Attach a receipt line to our own bubble once the server numbered it
+        
+        Args:
+            ref: number we sent the message with
+            seq: the message's seq in the chat
+        """
+        if ref not in self.pending_sent:
+            return
+        del self.pending_sent[ref]
+        if not isinstance(seq, int):
+            self.transcript.untrack(ref)
+            return
+        self.own_messages[seq] = [ref, None]
+        while len(self.own_messages) > MAX_RECEIPTS:
+            _, (old_ref, _) = self.own_messages.popitem(last=False)
+            self.transcript.untrack(old_ref)
+        self.update_receipt(seq)
+    
+    def handle_receipts(self, positions):
+        """
+        Refresh receipt lines after members acknowledged messages
+        
+        Args:
+            positions: {member: [delivered seq, seen seq]} that moved
+        """
+        self.receipt_positions.update(positions)
+        for seq in self.own_messages:
+            self.update_receipt(seq)
+    
+    def update_receipt(self, seq):
+        """Show how far one of our messages got: Sent, Delivered or Seen by ..."""
+        seen_by = [name for name, (_, seen) in self.receipt_positions.items() if seen >= seq]
+        if seen_by:
+            text = f"Seen by {', '.join(seen_by)}"
+        elif any(delivered >= seq for delivered, _ in self.receipt_positions.values()):
+            text = "Delivered"
+        else:
+            text = "Sent"
+        shown = self.own_messages[seq]
+        if shown[1] != text:
+            shown[1] = text
+            self.transcript.update(shown[0], receipt=text)
+    
     def handle_system_message(self, message):
         """Handle system messages"""
         self.add_system_message(message)
+        if "connected to" in message.lower():
+            self.reset_history()
+            self.request_history()
         if "connected to" in message.lower() and self.peer_name:
             self.contact_label.config(text=self.peer_name)
             self.status_label.config(text="Active Now")
@@ -857,6 +1372,10 @@ class ChatGUI:
         
         # Enable game button
         self.game_btn.config(state=tk.NORMAL)
+        
+        # Catch up on what the group said before we joined
+        self.reset_history()
+        self.request_history()
 
     def handle_user_list(self, users):
         """Handle user list"""
@@ -878,7 +1397,15 @@ class ChatGUI:
             self.status_label.config(text=status_text)
     
     def mark_message_as_seen(self, msg_id):
-        pass
+        """Report a message as read; acknowledged to the sender in the next batch"""
+        if self.seen_callback:
+            self.seen_callback(msg_id)
+    
+    def _on_focus_in(self, event):
+        """Messages that arrived in the background count as seen once we are back"""
+        unseen, self.unseen = self.unseen, []
+        for msg_id in unseen:
+            self.mark_message_as_seen(msg_id)
         
     def run(self):
         self.window.mainloop()
@@ -888,6 +1415,6 @@ if __name__ == "__main__":
     login = LoginWindow()
     nick = login.run()
     if nick:
-        def dummy(m): print(f"Sent: {m}")
+        def dummy(m, ref=None): print(f"Sent: {m}")
         app = ChatGUI(dummy, nick)
         app.run()
\ No newline at end of file
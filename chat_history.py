@@ -0,0 +1,150 @@
+"""
+chat_history.py - Recent message history kept in memory per group
+Every group has a fixed-size ring of its latest messages, addressed by
+the message's per-group sequence number, so "the N messages before seq
+S" is read straight out of the ring - no search and no disk access. Rings are kept
+for the most recently active groups only, which bounds the whole store;
+a group's entries are dropped outright once the group itself is gone.
+
+Pages are fetched newest-first with a cursor: a page holds the messages
+just before the cursor (oldest first), and its own cursor is the oldest
+seq it returned, to be passed back for the next page up.
+"""
+from collections import OrderedDict
+
+HISTORY_SIZE = 256  # messages remembered per group
+HISTORY_GROUPS = 1024  # groups remembered (least recently active dropped first)
+HISTORY_PAGE = 50  # default page size
+HISTORY_PAGE_MAX = 200  # largest page a client may ask for
+
+class HistoryRing:
+    """
+    The newest messages of one group, indexed by seq
+
+    A ring of `size` slots holds messages from the last `size` seqs.
+    Seqs may skip (a restarted server numbers on from its log), so each
+    slot is checked against the seq it is read for.
+    """
+
+    __slots__ = ('slots', 'first', 'last')
+
+    def __init__(self, size):
+        self.slots = [None] * size
+        self.first = 1  # oldest seq the ring may still hold
+        self.last = 0  # newest seq held (0 while empty)
+
+    def append(self, seq, record):
+        """Store a message, overwriting the one `size` seqs older"""
+        size = len(self.slots)
+        if not self.last:
+            self.first = seq
+        self.slots[seq % size] = record
+        self.last = max(self.last, seq)
+        self.first = max(self.first, self.last - size + 1)
+
+    def page(self, before, limit):
+        """
+        Up to `limit` of the newest messages held with seq < before
+
+        Returns:
+            list of records, oldest first
+        """
+        size = len(self.slots)
+        records = []
+        seq = min(before, self.last + 1) - 1
+        while seq >= self.first and len(records) < limit:
+            record = self.slots[seq % size]
+            if record is not None and record['seq'] == seq:
+                records.append(record)
+            seq -= 1
+        records.reverse()
+        return records
+
+class HistoryStore:
+    """Bounded per-group rings of recent messages"""
+
+    def __init__(self, size=HISTORY_SIZE, max_groups=HISTORY_GROUPS, keep_seqs=True):
+        """
+        Args:
+            size: messages remembered per group
+            max_groups: groups remembered before the least active is dropped
+            keep_seqs: remember the newest seq of a group whose ring was
+                dropped, so its numbering carries on; False when the
+                durable log already knows it
+        """
+        self.size = size
+        self.max_groups = max_groups
+        self.keep_seqs = keep_seqs
+        self.rings = OrderedDict()  # group id -> HistoryRing, least recent first
+        self.dropped_seq = {}  # group id -> newest seq, for groups whose ring was dropped
+
+    def append(self, group_id, record, seq=None):
+        """
+        Remember a message
+
+        Args:
+            group_id: chat group the message belongs to
+            record: message dict; a copy with 'seq' added is kept, the
+                caller's dict is left as it is
+            seq: sequence number already assigned (e.g. by the durable
+                log), or None to number it here
+
+        Returns:
+            the message's sequence number within the group
+        """
+        if seq is None:
+            seq = self.last(group_id) + 1
+        record = dict(record, seq=seq)
+
+        ring = self.rings.get(group_id)
+        if ring is None:
+            ring = self.rings[group_id] = HistoryRing(self.size)
+            self.dropped_seq.pop(group_id, None)
+            if len(self.rings) > self.max_groups:
+                dropped_id, dropped = self.rings.popitem(last=False)
+                if self.keep_seqs:
+                    self.dropped_seq[dropped_id] = dropped.last
+        else:
+            self.rings.move_to_end(group_id)
+        ring.append(seq, record)
+        return seq
+
+    def forget(self, group_id):
+        """Drop everything kept for a group that no longer exists"""
+        self.rings.pop(group_id, None)
+        self.dropped_seq.pop(group_id, None)
+
+    def last(self, group_id):
+        """
+        Newest sequence number of a group (0 if none)
+
+        Without keep_seqs, a group whose ring was dropped reads 0 here;
+        the caller takes its numbering from the log (or the broker) then.
+        """
+        ring = self.rings.get(group_id)
+        return ring.last if ring else self.dropped_seq.get(group_id, 0)
+
+    def first(self, group_id):
+        """Oldest sequence number still held for a group (last + 1 if none)"""
+        ring = self.rings.get(group_id)
+        return ring.first if ring else self.last(group_id) + 1
+
+    def page(self, group_id, before=None, limit=HISTORY_PAGE):
+        """
+        One page of a group's recent messages
+
+        Args:
+            group_id: chat group
+            before: cursor from the previous page, or None for the newest page
+            limit: most messages returned
+
+        Returns:
+            list of records held in memory, oldest first (may be shorter
+            than limit when older messages have left the ring)
+        """
+        ring = self.rings.get(group_id)
+        if ring is None or limit <= 0:
+            return []
+        if before is None:
+            before = ring.last + 1
+        return ring.page(before, limit)
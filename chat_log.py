@@ -0,0 +1,466 @@
+"""
+chat_log.py - Durable append-only message log
+Every chat message is appended to the active segment file of a log
+directory. Segments rotate at a size limit, and each record carries its
+group and a per-group sequence number so history can be read back by
+(group id, seq) after a restart.
+
+Appends only format the record and queue it in memory; a commit thread
+writes whatever has queued up and fsyncs it in one go (group commit),
+so the exchange path never waits on the disk.
+
+Each segment keeps a sparse index - the first and last record of every
+group plus every index_interval-th one - as (group key, seq, offset)
+entries. The active segment's index lives in memory; when a segment is
+sealed its entries are sorted, written to a .index file and mmap'd, so
+a lookup is a binary search and reads scan at most index_interval
+records of the group.
+
+Record layout: !IIQQ header (payload length, crc32, group key, seq)
+followed by the JSON payload.
+"""
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+import chat_codec
+
+RECORD_HEADER = struct.Struct('!IIQQ')  # payload length, crc32, group key, seq
+INDEX_HEADER = struct.Struct('!4sII')  # magic, entry count, group names length
+INDEX_ENTRY = struct.Struct('!QQQ')  # group key, seq, offset
+INDEX_MAGIC = b'CLIX'
+
+SEGMENT_BYTES = 16 * 1024 * 1024  # rotate the active segment past this size
+INDEX_INTERVAL = 32  # index every Nth record of a group
+COMMIT_INTERVAL = 0.005  # seconds a commit waits for more appends to share its fsync
+READ_CHUNK = 64 * 1024
+
+def group_key(group_id):
+    """Fixed-size 64-bit key for a group id"""
+    return int.from_bytes(hashlib.blake2b(group_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class Segment:
+    """One segment file and its sparse index"""
+
+    __slots__ = ('number', 'path', 'index_path', 'size', 'entries', 'last',
+                 'names', 'index', 'count', 'read_fd')
+
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, f'{number:010d}.log')
+        self.index_path = os.path.join(directory, f'{number:010d}.index')
+        self.size = 0  # bytes appended (including those not written yet)
+        self.entries = {}  # key -> [(seq, offset), ...] until sealed
+        self.last = {}  # key -> (seq, offset) of the newest record
+        self.names = {}  # key -> group id
+        self.index = None  # mmap of the .index file once sealed
+        self.count = 0  # entries in the sealed index
+        self.read_fd = None
+
+    def add(self, key, seq, offset, interval):
+        """
+        Note an appended record in the sparse index
+
+        Returns:
+            True if this is the group's first record in the segment
+        """
+        entries = self.entries.get(key)
+        first = entries is None
+        if first:
+            entries = self.entries[key] = []
+        if first or seq % interval == 0:
+            entries.append((seq, offset))
+        self.last[key] = (seq, offset)
+        return first
+
+    def seal(self):
+        """Write the sorted index file and switch lookups over to its mmap"""
+        rows = []
+        for key, entries in self.entries.items():
+            rows.extend((key, seq, offset) for seq, offset in entries)
+            last = self.last[key]
+            if entries[-1] != last:
+                rows.append((key,) + last)
+        rows.sort()
+        names = chat_codec.dumps({str(key): name for key, name in self.names.items()})
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(rows), len(names)))
+            f.write(b''.join(INDEX_ENTRY.pack(*row) for row in rows))
+            f.write(names)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        self.load_index()
+
+    def load_index(self):
+        """
+        Map the sealed .index file
+
+        Returns:
+            {key: (first seq, last seq)} for every group in the segment
+        """
+        with open(self.index_path, 'rb') as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, names_length = INDEX_HEADER.unpack_from(index)
+        if magic != INDEX_MAGIC:
+            index.close()
+            raise ValueError(f"{self.index_path} is not a log index")
+        names_start = INDEX_HEADER.size + count * INDEX_ENTRY.size
+        names = chat_codec.loads(index[names_start:names_start + names_length])
+        self.names = {int(key): name for key, name in names.items()}
+
+        ranges = {}
+        for key, seq, offset in INDEX_ENTRY.iter_unpack(index[INDEX_HEADER.size:names_start]):
+            if key in ranges:
+                ranges[key] = (ranges[key][0], seq)
+            else:
+                ranges[key] = (seq, seq)
+        self.size = os.path.getsize(self.path)
+        self.count = count
+        self.index = index
+        self.entries = None
+        self.last = None
+        return ranges
+
+    def find(self, key, seq):
+        """
+        Offset to start scanning from for (key, seq)
+
+        Returns:
+            offset of the last indexed record of the group at or before
+            seq (or of its first record), None if the group is absent
+        """
+        entries = self.entries
+        if entries is not None:
+            group_entries = entries.get(key)
+            if not group_entries:
+                return None
+            i = bisect.bisect_right(group_entries, (seq, float('inf'))) - 1
+            return group_entries[max(i, 0)][1]
+
+        # Binary search the mmap'd index for the last entry <= (key, seq)
+        index, base, size = self.index, INDEX_HEADER.size, INDEX_ENTRY.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INDEX_ENTRY.unpack_from(index, base + mid * size)[:2] <= (key, seq):
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in (lo - 1, lo):
+            if 0 <= i < self.count:
+                entry_key, _, offset = INDEX_ENTRY.unpack_from(index, base + i * size)
+                if entry_key == key:
+                    return offset
+        return None
+
+    def records(self, offset, end, only=None):
+        """
+        Yield (key, seq, payload) for records in [offset, end)
+
+        Args:
+            offset: file offset of the first record
+            end: file offset to stop at
+            only: if set, skip other groups' records without checking them
+
+        Raises:
+            ValueError: on a torn or corrupt record
+        """
+        if self.read_fd is None:
+            self.read_fd = os.open(self.path, os.O_RDONLY)
+        buffer = b''
+        base = offset  # file offset of buffer[0]
+        start = 0  # next record's position in buffer
+        while base + start < end:
+            record_end = start + RECORD_HEADER.size
+            if len(buffer) >= record_end:
+                length, crc, key, seq = RECORD_HEADER.unpack_from(buffer, start)
+                record_end += length
+            if len(buffer) < record_end:
+                # Refill: keep the partial record, read the next chunk behind it
+                more = os.pread(self.read_fd, max(READ_CHUNK, record_end - len(buffer)),
+                                base + len(buffer))
+                if not more:
+                    raise ValueError(f"Torn record at {base + start} in {self.path}")
+                buffer = buffer[start:] + more
+                base += start
+                start = 0
+                continue
+            if only is not None and key != only:
+                start = record_end
+                continue
+            payload = buffer[start + RECORD_HEADER.size:record_end]
+            if zlib.crc32(payload) != crc:
+                raise ValueError(f"Corrupt record at {base + start} in {self.path}")
+            yield key, seq, payload
+            start = record_end
+
+    def close(self):
+        """Release the index mmap and read descriptor"""
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.read_fd is not None:
+            os.close(self.read_fd)
+            self.read_fd = None
+
+class MessageLog:
+    """
+    Segmented, group-committed message log with per-group sequence numbers
+
+    append() is safe to call from the server loop while the commit
+    thread runs; read() flushes anything still queued before it looks.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, index_interval=INDEX_INTERVAL,
+                 commit_interval=COMMIT_INTERVAL, fsync=True):
+        """
+        Args:
+            directory: where segment and index files live (created if missing)
+            segment_bytes: size at which the active segment is sealed
+            index_interval: index every Nth record of a group
+            commit_interval: seconds a commit waits to batch more appends
+            fsync: False to skip fsync (tests and benchmarks only)
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        self.keys = {}  # group id -> key
+        self.names = {}  # key -> group id
+        self.last_seq = {}  # key -> newest seq
+        self.group_firsts = {}  # key -> first seq of the group in each of its segments
+        self.group_segments = {}  # key -> those segments, in log order
+        self.segments = []
+        self.pending = []  # record bytes, or (sealed, next) Segment pairs, not written yet
+        self.lock = threading.Lock()  # guards the append state above
+        self.io_lock = threading.Lock()  # serializes writes to the active file
+        self.wakeup = threading.Event()
+        self.closed = False
+
+        self.recover()
+        self.write_fd = os.open(self.active.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.committer = threading.Thread(target=self.commit_loop, name='chat-log-commit',
+                                          daemon=True)
+        self.committer.start()
+
+    def recover(self):
+        """Load sealed indexes and rebuild the active segment's state by scanning it"""
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                         if name.endswith('.log') and name[:-4].isdigit())
+        if not numbers:
+            numbers = [0]
+
+        for number in numbers[:-1]:
+            segment = Segment(self.directory, number)
+            if os.path.exists(segment.index_path):
+                ranges = segment.load_index()
+            else:
+                self.scan(segment)  # Crashed while sealing - rebuild the index
+                segment.seal()
+                ranges = segment.load_index()
+            self.register(segment, ranges)
+
+        self.active = Segment(self.directory, numbers[-1])
+        self.register(self.active, self.scan(self.active))
+
+    def scan(self, segment):
+        """
+        Rebuild a segment's in-memory index from its records, cutting off a torn tail
+
+        Returns:
+            {key: (first seq, last seq)}
+        """
+        if not os.path.exists(segment.path):
+            return {}
+        end = os.path.getsize(segment.path)
+        ranges = {}
+        offset = 0
+        try:
+            for key, seq, payload in segment.records(0, end):
+                segment.add(key, seq, offset, self.index_interval)
+                if key not in segment.names:
+                    segment.names[key] = chat_codec.loads(payload)['group']
+                ranges[key] = (ranges[key][0] if key in ranges else seq, seq)
+                offset += RECORD_HEADER.size + len(payload)
+        except ValueError as e:
+            print(f"[LOG] {e} - truncating {segment.path} to {offset} bytes")
+            os.truncate(segment.path, offset)
+        segment.size = offset
+        return ranges
+
+    def register(self, segment, ranges):
+        """Add a loaded segment's groups to the lookup tables"""
+        self.segments.append(segment)
+        for key, (first, last) in ranges.items():
+            self.group_firsts.setdefault(key, []).append(first)
+            self.group_segments.setdefault(key, []).append(segment)
+            self.last_seq[key] = max(self.last_seq.get(key, 0), last)
+        for key, name in segment.names.items():
+            self.names[key] = name
+            self.keys[name] = key
+
+    def key_for(self, group_id):
+        """Key for a group id, remembering the mapping"""
+        key = self.keys.get(group_id)
+        if key is None:
+            key = self.keys[group_id] = group_key(group_id)
+            self.names[key] = group_id
+        return key
+
+    def group_ids(self):
+        """Every group id with messages in the log"""
+        return list(self.keys)
+
+    def last(self, group_id):
+        """Newest sequence number logged for a group (0 if none)"""
+        return self.last_seq.get(self.key_for(group_id), 0)
+
+    def append(self, group_id, record, seq=None):
+        """
+        Log one message
+
+        Args:
+            group_id: chat group the message belongs to
+            record: JSON-serializable dict (group and seq are added)
+            seq: sequence number assigned elsewhere (it must be newer
+                than the group's last one), or None to number it here
+
+        Returns:
+            the message's sequence number within the group
+        """
+        key = self.key_for(group_id)
+        with self.lock:
+            last = self.last_seq.get(key, 0)
+            if seq is None or seq <= last:
+                seq = last + 1
+            payload = chat_codec.dumps(dict(record, group=group_id, seq=seq))
+            frame = RECORD_HEADER.pack(len(payload), zlib.crc32(payload), key, seq) + payload
+
+            segment = self.active
+            if segment.size and segment.size + len(frame) > self.segment_bytes:
+                segment = self.rotate()
+            offset = segment.size
+            segment.size += len(frame)
+            if segment.add(key, seq, offset, self.index_interval):
+                segment.names[key] = group_id
+                self.group_firsts.setdefault(key, []).append(seq)
+                self.group_segments.setdefault(key, []).append(segment)
+            self.last_seq[key] = seq
+            self.pending.append(frame)
+        self.wakeup.set()
+        return seq
+
+    def rotate(self):
+        """Start a new active segment (called with self.lock held)"""
+        sealed = self.active
+        self.active = Segment(self.directory, sealed.number + 1)
+        self.segments.append(self.active)
+        self.pending.append((sealed, self.active))  # The commit thread seals it in order
+        return self.active
+
+    def read(self, group_id, from_seq=1, limit=50):
+        """
+        Read a group's messages in order, starting at a sequence number
+
+        Args:
+            group_id: chat group
+            from_seq: first sequence number wanted
+            limit: most records returned
+
+        Returns:
+            list of record dicts (with 'group' and 'seq')
+        """
+        key = self.keys.get(group_id)
+        segments = self.group_segments.get(key)
+        if not segments or limit <= 0:
+            return []
+        with self.lock:
+            active, active_end = self.active, self.active.size
+        if self.pending:
+            self.flush()
+
+        i = max(bisect.bisect_right(self.group_firsts[key], from_seq) - 1, 0)
+        records = []
+        for segment in segments[i:]:
+            if segment.number > active.number:
+                break  # Appended after this read started
+            offset = segment.find(key, from_seq)
+            if offset is None:
+                continue
+            end = active_end if segment is active else segment.size
+            for _, seq, payload in segment.records(offset, end, key):
+                if seq < from_seq:
+                    continue
+                record = chat_codec.loads(payload)
+                if record['group'] != group_id:
+                    continue  # 64-bit key collision
+                records.append(record)
+                if len(records) >= limit:
+                    return records
+        return records
+
+    def flush(self):
+        """Write everything appended so far (without fsync)"""
+        with self.io_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            data = []
+            for item in batch:
+                if isinstance(item, bytes):
+                    data.append(item)
+                    continue
+                self.write_all(b''.join(data))
+                data = []
+                sealed, following = item
+                if self.fsync:
+                    os.fsync(self.write_fd)
+                os.close(self.write_fd)
+                self.write_fd = os.open(following.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                sealed.seal()
+            self.write_all(b''.join(data))
+
+    def write_all(self, data):
+        """os.write until every byte is in the active file"""
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.write_fd, view):]
+
+    def sync(self):
+        """Write and fsync everything appended so far"""
+        self.flush()
+        if self.fsync:
+            with self.io_lock:
+                os.fsync(self.write_fd)
+
+    def commit_loop(self):
+        """Group commit: one write + fsync for every batch of appends"""
+        while not self.closed:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            time.sleep(self.commit_interval)  # Let more appends join this commit
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"[LOG] Commit failed: {e}")
+
+    def close(self):
+        """Commit everything and release files"""
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.committer.join()
+        self.sync()
+        os.close(self.write_fd)
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,135 @@
+"""
+chat_ratelimit.py - Per-client token buckets for the dispatch path
+Every client has one bucket for all of its frames and one per action it
+uses, checked in O(1) before the frame reaches its handler. A frame that
+finds a bucket empty is not handled yet: the server holds it and stops
+reading that connection until the bucket has refilled, so a flooding
+client slows itself down without taking turns from anyone else.
+
+Throttling escalates with how long a client stays over its limits:
+  - at first the frames over the limit are only deferred,
+  - after ERROR_AFTER seconds they are dropped, with an error to the client,
+  - after DISCONNECT_AFTER seconds the client is disconnected.
+A client counts as throttled from its first deferred frame until it has
+gone CALM_AFTER seconds without one.
+"""
+
+# action -> (tokens per second, burst); '*' is the budget for every
+# frame of the client together, whatever its action
+RATE_LIMITS = {
+    '*': (50, 100),
+    'exchange': (20, 40),
+    'who': (1, 5),
+    'history': (5, 20),
+    'connect': (2, 10),
+    'create_group': (1, 5),
+    'login': (1, 5),
+    'resume': (1, 5),
+}
+
+ERROR_AFTER = 3  # seconds throttled before frames over the limit are dropped
+DISCONNECT_AFTER = 15  # seconds throttled before the client is disconnected
+CALM_AFTER = 2  # seconds without a refused frame that end the throttling
+
+# Verdicts of RateLimiter.check()
+ADMIT, DEFER, DROP, DISCONNECT = range(4)
+
+class TokenBucket:
+    """Tokens refill at `rate` per second up to `burst`; a frame takes one"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now):
+        """
+        Add the tokens earned since the last call
+
+        Returns:
+            seconds until a whole token is available (0 if one is)
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+def parse_limit(text):
+    """
+    Parse a command line limit "ACTION=RATE:BURST" (e.g. "who=1:5")
+
+    Returns:
+        (action, (rate, burst))
+    """
+    action, _, spec = text.partition('=')
+    rate, _, burst = spec.partition(':')
+    rate = float(rate)
+    burst = float(burst) if burst else max(1.0, rate)
+    if not action or rate <= 0 or burst < 1:
+        raise ValueError(f"Bad rate limit: {text!r} (expected ACTION=RATE:BURST)")
+    return action, (rate, burst)
+
+class RateLimiter:
+    """One client's buckets and throttling state"""
+
+    __slots__ = ('limits', 'buckets', 'since', 'refused', 'warned', 'wait')
+
+    def __init__(self, limits):
+        """
+        Args:
+            limits: {action: (rate, burst)}, shared by every client
+        """
+        self.limits = limits
+        self.buckets = {}  # action -> TokenBucket, created on first use
+        self.since = None  # time.monotonic() throttling began, None if not throttled
+        self.refused = None  # time.monotonic() of the last frame refused
+        self.warned = False  # error already sent for this throttling episode
+        self.wait = 0  # seconds the last refused frame has to wait
+
+    def bucket(self, action, now):
+        """The client's bucket for an action, or None if it is unlimited"""
+        bucket = self.buckets.get(action)
+        if bucket is None:
+            limit = self.limits.get(action)
+            if limit is None:
+                return None
+            bucket = self.buckets[action] = TokenBucket(limit[0], limit[1], now)
+        return bucket
+
+    def check(self, action, now):
+        """
+        Decide what to do with one frame
+
+        Args:
+            action: the frame's action
+            now: time.monotonic()
+
+        Returns:
+            (verdict, seconds until the frame could be admitted)
+        """
+        overall = self.bucket('*', now)
+        own = self.bucket(action, now)
+        wait = max(overall.refill(now) if overall else 0, own.refill(now) if own else 0)
+        if not wait:
+            # Take from both or neither, so a deferred frame costs nothing
+            if overall:
+                overall.tokens -= 1
+            if own:
+                own.tokens -= 1
+            if self.since is not None and now - self.refused >= CALM_AFTER:
+                self.since = None
+                self.warned = False
+            return ADMIT, 0
+
+        self.wait = wait
+        self.refused = now
+        if self.since is None:
+            self.since = now
+        throttled = now - self.since
+        if throttled >= DISCONNECT_AFTER:
+            return DISCONNECT, wait
+        if throttled >= ERROR_AFTER:
+            return DROP, wait
+        return DEFER, wait
@@ -0,0 +1,68 @@
+"""
+chat_receipts.py - Delivery and read positions for group members
+Clients acknowledge messages cumulatively: one ack says "everything in
+this group up to seq N has been delivered (and up to seq M seen)", and
+clients send them in batches rather than per message. The server keeps
+each member's positions and passes the ones that moved on to the group
+as one 'receipts' message per group every RECEIPT_INTERVAL, so receipt
+traffic grows with the number of members, not with members x acks.
+"""
+
+RECEIPT_INTERVAL = 0.25  # seconds between receipt broadcasts
+
+class ReceiptTracker:
+    """Per-group, per-member delivered/seen positions"""
+
+    def __init__(self):
+        self.positions = {}  # group id -> {name: [delivered seq, seen seq]}
+        self.changed = {}  # group id -> {name: [delivered, seen]} not broadcast yet
+
+    def ack(self, group_id, name, delivered=0, seen=0):
+        """
+        Record a cumulative ack; positions only ever move forward
+
+        Args:
+            group_id: chat group
+            name: member sending the ack
+            delivered: highest seq received
+            seen: highest seq shown to the user
+
+        Returns:
+            True if either position moved
+        """
+        members = self.positions.setdefault(group_id, {})
+        position = members.get(name)
+        if position is None:
+            position = members[name] = [0, 0]
+        seen = min(seen, max(delivered, position[0]))  # nothing is seen before it arrives
+        if delivered <= position[0] and seen <= position[1]:
+            return False
+        position[0] = max(position[0], delivered)
+        position[1] = max(position[1], seen)
+        self.changed.setdefault(group_id, {})[name] = list(position)
+        return True
+
+    def get(self, group_id, name):
+        """
+        A member's positions
+
+        Returns:
+            (delivered seq, seen seq), (0, 0) if never acked
+        """
+        position = self.positions.get(group_id, {}).get(name)
+        return tuple(position) if position else (0, 0)
+
+    def take(self):
+        """
+        Positions that moved since the last call
+
+        Returns:
+            {group id: {name: [delivered, seen]}}
+        """
+        changed, self.changed = self.changed, {}
+        return changed
+
+    def forget(self, group_id):
+        """Drop a group that no longer exists"""
+        self.positions.pop(group_id, None)
+        self.changed.pop(group_id, None)
@@ -0,0 +1,184 @@
+"""
+chat_scrollback.py - Bounded-memory sequences for the client's scroll-back
+The GUI keeps everything shown in a chat (transcript rows, and the text
+lines /summary and search work on) for as long as the session runs. To
+keep the client's memory flat over a day-long session, a Scrollback
+holds only about memory_records of them in memory: the rest are spilled
+to an append-only temporary file and read back when scrolling or a
+search reaches them.
+
+Records are kept in chunks of up to chunk_records. A chunk is either in
+memory, on disk, or both (read back, and still valid on disk). When too
+many records are in memory, the chunks that have been in memory longest
+(other than the newest one) are spilled; a chunk read back is simply
+dropped again, since its copy on disk is still good. A chunk changed by
+an insert or an assignment is written again as a new copy the next time
+it is spilled - the file is never rewritten.
+"""
+import bisect
+import struct
+import tempfile
+from collections import OrderedDict
+import chat_codec
+
+CHUNK_RECORDS = 256  # records per chunk, by default
+SCROLLBACK_MEMORY = 2048  # records kept in memory per Scrollback
+
+CHUNK_HEADER = struct.Struct('!I')  # length of one spilled chunk
+
+class Chunk:
+    """A run of consecutive records, in memory and/or in the spill file"""
+
+    __slots__ = ('records', 'count', 'offset')
+
+    def __init__(self, records):
+        self.records = records  # list, or None while only on disk
+        self.count = len(records)
+        self.offset = None  # file offset of the copy on disk, None if there is none
+
+class Scrollback:
+    """
+    A list-like sequence of records that spills its older part to disk
+
+    Supports len(), indexing (negative too) and slicing, assignment to
+    an index, iteration from the oldest record, append() and insert_many().
+    """
+
+    def __init__(self, memory_records=SCROLLBACK_MEMORY, encode=None, decode=None,
+                 chunk_records=CHUNK_RECORDS):
+        """
+        Args:
+            memory_records: records kept in memory before chunks are spilled
+            encode: record -> JSON-serializable value, for spilling (default: as is)
+            decode: the reverse, for records read back
+            chunk_records: records per chunk; smaller chunks make reading
+                back scattered records cheaper
+        """
+        self.memory_records = memory_records
+        self.chunk_records = chunk_records
+        self.encode = encode
+        self.decode = decode
+        self.chunks = []
+        self.starts = []  # index of each chunk's first record
+        self.length = 0
+        self.resident = 0  # records held in memory
+        self.in_memory = OrderedDict()  # chunks holding their records, longest held first
+        self.file = None  # spill file, created on first spill
+        self.file_size = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        """Every record, oldest first; spilled chunks are streamed, not kept"""
+        for chunk in self.chunks:
+            yield from chunk.records if chunk.records is not None else self.read(chunk)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Scrollback index out of range")
+        position = bisect.bisect_right(self.starts, index) - 1
+        return self.load(position)[index - self.starts[position]]
+
+    def __setitem__(self, index, record):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Scrollback index out of range")
+        position = bisect.bisect_right(self.starts, index) - 1
+        self.load(position)[index - self.starts[position]] = record
+        self.chunks[position].offset = None  # The copy on disk is stale now
+
+    def append(self, record):
+        """Add a record at the end"""
+        last = self.chunks[-1] if self.chunks else None
+        if last is not None and last.records is not None and last.offset is None \
+                and last.count < self.chunk_records:
+            last.records.append(record)
+            last.count += 1
+        else:
+            chunk = Chunk([record])
+            self.chunks.append(chunk)
+            self.starts.append(self.length)
+            self.in_memory[chunk] = None
+        self.length += 1
+        self.resident += 1
+        self.trim()
+
+    def insert_many(self, index, records):
+        """Add records before the one at index (at the end if index == len)"""
+        if not records:
+            return
+        if index >= self.length:
+            for record in records:
+                self.append(record)
+            return
+        position = bisect.bisect_right(self.starts, index) - 1
+        chunk = self.chunks[position]
+        current = self.load(position)
+        at = index - self.starts[position]
+        chunk.records = current[:at] + list(records) + current[at:]
+        chunk.count = len(chunk.records)
+        chunk.offset = None  # The copy on disk is stale now
+        for i in range(position + 1, len(self.starts)):
+            self.starts[i] += len(records)
+        self.length += len(records)
+        self.resident += len(records)
+        self.trim(keep=chunk)
+
+    def load(self, position):
+        """The records of a chunk, reading them back from disk if needed"""
+        chunk = self.chunks[position]
+        if chunk.records is None:
+            chunk.records = self.read(chunk)
+            self.resident += chunk.count
+            self.in_memory[chunk] = None
+            self.trim(keep=chunk)
+        return chunk.records
+
+    def trim(self, keep=None):
+        """Spill or drop chunks until few enough records are in memory"""
+        if self.resident <= self.memory_records:
+            return
+        newest = self.chunks[-1]
+        for chunk in list(self.in_memory):
+            if self.resident <= self.memory_records:
+                return
+            if chunk is keep or chunk is newest:
+                continue
+            if chunk.offset is None:
+                self.write(chunk)
+            chunk.records = None
+            self.resident -= chunk.count
+            del self.in_memory[chunk]
+
+    def write(self, chunk):
+        """Append a chunk's records to the spill file, as one JSON array"""
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix='chat-scrollback-')
+        encode = self.encode
+        records = [encode(record) for record in chunk.records] if encode else chunk.records
+        payload = chat_codec.dumps(records)
+        data = CHUNK_HEADER.pack(len(payload)) + payload
+        self.file.seek(self.file_size)
+        self.file.write(data)
+        chunk.offset = self.file_size
+        self.file_size += len(data)
+
+    def read(self, chunk):
+        """A spilled chunk's records, read from the file"""
+        self.file.seek(chunk.offset)
+        length, = CHUNK_HEADER.unpack(self.file.read(CHUNK_HEADER.size))
+        records = chat_codec.loads(self.file.read(length))
+        decode = self.decode
+        return [decode(record) for record in records] if decode else records
+
+    def close(self):
+        """Delete the spill file"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,207 @@
+"""
+chat_search.py - Incremental inverted index for searching the chat
+Every message shown is added once, as it is shown, so a search never
+rescans the chat: each word maps to the sorted list of messages that
+contain it (its postings), and a query only walks the postings of its
+own words.
+
+Queries are words, all of which must match (AND). Each word matches
+any word in a message that starts with it ("hel" finds "hello"), and
+from:NAME keeps only messages sent by NAME. The newest matches are
+returned first; the walk stops as soon as enough of them are found.
+
+Doc ids follow message order: new messages count up from 0, and pages
+of older history loaded later count down from -1, so "newest first"
+also holds for what was backfilled.
+"""
+import bisect
+import re
+from array import array
+from chat_scrollback import Scrollback
+
+SEARCH_LIMIT = 15  # matches returned by default
+SET_AFTER = 8  # a term expanding to more words than this is checked through a set
+BLOCK = 256  # docs of a query's rarest term intersected at a time
+CHECK_RATIO = 16  # look candidates up one by one in postings this much bigger
+DOC_CHUNK = 32  # lines per chunk of the spilled line store
+
+WORD = re.compile(r"\w+")
+SENDER_PREFIX = 'from:'
+
+def tokenize(text):
+    """The lowercased words of a text"""
+    return WORD.findall(text.lower())
+
+def contains(postings, doc):
+    """True if a sorted postings array holds doc"""
+    i = bisect.bisect_left(postings, doc)
+    return i < len(postings) and postings[i] == doc
+
+class SearchIndex:
+    """Messages by word and by sender, for AND/prefix/sender queries"""
+
+    def __init__(self):
+        # doc id -> line shown for it; matches are scattered, so small chunks
+        self.docs = Scrollback(chunk_records=DOC_CHUNK)
+        self.older = Scrollback(chunk_records=DOC_CHUNK)  # line of doc -1, -2, ...
+        self.postings = {}  # word -> array of doc ids, ascending
+        self.vocabulary = []  # every word, sorted, for prefix lookups
+        self.senders = {}  # lowercased sender -> array of doc ids
+
+    def __len__(self):
+        return len(self.docs) + len(self.older)
+
+    def add(self, sender, text, line=None):
+        """
+        Index one message
+
+        Args:
+            sender: who sent it ("Me" for our own messages)
+            text: the message text
+            line: what a search shows for it (default "[sender]: text")
+
+        Returns:
+            its doc id
+        """
+        doc = len(self.docs)
+        self.docs.append(line if line is not None else f"[{sender}]: {text}")
+        postings = self.postings
+        for word in set(tokenize(text)):
+            entries = postings.get(word)
+            if entries is None:
+                entries = postings[word] = array('i')
+                bisect.insort(self.vocabulary, word)
+            entries.append(doc)
+        self.senders.setdefault(sender.lower(), array('i')).append(doc)
+        return doc
+
+    def add_older(self, messages):
+        """
+        Index a page of messages older than every one indexed so far
+
+        They get the next negative doc ids down, so they rank below
+        everything already indexed.
+
+        Args:
+            messages: (sender, text, line) tuples, oldest first; line as for add()
+        """
+        first = -len(self.older) - len(messages)  # doc id of the oldest
+        words = {}
+        senders = {}
+        for doc, (sender, text, line) in enumerate(messages, first):
+            for word in set(tokenize(text)):
+                words.setdefault(word, []).append(doc)
+            senders.setdefault(sender.lower(), []).append(doc)
+        for sender, text, line in reversed(messages):
+            self.older.append(line if line is not None else f"[{sender}]: {text}")
+
+        # One copy per word and page, the new ids in front
+        for word, docs in words.items():
+            entries = self.postings.get(word)
+            if entries is None:
+                entries = array('i')
+                bisect.insort(self.vocabulary, word)
+            self.postings[word] = array('i', docs) + entries
+        for sender, docs in senders.items():
+            self.senders[sender] = array('i', docs) + self.senders.get(sender, array('i'))
+
+    def line(self, doc):
+        """The line shown for a doc id"""
+        return self.docs[doc] if doc >= 0 else self.older[-doc - 1]
+
+    def term_postings(self, term):
+        """The postings lists a query term matches (one per matching word)"""
+        if term.startswith(SENDER_PREFIX):
+            entries = self.senders.get(term[len(SENDER_PREFIX):])
+            return [entries] if entries else []
+        vocabulary = self.vocabulary
+        i = bisect.bisect_left(vocabulary, term)
+        lists = []
+        while i < len(vocabulary) and vocabulary[i].startswith(term):
+            lists.append(self.postings[vocabulary[i]])
+            i += 1
+        return lists
+
+    def parse(self, query):
+        """Query terms: lowercased word prefixes and from:NAME filters"""
+        terms = []
+        for part in query.lower().split():
+            if part.startswith(SENDER_PREFIX) and len(part) > len(SENDER_PREFIX):
+                terms.append(part)
+            else:
+                terms.extend(tokenize(part))
+        return terms
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Find the newest messages matching every term of a query
+
+        Walks the postings of the rarest term from the newest message
+        back, a block at a time, and intersects each block with the
+        other terms' postings, until limit matches are found.
+
+        Returns:
+            (matching lines newest first, True if there are more matches)
+        """
+        matched = self.search_docs(query, limit + 1)
+        return [self.line(doc) for doc in matched[:limit]], len(matched) > limit
+
+    def search_docs(self, query, limit):
+        """Doc ids of up to limit matches, newest first"""
+        term_lists = [self.term_postings(term) for term in self.parse(query)]
+        if not term_lists or not all(term_lists):
+            return []
+        term_lists.sort(key=lambda lists: sum(map(len, lists)))
+        driver, others = term_lists[0], term_lists[1:]
+        # Terms expanding to many words are checked against one set
+        expanded = [self.union(lists) if len(lists) > SET_AFTER else None for lists in others]
+
+        # Walk back through windows of doc ids holding about BLOCK docs
+        # of the rarest term each, intersecting with C-level set operations
+        span = max(BLOCK, BLOCK * len(self) // sum(map(len, driver)))
+        matched = []
+        lowest = -len(self.older)
+        high = len(self.docs)
+        while high > lowest and len(matched) < limit:
+            low = max(lowest, high - span)
+            candidates = set()
+            for entries in driver:
+                candidates.update(entries[bisect.bisect_left(entries, low):
+                                          bisect.bisect_left(entries, high)])
+            for lists, docs in zip(others, expanded):
+                if not candidates:
+                    break
+                if docs is not None:
+                    candidates &= docs
+                    continue
+                bounds = [(entries, bisect.bisect_left(entries, low),
+                           bisect.bisect_left(entries, high)) for entries in lists]
+                if sum(end - start for _, start, end in bounds) > len(candidates) * CHECK_RATIO:
+                    # A common word: look each candidate up instead
+                    candidates = {doc for doc in candidates
+                                  if any(contains(entries, doc) for entries in lists)}
+                elif len(bounds) == 1:
+                    entries, start, end = bounds[0]
+                    candidates = candidates.intersection(entries[start:end])
+                else:
+                    found = set()
+                    for entries, start, end in bounds:
+                        found.update(candidates.intersection(entries[start:end]))
+                    candidates = found
+            matched.extend(sorted(candidates, reverse=True))
+            high = low
+            if not candidates:
+                span *= 2  # Few matches around here: take bigger steps
+        return matched[:limit]
+
+    def union(self, lists):
+        """Every doc id in any of the postings lists"""
+        docs = set()
+        for entries in lists:
+            docs.update(entries)
+        return docs
+
+    def close(self):
+        """Delete the spilled lines"""
+        self.docs.close()
+        self.older.close()
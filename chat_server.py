@@ -3,45 +3,192 @@ chat_server.py - COMPLETE VERSION WITH GROUP CHAT SUPPORT
 Ready to copy and paste - no manual edits needed!
 """
 import socket
-import select
-import json
-from chat_utils import mysend, myrecv, CHAT_PORT
+import selectors
+import argparse
+import time
+from collections import deque
+from chat_utils import encode_frame, FrameDecoder, CHAT_PORT, MAX_FRAME_SIZE, LOGIN_FRAME_SIZE
 from chat_group import Group
+from chat_session import (Session, SessionTable, ParkedSession, new_resume_token, tokens_match,
+                          RESUME_GRACE)
+from chat_log import MessageLog
+from chat_history import HistoryStore, HISTORY_SIZE, HISTORY_PAGE, HISTORY_PAGE_MAX
+from chat_spool import OfflineSpool
+from chat_receipts import ReceiptTracker, RECEIPT_INTERVAL
+from chat_timers import (TimerWheel, TICK, HEARTBEAT_CAPABILITY, HEARTBEAT_INTERVAL,
+                         HEARTBEAT_TIMEOUT, LOGIN_TIMEOUT)
+from chat_ratelimit import (RateLimiter, RATE_LIMITS, DISCONNECT_AFTER, parse_limit,
+                            ADMIT, DROP, DISCONNECT)
+import chat_codec
+import chat_wire
+from chat_compress import (StreamCompressor, StreamDecompressor, is_compressed,
+                           DEFLATE_CAPABILITY, COMPRESS_THRESHOLD)
 
-class Server:
+# Outbound backpressure defaults (bytes / seconds)
+OUTBOUND_HIGH_WATERMARK = 1024 * 1024
+OUTBOUND_LOW_WATERMARK = 256 * 1024
+SLOW_CONSUMER_TIMEOUT = 10
+
+# Optional protocol features a client may ask for at login
+SUPPORTED_CAPABILITIES = {chat_wire.BINARY_CAPABILITY, DEFLATE_CAPABILITY,
+                          HEARTBEAT_CAPABILITY}
+
+# Most frames handed to one sendmsg() call
+MAX_IOV = 64
+
+# Pending connections the kernel may queue before we accept them
+ACCEPT_BACKLOG = 1024
+
+class OutboundQueue:
+    """
+    Frames waiting to be written to one socket
+    
+    Frames are kept by reference, so a broadcast frame encoded once is
+    shared by every recipient's queue instead of being copied into it.
+    """
+    
     def __init__(self):
+        self.frames = deque()
+        self.size = 0  # total bytes still to send
+    
+    def __len__(self):
+        return self.size
+    
+    def append(self, frame):
+        """Queue a frame (bytes or memoryview) behind the others"""
+        self.frames.append(frame)
+        self.size += len(frame)
+    
+    def write_to(self, sock):
+        """
+        Send as much of the queue as the socket accepts
+        
+        Returns:
+            Number of bytes written
+        """
+        frames = self.frames
+        if hasattr(sock, 'sendmsg'):
+            batch = [frames[i] for i in range(min(len(frames), MAX_IOV))]
+            sent = sock.sendmsg(batch)
+        else:
+            sent = sock.send(frames[0])
+        
+        self.size -= sent
+        remaining = sent
+        while remaining:
+            head = frames[0]
+            if remaining >= len(head):
+                remaining -= len(head)
+                frames.popleft()
+            else:
+                frames[0] = memoryview(head)[remaining:]
+                remaining = 0
+        return sent
+
+class Server:
+    def __init__(self, port=CHAT_PORT, high_watermark=OUTBOUND_HIGH_WATERMARK,
+                 low_watermark=OUTBOUND_LOW_WATERMARK,
+                 slow_consumer_timeout=SLOW_CONSUMER_TIMEOUT,
+                 compress_threshold=COMPRESS_THRESHOLD, reuse_port=False, log_dir=None,
+                 history_size=HISTORY_SIZE, spool_dir=None, resume_grace=RESUME_GRACE,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                 rate_limits=RATE_LIMITS):
+        self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind(('0.0.0.0', CHAT_PORT))
-        self.server_socket.listen(5)
+        if reuse_port:
+            # Several worker processes share the port; the kernel spreads connections
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.server_socket.bind(('0.0.0.0', port))
+        self.server_socket.listen(ACCEPT_BACKLOG)
+        self.server_socket.setblocking(False)
+        
+        # Readiness notification (epoll on Linux); key.data is the Session,
+        # or a callable for the listening socket and other auxiliary sockets
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server_socket, selectors.EVENT_READ,
+                               self.handle_new_connection)
+        
+        # Client tracking: one Session per connection, by fd and by name
+        self.sessions = SessionTable()
         
-        # Client tracking
-        self.clients = {}  # {name: socket}
-        self.logged_name2sock = {}  # name -> socket
-        self.logged_sock2name = {}  # socket -> name
+        # Per-connection deflate streams for clients that negotiated them
+        self.compress_threshold = compress_threshold
         
         # Group management
         self.group = Group()
         
-        # Socket lists for select
-        self.all_sockets = [self.server_socket]
+        # Durable message log (optional)
+        self.message_log = None
+        if log_dir:
+            self.message_log = MessageLog(log_dir)
+            self.reserve_group_ids(self.message_log.group_ids())
+            print(f"[SERVER] Logging messages to {log_dir}")
         
-        print(f"[SERVER] Started on port {CHAT_PORT}")
+        # Recent messages per group, for the history action
+        self.history = HistoryStore(history_size, keep_seqs=self.message_log is None)
+        
+        # Messages for members whose connection dropped (None: they leave
+        # their chat on disconnect instead)
+        self.spool = OfflineSpool(spool_dir)
+        
+        # Dropped sessions a reconnecting client may still resume (0: never)
+        self.resume_grace = resume_grace
+        self.parked = {}  # name -> ParkedSession
+        
+        # Login deadlines, heartbeats and parked sessions' grace, one
+        # timer each; due ones fire from reap_connections()
+        self.timers = TimerWheel()
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        
+        # Per-client token buckets, {action: (rate, burst)} (None: no limits)
+        self.rate_limits = rate_limits
+        self.throttled = set()  # sessions with frames held by a rate limit
+        
+        # Delivered/seen positions from cumulative acks, broadcast in batches
+        self.receipts = ReceiptTracker()
+        self.next_receipts = 0
+        
+        # Action routing table (see register_action)
+        self.handlers = self.default_handlers()
+        
+        # Outbound backpressure
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.slow_consumer_timeout = slow_consumer_timeout
+        self.lagging = set()  # sessions whose queue crossed high_watermark
+        self.dead_sessions = set()  # sends failed, close on next loop pass
+        
+        print(f"[SERVER] Started on port {port} (JSON codec: {chat_codec.BACKEND})")
         print("[SERVER] Waiting for connections...")
     
     def run(self):
         """Main server loop"""
         while True:
             try:
-                read_ready, _, _ = select.select(self.all_sockets, [], [], 1)
-                
-                for sock in read_ready:
-                    if sock == self.server_socket:
-                        # New connection
-                        self.handle_new_connection()
-                    else:
+                # Only sockets with work registered (see update_interest);
+                # wake up sooner while receipts or throttled frames wait
+                timeout = RECEIPT_INTERVAL if self.receipts.changed else 1
+                if self.throttled:
+                    timeout = TICK
+                for key, mask in self.selector.select(timeout=timeout):
+                    session = key.data
+                    if callable(session):
+                        # New connection(s), or another registered socket
+                        session()
+                        continue
+                    
+                    if session.closed:
+                        continue  # Torn down earlier in this batch
+                    if mask & selectors.EVENT_WRITE:
+                        self.flush_outbound(session)
+                    if mask & selectors.EVENT_READ and not session.closed:
                         # Existing client message
-                        self.handle_client_message(sock)
+                        self.handle_client_message(session)
+                
+                self.reap_connections()
+                self.flush_receipts()
                         
             except KeyboardInterrupt:
                 print("\n[SERVER] Shutting down...")
@@ -52,85 +199,340 @@ class Server:
         self.shutdown()
     
     def handle_new_connection(self):
-        """Handle new client connection"""
-        try:
-            client_socket, address = self.server_socket.accept()
-            self.all_sockets.append(client_socket)
-            print(f"[SERVER] New connection from {address}")
-        except Exception as e:
-            print(f"[SERVER] Error accepting connection: {e}")
+        """Accept every connection waiting on the listening socket"""
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except Exception as e:
+                print(f"[SERVER] Error accepting connection: {e}")
+                return
+            
+            try:
+                client_socket.setblocking(False)
+                # Small frames only until login (see start_session)
+                session = Session(client_socket, client_socket.fileno(),
+                                  FrameDecoder(max_frame_size=LOGIN_FRAME_SIZE))
+                self.sessions.add(session)
+                self.watch(session)
+                self.update_interest(session)
+                print(f"[SERVER] New connection from {address}")
+            except Exception as e:
+                print(f"[SERVER] Error accepting connection: {e}")
+                client_socket.close()
     
-    def handle_client_message(self, sock):
-        """Handle message from existing client"""
+    def handle_client_message(self, session):
+        """
+        Handle readable data from an existing client
+        
+        Reads once per readiness event and dispatches every frame the
+        bytes complete; a half-sent frame simply waits in the decoder.
+        """
         try:
-            msg = myrecv(sock)
+            decoder = session.decoder
+            try:
+                received = decoder.recv_into(session.sock)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                received = 0
             
-            if not msg:
+            if not received:
                 # Client disconnected
-                self.handle_disconnect(sock)
+                self.handle_disconnect(session)
                 return
             
-            # Parse JSON message
-            try:
-                data = json.loads(msg)
-            except json.JSONDecodeError:
-                # Handle legacy text commands
-                self.handle_legacy_command(sock, msg)
+            # Again after each batch: a login handled in one may raise
+            # the size limit for a frame right behind it
+            frames = decoder.frames()
+            while frames and not session.closed:
+                for payload in frames:
+                    self.process_message(session, payload)
+                    if session.closed:
+                        break  # Handler closed the connection
+                else:
+                    frames = decoder.frames()
+                
+        except Exception as e:
+            print(f"[SERVER] Error handling message: {e}")
+            self.handle_disconnect(session)
+    
+    def process_message(self, session, msg):
+        """
+        Parse one decoded frame and route it to its handler
+        
+        Shared by every server engine, so the select() loop and the
+        asyncio engine give each action the same semantics. Frames of a
+        client over its rate limits are held (see admit) and handled
+        later by drain_held, in the order they arrived.
+        
+        Args:
+            session: Session the frame arrived on
+            msg: frame payload (bytes or str)
+        """
+        try:
+            session.frames_in += 1
+            session.bytes_in += len(msg)
+            session.last_active = time.monotonic()
+            
+            if session.held is not None:
+                # Throttled: queue behind the frames already waiting
+                session.held.append(msg)
                 return
             
-            action = data.get('action', '')
-            
-            # Route to appropriate handler
-            if action == 'login':
-                self.handle_login(sock, data)
-            elif action == 'connect':
-                self.handle_connect(sock, data)
-            elif action == 'create_group':  # NEW: Group chat support
-                self.handle_create_group(sock, data)
-            elif action == 'exchange':
-                self.handle_exchange(sock, data)
-            elif action == 'disconnect':
-                self.handle_disconnect_request(sock, data)
-            elif action == 'who':
-                self.handle_who(sock)
-            elif action == 'quit':
-                self.handle_disconnect(sock)
-            else:
-                print(f"[SERVER] Unknown action: {action}")
+            message = self.decode_message(session, msg)
+            if self.rate_limits and not self.admit(session, message):
+                return
+            self.handle_decoded(session, message)
                 
         except Exception as e:
             print(f"[SERVER] Error handling message: {e}")
-            self.handle_disconnect(sock)
+            self.handle_disconnect(session)
+    
+    def decode_message(self, session, msg):
+        """
+        Decompress and parse one frame
+        
+        Returns:
+            the message dict, or the text of a legacy command
+        """
+        if is_compressed(msg):
+            if not session.decompressor:
+                raise ValueError("compressed frame before deflate was negotiated")
+            msg = session.decompressor.decompress(msg)
+        
+        if chat_wire.is_binary(msg):
+            data = chat_wire.decode(msg)
+        else:
+            # Parse JSON message
+            try:
+                data = chat_codec.loads(msg)
+            except chat_codec.DecodeError:
+                data = None
+        
+        if isinstance(data, dict):
+            return data
+        if isinstance(msg, bytes):
+            msg = msg.decode('utf-8')
+        return msg
+    
+    def handle_decoded(self, session, message):
+        """Route a message from decode_message to its handler"""
+        if isinstance(message, dict):
+            self.dispatch(session, message)
+        else:
+            # Handle legacy text commands
+            self.handle_legacy_command(session, message)
+    
+    def admit(self, session, message):
+        """
+        Check a message against its sender's rate limits
+        
+        A message over the limits is held, and the connection is no
+        longer read until drain_held has handled it, so a flooding client
+        is slowed down at its own socket. Legacy commands only count
+        against the client's overall limit.
+        
+        Returns:
+            True if the message may be handled now
+        """
+        limiter = session.limiter
+        if limiter is None:
+            limiter = session.limiter = RateLimiter(self.rate_limits)
+        action = message.get('action') if isinstance(message, dict) else None
+        verdict, wait = limiter.check(action, time.monotonic())
+        if verdict == ADMIT:
+            return True
+        
+        if limiter.since == limiter.refused:
+            print(f"[SERVER] Throttling {session.name or 'unknown'}")
+        session.held = deque([message])
+        self.throttled.add(session)
+        self.update_interest(session)
+        self.throttle(session, verdict, wait)
+        return False
+    
+    def throttle(self, session, verdict, wait):
+        """
+        Apply a rate limit verdict to the first held message
+        
+        Args:
+            session: throttled Session
+            verdict: DEFER, DROP or DISCONNECT (see chat_ratelimit)
+            wait: seconds until the client's buckets admit a message again
+        """
+        if verdict == DISCONNECT:
+            print(f"[SERVER] Disconnecting {session.name or 'unknown'}: "
+                  f"over its rate limits for {DISCONNECT_AFTER}s")
+            self.handle_disconnect(session, leaving=True)
+            return
+        
+        if verdict == DROP:
+            session.held.popleft()
+            if not session.limiter.warned:
+                session.limiter.warned = True
+                self.send_json(session, {
+                    'action': 'error',
+                    'message': 'Too many requests - slow down, messages are being dropped'
+                })
+        self.schedule_drain(session, wait)
+    
+    def schedule_drain(self, session, wait):
+        """Run drain_held for a throttled session once wait seconds have passed"""
+        self.timers.schedule(wait, self.drain_held, session)
+    
+    def drain_held(self, session):
+        """
+        Handle a throttled session's held frames as its buckets allow
+        
+        Stops at the first frame that has to wait again; once none are
+        left, the connection is read again.
+        """
+        held = session.held
+        if session.closed or held is None:
+            return
+        try:
+            while held:
+                message = held[0]
+                if not isinstance(message, (dict, str)):
+                    # Decoded only now, in order, as deflate streams require
+                    message = held[0] = self.decode_message(session, message)
+                verdict, wait = session.limiter.check(
+                    message.get('action') if isinstance(message, dict) else None,
+                    time.monotonic())
+                if verdict != ADMIT:
+                    self.throttle(session, verdict, wait)
+                    return
+                held.popleft()
+                self.handle_decoded(session, message)
+                if session.closed:
+                    return
+        except Exception as e:
+            print(f"[SERVER] Error handling message: {e}")
+            self.handle_disconnect(session)
+            return
+        
+        session.held = None
+        self.throttled.discard(session)
+        self.update_interest(session)
+    
+    def default_handlers(self):
+        """
+        Build the action -> handler table
+        
+        Every handler is called as handler(session, data).
+        
+        Returns:
+            {action: bound handler}
+        """
+        return {
+            'login': self.handle_login,
+            'resume': self.handle_resume,
+            'connect': self.handle_connect,
+            'create_group': self.handle_create_group,  # NEW: Group chat support
+            'exchange': self.handle_exchange,
+            'disconnect': self.handle_disconnect_request,
+            'who': self.handle_who,
+            'history': self.handle_history,
+            'ack': self.handle_ack,
+            'ping': self.handle_ping,
+            'pong': self.handle_pong,
+            'quit': self.handle_disconnect_request,
+        }
+    
+    def register_action(self, action, handler):
+        """
+        Add or replace the handler for an action
+        
+        Args:
+            action: action name as it appears in the message
+            handler: callable taking (session, data)
+        """
+        self.handlers[action] = handler
     
-    def handle_login(self, sock, data):
+    def dispatch(self, session, data):
+        """
+        Route a parsed message to its handler with one dict lookup
+        
+        Args:
+            session: Session the message arrived on
+            data: parsed message dict
+        """
+        handler = self.handlers.get(data.get('action', ''))
+        if handler is None:
+            print(f"[SERVER] Unknown action: {data.get('action', '')}")
+            return
+        handler(session, data)
+    
+    def claim_name(self, session, name):
+        """
+        Reserve a login name for a session
+        
+        Returns:
+            False if someone else is already logged in under the name
+        """
+        if not self.sessions.login(session, name):
+            return False
+        self.group.add_user(name)
+        return True
+    
+    def release_name(self, name):
+        """Give a login name back once its session has disconnected"""
+    
+    def is_online(self, name):
+        """True if a user with this name is logged in"""
+        return self.sessions.get_name(name) is not None
+    
+    def online_names(self):
+        """Names of every logged in user"""
+        return self.sessions.names()
+    
+    def reserve_group_ids(self, group_ids):
+        """Never hand out a group id that already has logged messages"""
+        for group_id in group_ids:
+            _, _, number = group_id.rpartition('_')
+            if number.isdigit() and int(number) >= self.group.next_group_id:
+                self.group.next_group_id = int(number) + 1
+    
+    def sync_groups(self, names):
+        """Refresh the cached group_id of the named sessions after a group change"""
+        for name in names:
+            session = self.sessions.get_name(name)
+            if session:
+                session.group_id = self.group.get_user_group(name)
+    
+    def handle_login(self, session, data):
         """Handle login request"""
         try:
             name = data.get('name', '').strip()
             
             if not name:
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'login',
                     'status': 'error',
                     'message': 'Name cannot be empty'
                 })
                 return
             
-            if name in self.clients:
-                self.send_json(sock, {
+            if session.name:
+                self.send_json(session, {
                     'action': 'login',
                     'status': 'error',
-                    'message': 'Name already taken'
+                    'message': f'Already logged in as {session.name}'
                 })
                 return
             
             # Register client
-            self.clients[name] = sock
-            self.logged_name2sock[name] = sock
-            self.logged_sock2name[sock] = name
-            self.group.add_user(name)
+            if not self.claim_name(session, name):
+                self.send_json(session, {
+                    'action': 'login',
+                    'status': 'error',
+                    'message': 'Name already taken'
+                })
+                return
             
-            # Send success
-            self.send_json(sock, {
+            self.start_session(session, data, {
                 'action': 'login',
                 'status': 'success',
                 'message': f'Welcome {name}!'
@@ -138,22 +540,211 @@ class Server:
             
             print(f"[SERVER] {name} logged in")
             
+            # Logging in anew ends a parked session; nobody was told it dropped
+            parked = self.parked.pop(name, None)
+            if parked:
+                parked.timer.cancel()
+            self.deliver_spool(session, announce=parked is None)
+            
         except Exception as e:
             print(f"[SERVER] Login error: {e}")
     
-    def handle_connect(self, sock, data):
+    def start_session(self, session, data, response):
+        """
+        Send a successful login/resume reply and switch to what it accepted
+        
+        The reply itself is always JSON - the client has not switched yet.
+        
+        Args:
+            session: Session that just claimed its name
+            data: the request, with the optional 'capabilities' list
+            response: reply dict; accepted capabilities and the resume
+                token are added
+        """
+        requested = data.get('capabilities')
+        accepted = []
+        if isinstance(requested, list):
+            accepted = [c for c in requested if c in SUPPORTED_CAPABILITIES]
+            response['capabilities'] = accepted
+        if self.resume_grace:
+            session.resume_token = response['resume_token'] = new_resume_token()
+        self.send_json(session, response)
+        
+        if chat_wire.BINARY_CAPABILITY in accepted:
+            session.wire_format = chat_wire.BINARY_CAPABILITY
+        if DEFLATE_CAPABILITY in accepted:
+            session.compressor = StreamCompressor(self.compress_threshold)
+            session.decompressor = StreamDecompressor()
+        if HEARTBEAT_CAPABILITY in accepted:
+            session.heartbeat = True
+        if session.decoder:
+            session.decoder.max_frame_size = MAX_FRAME_SIZE
+    
+    def deliver_spool(self, session, announce=True):
+        """
+        Return a user to their chat and hand over what they missed
+        
+        Everything spooled while they were away goes out as one 'batch'
+        frame, preceded by a status line, so the client catches up in a
+        single write.
+        
+        Args:
+            session: Session that just logged in
+            announce: tell the rest of the chat the user is back
+        """
+        name = session.name
+        self.sync_groups([name])
+        if self.spool is None:
+            return
+        payloads, dropped = self.spool.take(name)
+        if not session.group_id and not payloads:
+            return
+        
+        if session.group_id:
+            others = self.group.get_other_members(name)
+            status = f'Back in your chat with {", ".join(others)}'
+            if announce:
+                self.broadcast(others, {
+                    'action': 'status',
+                    'message': f'{name} is back'
+                })
+        else:
+            status = 'Your chat ended while you were away'
+        if payloads:
+            status += f' - {len(payloads)} new message(s)'
+        if dropped:
+            status += f' ({dropped} older ones were dropped)'
+        payloads.insert(0, self.encode_payload({'action': 'status', 'message': status}))
+        
+        # The spooled messages are already JSON - splice them in as they are
+        self.send_payload(session, b'{"action":"batch","messages":[' + b','.join(payloads) + b']}')
+        print(f"[SERVER] Delivered {len(payloads) - 1} spooled message(s) to {name}")
+    
+    def handle_resume(self, session, data):
+        """
+        Handle a reconnecting client taking back its dropped session
+        
+        Expected data:
+        {
+            'action': 'resume',
+            'name': 'alice',
+            'token': '...',               # resume_token from the login reply
+            'last_seq': {'group_1': 57},  # newest seq received, per group
+            'capabilities': ['binary']    # optional, as for login
+        }
+        
+        Within resume_grace of the drop the user gets their name and chat
+        back without the other members ever hearing of it, and one batch
+        with the chat's messages after last_seq. Otherwise the reply is an
+        error and the client should log in again.
+        """
+        try:
+            name = data.get('name')
+            token = data.get('token')
+            if not isinstance(name, str) or session.name:
+                name = None
+            
+            live = self.sessions.get_name(name)
+            if live is not None and tokens_match(token, live.resume_token):
+                # The old connection is dead, but the server has not seen
+                # it fail yet - drop (and park) it now
+                self.handle_disconnect(live)
+            
+            parked = self.parked.get(name)
+            if parked is None or not parked.matches(token) or not self.claim_name(session, name):
+                self.send_json(session, {
+                    'action': 'resume',
+                    'status': 'error',
+                    'message': 'Session can no longer be resumed'
+                })
+                return
+            del self.parked[name]
+            parked.timer.cancel()
+            
+            self.start_session(session, data, {
+                'action': 'resume',
+                'status': 'success',
+                'message': f'Welcome back {name}!'
+            })
+            
+            last_seq = data.get('last_seq')
+            if not isinstance(last_seq, dict):
+                last_seq = {}
+            self.replay_missed(session, parked.group_id, last_seq.get(parked.group_id, 0))
+            
+        except Exception as e:
+            print(f"[SERVER] Resume error: {e}")
+    
+    def replay_missed(self, session, group_id, last_seq):
+        """
+        Send a resumed session everything it missed, as one 'batch' frame
+        
+        Chat messages come from the spool merged with the group's history
+        from seq last_seq on, so messages lost in flight when the old
+        connection died are replayed too. Other spooled notices follow in
+        the order they were sent.
+        
+        Args:
+            session: the resumed Session
+            group_id: chat the user was in when the connection dropped
+            last_seq: newest seq of that chat the client received
+        """
+        name = session.name
+        self.sync_groups([name])
+        if not isinstance(last_seq, int):
+            last_seq = 0
+        
+        payloads, dropped = self.spool.take(name)
+        missed = {}  # seq -> incoming message
+        notices = []
+        for payload in payloads:
+            data = chat_codec.loads(payload)
+            if data.get('action') == 'incoming' and data.get('group_id') == group_id:
+                missed[data['seq']] = data
+            else:
+                notices.append(data)
+        
+        newest = max(self.history.last(group_id), self.logged_seq(group_id))
+        if newest > last_seq:
+            for record in self.history_page(group_id, newest + 1,
+                                            min(newest - last_seq, HISTORY_PAGE_MAX)):
+                if record['from'] != name:
+                    missed[record['seq']] = {
+                        'action': 'incoming',
+                        'from': record['from'],
+                        'message': record['message'],
+                        'timestamp': record['timestamp'],
+                        'group_id': group_id,
+                        'seq': record['seq'],
+                        'msg_id': f"{group_id}:{record['seq']}"
+                    }
+        messages = [missed[seq] for seq in sorted(missed) if seq > last_seq]
+        
+        if session.group_id == group_id:
+            status = f'Reconnected - {len(messages)} missed message(s)'
+        else:
+            status = 'Reconnected - your chat ended while you were away'
+        if dropped:
+            status += f' ({dropped} older notices were dropped)'
+        self.send_json(session, {
+            'action': 'batch',
+            'messages': [{'action': 'status', 'message': status}] + notices + messages
+        })
+        print(f"[SERVER] {name} resumed, replayed {len(messages)} message(s)")
+    
+    def handle_connect(self, session, data):
         """Handle connection request (2-person chat)"""
         try:
-            from_name = self.logged_sock2name.get(sock)
+            from_name = session.name
             to_name = data.get('to', '')
             
             if not from_name:
                 print(f"[DEBUG] from_name is None!") 
                 return
             
-            if to_name not in self.clients:
+            if not self.is_online(to_name):
                 print(f"[DEBUG] {to_name} not in clients!") 
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'connect',
                     'status': 'error',
                     'message': f'{to_name} not found'
@@ -165,34 +756,33 @@ class Server:
             print(f"[DEBUG] group.connect returned: {result}")
             
             if not result:
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'connect',
                     'status': 'error',
                     'message': 'Connection failed (user busy?)'
                 })
                 return
+            self.sync_groups([from_name, to_name])
             
             # Notify both users
-            self.send_json(sock, {
+            self.send_json(session, {
                 'action': 'connect',
                 'status': 'success',
                 'message': f'Connected to {to_name}'
             })
             
-            to_sock = self.clients.get(to_name)
-            if to_sock:
-                self.send_json(to_sock, {
-                    'action': 'connect',
-                    'status': 'success',
-                    'message': f'Connected to {from_name}'
-                })
+            self.broadcast([to_name], {
+                'action': 'connect',
+                'status': 'success',
+                'message': f'Connected to {from_name}'
+            })
             
             print(f"[SERVER] {from_name} ↔ {to_name}")
             
         except Exception as e:
             print(f"[SERVER] Connect error: {e}")
     
-    def handle_create_group(self, sock, data):
+    def handle_create_group(self, session, data):
         """
         NEW METHOD: Handle group creation (3+ people)
         
@@ -203,11 +793,11 @@ class Server:
         }
         """
         try:
-            creator = self.logged_sock2name.get(sock)
+            creator = session.name
             members_list = data.get('members', [])
             
             if not creator:
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'error',
                     'message': 'You must be logged in'
                 })
@@ -218,9 +808,9 @@ class Server:
                 members_list.insert(0, creator)
             
             # Validate all members exist
-            invalid_members = [m for m in members_list if m not in self.clients]
+            invalid_members = [m for m in members_list if not self.is_online(m)]
             if invalid_members:
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'error',
                     'message': f'Users not found: {", ".join(invalid_members)}'
                 })
@@ -230,34 +820,32 @@ class Server:
             success, result = self.group.create_group(members_list)
             
             if not success:
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'error',
                     'message': result
                 })
                 return
             
             group_id = result
+            self.sync_groups(members_list)
             
             # Notify all members
-            for member in members_list:
-                member_socket = self.clients.get(member)
-                if member_socket:
-                    self.send_json(member_socket, {
-                        'action': 'group_created',
-                        'group_id': group_id,
-                        'members': members_list,
-                        'message': f'Group chat created: {", ".join(members_list)}'
-                    })
+            self.broadcast(members_list, {
+                'action': 'group_created',
+                'group_id': group_id,
+                'members': members_list,
+                'message': f'Group chat created: {", ".join(members_list)}'
+            })
             
             print(f"[SERVER] Group {group_id} created with: {members_list}")
             
         except Exception as e:
             print(f"[SERVER] Create group error: {e}")
     
-    def handle_exchange(self, sock, data):
+    def handle_exchange(self, session, data):
         """Handle message exchange (works for both 2-person and group chats)"""
         try:
-            sender = self.logged_sock2name.get(sock)
+            sender = session.name
             message = data.get('message', '')
             timestamp = data.get('timestamp', '')
             
@@ -265,44 +853,90 @@ class Server:
                 return
             
             # Get sender's group
-            group_id = self.group.get_user_group(sender)
+            group_id = session.group_id
             if not group_id:
-                self.send_json(sock, {
+                self.send_json(session, {
                     'action': 'error',
                     'message': 'You are not in any chat'
                 })
                 return
             
-            # Get all other members in group
-            recipients = self.group.get_other_members(sender)
-            
-            # Send to all recipients
-            for recipient in recipients:
-                recipient_sock = self.clients.get(recipient)
-                if recipient_sock:
-                    self.send_json(recipient_sock, {
-                        'action': 'incoming',
-                        'from': sender,  # IMPORTANT: Include sender name
-                        'message': message,
-                        'timestamp': timestamp
-                    })
-            
-            print(f"[SERVER] {sender} → {recipients}: {message[:50]}...")
+            record = {
+                'from': sender,
+                'message': message,
+                'timestamp': timestamp,
+                'time': time.time()
+            }
+            self.publish_message(session, group_id, record, data.get('ref'))
             
         except Exception as e:
             print(f"[SERVER] Exchange error: {e}")
     
-    def handle_disconnect_request(self, sock, data):
+    def publish_message(self, session, group_id, record, ref=None):
+        """
+        Number a chat message, store it and deliver it to its group
+        
+        Args:
+            session: sender's Session
+            group_id: sender's group
+            record: message dict ('from', 'message', 'timestamp', 'time')
+            ref: sender's reference for the message, echoed back with its seq
+        """
+        seq = max(self.history.last(group_id), self.logged_seq(group_id)) + 1
+        if self.message_log:
+            # Queued in memory; the log's commit thread writes it
+            self.message_log.append(group_id, record, seq)
+        self.history.append(group_id, record, seq)
+        self.deliver_message(session, group_id, seq, record, ref,
+                             self.group.get_other_members(record['from']))
+    
+    def deliver_message(self, session, group_id, seq, record, ref, recipients):
+        """
+        Send a numbered chat message to its recipients and its seq to the sender
+        
+        Args:
+            session: sender's Session, or None if the sender is not connected here
+            group_id: chat group of the message
+            seq: the message's sequence number within the group
+            record: message dict
+            ref: sender's reference for the message, or None
+            recipients: names to deliver the message to
+        """
+        msg_id = f'{group_id}:{seq}'
+        if session is not None and ref is not None:
+            # Tells the sender which seq its message got, for receipts
+            self.send_json(session, {
+                'action': 'sent',
+                'ref': ref,
+                'group_id': group_id,
+                'seq': seq,
+                'msg_id': msg_id
+            })
+        
+        # Send to all recipients (encoded once, shared by all)
+        self.broadcast(recipients, {
+            'action': 'incoming',
+            'from': record['from'],  # IMPORTANT: Include sender name
+            'message': record['message'],
+            'timestamp': record['timestamp'],
+            'group_id': group_id,
+            'seq': seq,
+            'msg_id': msg_id
+        })
+        
+        print(f"[SERVER] {record['from']} → {recipients}: {record['message'][:50]}...")
+    
+    def handle_disconnect_request(self, session, data):
         """Handle explicit disconnect request"""
-        self.handle_disconnect(sock)
+        self.handle_disconnect(session, leaving=True)
     
-    def handle_who(self, sock):
+    def handle_who(self, session, data=None):
         """Handle 'who is online' request"""
         try:
-            requester = self.logged_sock2name.get(sock)
-            users = [name for name in self.clients.keys() if name != requester]
+            requester = session.name
+            users = [name for name in self.online_names() if name != requester]
             
-            self.send_json(sock, {
+            self.send_json(session, {
                 'action': 'who',
                 'users': users
             })
@@ -310,56 +944,302 @@ class Server:
         except Exception as e:
             print(f"[SERVER] Who error: {e}")
     
-    def handle_disconnect(self, sock):
-        """Handle client disconnection"""
+    def handle_history(self, session, data):
+        """
+        Handle a history request for the sender's current chat
+        
+        Expected data:
+        {
+            'action': 'history',
+            'before': 120,  # optional cursor from the previous page
+            'limit': 50     # optional page size
+        }
+        
+        Replies with the messages just before the cursor, oldest first,
+        and the cursor for the next page up (None once nothing older is
+        left to send).
+        """
         try:
-            name = self.logged_sock2name.get(sock)
+            group_id = session.group_id
+            if not group_id:
+                self.send_json(session, {
+                    'action': 'error',
+                    'message': 'You are not in any chat'
+                })
+                return
+            
+            before = data.get('before')
+            limit = data.get('limit', HISTORY_PAGE)
+            if not isinstance(limit, int) or limit <= 0:
+                limit = HISTORY_PAGE
+            limit = min(limit, HISTORY_PAGE_MAX)
+            if not isinstance(before, int):
+                before = max(self.history.last(group_id), self.logged_seq(group_id)) + 1
             
-            if name:
+            records = self.history_page(group_id, before, limit)
+            
+            # Without a log, nothing older than the ring can be served
+            floor = 1 if self.message_log else self.history.first(group_id)
+            oldest = records[0]['seq'] if records else before
+            self.send_json(session, {
+                'action': 'history',
+                'group_id': group_id,
+                'messages': [{
+                    'from': record['from'],
+                    'message': record['message'],
+                    'timestamp': record['timestamp'],
+                    'seq': record['seq']
+                } for record in records],
+                'cursor': oldest if oldest > floor else None
+            })
+            
+        except Exception as e:
+            print(f"[SERVER] History error: {e}")
+    
+    def history_page(self, group_id, before, limit):
+        """
+        Up to `limit` messages of a group with seq < before, oldest first
+        
+        Served from the ring, and from the log for what the ring no
+        longer holds. With --workers or --broker each process logs only
+        the messages its own users sent, so what comes from the log
+        there has gaps: older history is incomplete in those modes.
+        """
+        messages = self.history.page(group_id, before, limit)
+        top = messages[0]['seq'] if messages else before
+        if self.message_log and top > 1 and len(messages) < limit:
+            # Older than the ring remembers - page in from the log. A
+            # log with gaps reads on past top, into what the ring holds
+            start = max(1, top - (limit - len(messages)))
+            older = [record for record in self.message_log.read(group_id, start, top - start)
+                     if record['seq'] < top]
+            messages = older + messages
+        return messages
+    
+    def handle_ack(self, session, data):
+        """
+        Handle a cumulative delivery/read acknowledgement
+        
+        Expected data:
+        {
+            'action': 'ack',
+            'group_id': 'group_1',
+            'delivered': 57,  # every message up to seq 57 arrived
+            'seen': 55        # optional: and up to seq 55 was shown
+        }
+        
+        Nothing is sent back; positions that moved reach the group in
+        the next flush_receipts() batch.
+        """
+        group_id = data.get('group_id')
+        if not session.name or group_id != session.group_id:
+            return  # Late ack for a chat the user already left
+        delivered = data.get('delivered', 0)
+        seen = data.get('seen', 0)
+        if not isinstance(delivered, int) or not isinstance(seen, int):
+            return
+        self.receipts.ack(group_id, session.name, delivered, seen)
+        self.flush_receipts()
+    
+    def flush_receipts(self):
+        """
+        Send every group the positions that moved, at most once per RECEIPT_INTERVAL
+        
+        One 'receipts' message per group carries all members' changes:
+        {'action': 'receipts', 'group_id': ..., 'positions': {name: [delivered, seen]}}
+        """
+        now = time.monotonic()
+        if now < self.next_receipts:
+            return
+        self.next_receipts = now + RECEIPT_INTERVAL
+        for group_id, positions in self.receipts.take().items():
+            members = self.group.get_group_members(group_id)
+            if not members:
+                self.receipts.forget(group_id)
+                self.history.forget(group_id)
+                continue
+            if self.spool is not None:
+                # Outdated by the time anyone returns - never spool them
+                members = [m for m in members if self.sessions.get_name(m)]
+            self.broadcast(members, {
+                'action': 'receipts',
+                'group_id': group_id,
+                'positions': positions
+            })
+    
+    def logged_seq(self, group_id):
+        """Newest sequence number in the durable log (0 without a log)"""
+        return self.message_log.last(group_id) if self.message_log else 0
+    
+    def handle_disconnect(self, session, leaving=False):
+        """
+        Handle client disconnection
+        
+        Args:
+            session: Session to tear down
+            leaving: True when the user asked to quit; a connection that
+                merely dropped keeps its place in the chat, and messages
+                for it are spooled until the user logs back in
+        """
+        if session.closed:
+            return
+        
+        try:
+            session.closed = True
+            name = session.name
+            
+            if name and not leaving and self.spool is not None and session.group_id:
+                self.release_name(name)
+                if self.resume_grace and session.resume_token:
+                    # Kept quiet for now: a client back within the grace
+                    # resumes as if nothing had happened
+                    parked = self.parked[name] = ParkedSession(name, session.resume_token,
+                                                               session.group_id)
+                    parked.timer = self.timers.schedule(self.resume_grace, self.expire_parked, parked)
+                    print(f"[SERVER] {name} dropped, parking their session")
+                else:
+                    self.announce_offline(name)
+                    print(f"[SERVER] {name} dropped, spooling their messages")
+            elif name:
                 # Get group info before disconnecting
+                members = list(self.group.get_group_members(session.group_id))
                 group_id, remaining = self.group.disconnect(name)
+                self.sync_groups(members)
+                self.release_name(name)
                 
-                # Notify remaining members
-                if group_id and remaining:
-                    for member in remaining:
-                        member_sock = self.clients.get(member)
-                        if member_sock:
-                            self.send_json(member_sock, {
-                                'action': 'disconnect',
-                                'message': f'{name} left the chat'
-                            })
-                
-                # Clean up
-                del self.clients[name]
-                del self.logged_name2sock[name]
-                del self.logged_sock2name[sock]
+                # Notify the other members - including one left alone,
+                # whose chat has just ended
+                self.announce_left(name, group_id, [m for m in members if m != name])
                 
                 print(f"[SERVER] {name} disconnected")
             
-            # Remove socket
-            if sock in self.all_sockets:
-                self.all_sockets.remove(sock)
+            # Clean up (every index drops the session in O(1))
+            if session.timer:
+                session.timer.cancel()
+                session.timer = None
+            self.update_interest(session)
+            self.sessions.remove(session)
+            self.lagging.discard(session)
+            self.dead_sessions.discard(session)
+            self.throttled.discard(session)
+            session.outbound = None
+            session.held = None
             
-            sock.close()
+            self.close_connection(session)
             
         except Exception as e:
             print(f"[SERVER] Disconnect error: {e}")
     
-    def handle_legacy_command(self, sock, msg):
+    def announce_left(self, name, group_id, others):
+        """
+        Tell the rest of a chat that a member has left it
+        
+        Args:
+            name: the member who left
+            group_id: the chat they left (None if they were in none)
+            others: the members to notify
+        """
+        if group_id and not self.group.get_group_members(group_id):
+            # Group ids are never reused, so nothing of it is needed again
+            self.receipts.forget(group_id)
+            self.history.forget(group_id)
+        if group_id and others:
+            self.broadcast(others, {
+                'action': 'disconnect',
+                'message': f'{name} left the chat'
+            })
+    
+    def announce_offline(self, name):
+        """Tell a dropped member's chat that their messages are being kept"""
+        self.broadcast(self.group.get_other_members(name), {
+            'action': 'status',
+            'message': f'{name} went offline - messages will be delivered when they return'
+        })
+    
+    def expire_parked(self, parked):
+        """Timer callback: give up on a parked session whose grace ran out"""
+        name = parked.name
+        if self.parked.get(name) is not parked:
+            return
+        del self.parked[name]
+        if self.group.is_in_group(name):
+            self.announce_offline(name)
+        print(f"[SERVER] {name} did not resume, spooling their messages")
+    
+    def watch(self, session):
+        """Start a new connection's liveness timer: it has LOGIN_TIMEOUT to log in"""
+        session.timer = self.timers.schedule(LOGIN_TIMEOUT, self.check_liveness, session)
+    
+    def check_liveness(self, session):
+        """
+        Timer callback: ping a quiet connection, drop a dead one
+        
+        Frames do not touch the timer. It looks at session.last_active
+        when it fires and sleeps for the rest of the interval, so a busy
+        connection costs one timer event per interval, not one per frame.
+        A connection quiet for a whole interval also gives back its
+        receive buffer. Clients that did not negotiate heartbeats are
+        never pinged.
+        """
+        session.timer = None
+        if session.closed:
+            return
+        if not session.name:
+            print(f"[SERVER] Closing connection fd={session.fd}: no login within {LOGIN_TIMEOUT}s")
+            self.handle_disconnect(session)
+            return
+        
+        now = time.monotonic()
+        quiet = now - session.last_active
+        if quiet >= self.heartbeat_interval and session.decoder:
+            session.decoder.release()
+        if not session.heartbeat:
+            delay = self.heartbeat_interval - quiet if quiet < self.heartbeat_interval else self.heartbeat_interval
+            session.timer = self.timers.schedule(delay, self.check_liveness, session)
+            return
+        
+        if session.ping_sent is not None and session.last_active >= session.ping_sent:
+            session.ping_sent = None  # Answered (any frame will do)
+        if quiet < self.heartbeat_interval:
+            delay = self.heartbeat_interval - quiet
+        elif session.ping_sent is None:
+            session.ping_sent = now
+            self.send_json(session, {'action': 'ping'})
+            delay = self.heartbeat_timeout
+        else:
+            # A dropped member in a chat is parked, so a client that was
+            # only cut off can still resume
+            print(f"[SERVER] {session.name} did not answer a ping, dropping the connection")
+            self.handle_disconnect(session)
+            return
+        session.timer = self.timers.schedule(delay, self.check_liveness, session)
+    
+    def handle_ping(self, session, data):
+        """Answer a client checking that the connection is alive"""
+        self.send_json(session, {'action': 'pong'})
+    
+    def handle_pong(self, session, data):
+        """Nothing to do - any frame counts as activity (see check_liveness)"""
+    
+    def close_connection(self, session):
+        """Close the session's underlying connection"""
+        session.sock.close()
+    
+    def handle_legacy_command(self, session, msg):
         """Handle old text-based commands for backward compatibility"""
         try:
             parts = msg.split()
             command = parts[0] if parts else ''
             
             if command == 'connect' and len(parts) >= 2:
-                self.handle_connect(sock, {'to': parts[1]})
+                self.handle_connect(session, {'to': parts[1]})
             elif command == 'who':
-                self.handle_who(sock)
+                self.handle_who(session)
             elif command == 'q':
-                self.handle_disconnect(sock)
+                self.handle_disconnect(session, leaving=True)
             else:
                 # Try to send as message
-                self.handle_exchange(sock, {
+                self.handle_exchange(session, {
                     'message': msg,
                     'timestamp': ''
                 })
@@ -367,24 +1247,337 @@ class Server:
         except Exception as e:
             print(f"[SERVER] Legacy command error: {e}")
     
-    def send_json(self, sock, data):
-        """Helper: Send JSON message to socket"""
+    def send_json(self, session, data):
+        """Helper: Send JSON message to a session"""
         try:
-            json_str = json.dumps(data)
-            mysend(sock, json_str)
+            self.send_payload(session, self.encode_payload(data, session.wire_format))
         except Exception as e:
             print(f"[SERVER] Send error: {e}")
     
+    def send_payload(self, session, payload):
+        """Compress (if negotiated), frame and queue a serialized message"""
+        if session.compressor:
+            payload = session.compressor.compress(payload)
+        self.send_frame(session, encode_frame(payload))
+    
+    def broadcast(self, names, data):
+        """
+        Send the same JSON message to several users
+        
+        The message is serialized and framed once per wire format and
+        the resulting bytes object is queued for every recipient using
+        that format, so a group of N members costs at most two encodes
+        instead of N. Recipients with a deflate stream still compress
+        their copy individually, since every stream has its own context.
+        
+        Args:
+            names: usernames to deliver to (offline names are skipped,
+                or spooled if they are still members of a chat)
+            data: message dict
+        """
+        payloads = {}  # wire format -> payload
+        frames = {}  # wire format -> uncompressed frame
+        for name in names:
+            session = self.sessions.get_name(name)
+            if not session and (self.spool is None or not self.group.is_in_group(name)):
+                continue
+            
+            # The spool keeps JSON, the format every client can read
+            wire_format = session.wire_format if session else None
+            payload = payloads.get(wire_format)
+            if payload is None:
+                try:
+                    payload = payloads[wire_format] = self.encode_payload(data, wire_format)
+                except Exception as e:
+                    print(f"[SERVER] Send error: {e}")
+                    return
+            if not session:
+                self.spool.add(name, payload)
+                continue
+            
+            compressor = session.compressor
+            if compressor and len(payload) >= compressor.threshold:
+                self.send_frame(session, encode_frame(compressor.compress(payload)))
+                continue
+            
+            frame = frames.get(wire_format)
+            if frame is None:
+                frame = frames[wire_format] = encode_frame(payload)
+            self.send_frame(session, frame)
+    
+    def encode_payload(self, data, wire_format=None):
+        """
+        Serialize a message dict for a connection's negotiated format
+        
+        Args:
+            data: message dict
+            wire_format: 'binary', or None for JSON
+            
+        Returns:
+            bytes payload (JSON whenever the action has no binary code)
+        """
+        if wire_format == chat_wire.BINARY_CAPABILITY:
+            payload = chat_wire.encode(data)
+            if payload is not None:
+                return payload
+        return chat_codec.dumps(data)
+    
+    def send_frame(self, session, frame):
+        """
+        Queue an encoded frame on the session's outbound buffer
+        
+        Writes as much as the kernel accepts right away and leaves the
+        rest for the select() loop, so a full TCP window never blocks
+        the server.
+        
+        Args:
+            session: destination Session
+            frame: length-prefixed bytes from encode_frame
+        """
+        if session.closed or session in self.dead_sessions:
+            return
+        session.frames_out += 1
+        session.bytes_out += len(frame)
+        
+        queue = session.outbound
+        if queue is None:
+            # Nothing queued yet - try to skip the queue entirely
+            try:
+                sent = session.sock.send(frame)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
+                print(f"[SERVER] Send error: {e}")
+                self.dead_sessions.add(session)
+                return
+            if sent == len(frame):
+                return
+            queue = session.outbound = OutboundQueue()
+            self.update_interest(session)
+            if sent:
+                frame = memoryview(frame)[sent:]
+        
+        queue.append(frame)
+        self.track_backpressure(session, len(queue))
+    
+    def flush_outbound(self, session):
+        """Write queued bytes to a socket that select() reported writable"""
+        queue = session.outbound
+        if queue:
+            try:
+                queue.write_to(session.sock)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"[SERVER] Send error: {e}")
+                self.dead_sessions.add(session)
+                return
+        
+        if not queue:
+            session.outbound = None
+            self.update_interest(session)
+        self.track_backpressure(session, self.queue_depth(session))
+    
+    def track_backpressure(self, session, depth):
+        """
+        Apply the high/low watermarks to a session's queue depth
+        
+        A client whose queue reaches high_watermark stops being read
+        until it drains below low_watermark. reap_connections drops it
+        if it stays over the limit for slow_consumer_timeout seconds.
+        """
+        if depth >= self.high_watermark:
+            if session.lagging_since is None:
+                session.lagging_since = time.monotonic()
+                self.lagging.add(session)
+                self.update_interest(session)
+                print(f"[SERVER] {session.name or 'unknown'} is lagging ({depth} bytes queued)")
+        elif depth <= self.low_watermark and session.lagging_since is not None:
+            session.lagging_since = None
+            self.lagging.discard(session)
+            self.update_interest(session)
+    
+    def update_interest(self, session):
+        """
+        Register exactly the events a session needs with the selector
+        
+        Read interest is dropped while the client is lagging or throttled,
+        and write interest is only held while its outbound queue is
+        non-empty, so idle connections never wake the loop.
+        """
+        events = 0
+        if not session.closed:
+            if session.lagging_since is None and session.held is None:
+                events |= selectors.EVENT_READ
+            if session.outbound is not None:
+                events |= selectors.EVENT_WRITE
+        if events == session.events:
+            return
+        
+        if not session.events:
+            self.selector.register(session.sock, events, session)
+        elif not events:
+            self.selector.unregister(session.sock)
+        else:
+            self.selector.modify(session.sock, events, session)
+        session.events = events
+    
+    def queue_depth(self, session):
+        """Number of outbound bytes still waiting for a session"""
+        queue = session.outbound
+        return len(queue) if queue else 0
+    
+    def queue_depths(self):
+        """
+        Report outbound queue depth for every logged in client
+        
+        Returns:
+            {name: queued_bytes}
+        """
+        return {name: self.queue_depth(session)
+                for name, session in self.sessions.by_name.items()}
+    
+    def reap_connections(self):
+        """
+        Close sessions whose sends failed or that stayed over the limit,
+        and run the timers that are due
+        """
+        now = time.monotonic()
+        for session in list(self.lagging):
+            self.track_backpressure(session, self.queue_depth(session))
+            since = session.lagging_since
+            if since is not None and now - since >= self.slow_consumer_timeout:
+                print(f"[SERVER] Disconnecting slow consumer {session.name or 'unknown'} "
+                      f"({self.queue_depth(session)} bytes queued)")
+                self.dead_sessions.add(session)
+        
+        for session in list(self.dead_sessions):
+            self.dead_sessions.discard(session)
+            session.outbound = None
+            self.handle_disconnect(session)
+        
+        self.timers.advance(now)
+    
     def shutdown(self):
         """Shutdown server gracefully"""
         print("[SERVER] Closing all connections...")
-        for sock in self.all_sockets:
+        for session in self.sessions:
             try:
-                sock.close()
+                self.close_connection(session)
             except:
                 pass
+        try:
+            self.selector.close()
+            self.server_socket.close()
+        except:
+            pass
+        if self.message_log:
+            self.message_log.close()
+        if self.spool is not None:
+            self.spool.close()
         print("[SERVER] Shutdown complete")
 
+def raise_fd_limit():
+    """Lift the soft open-file limit to the hard limit so 10k+ clients fit"""
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:
+        hard = max(soft, 65536)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            print(f"[SERVER] Could not raise open file limit: {e}")
+
+def main():
+    """Parse command line options and start the chosen server engine"""
+    parser = argparse.ArgumentParser(description="ICS chat server")
+    parser.add_argument('--port', type=int, default=CHAT_PORT,
+                        help=f"port to listen on (default {CHAT_PORT})")
+    parser.add_argument('--engine', choices=['select', 'asyncio'], default='select',
+                        help="event loop to serve clients with: select (selectors/epoll, "
+                             "the default) or asyncio")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes sharing the port via SO_REUSEPORT "
+                             "(default 1, Linux only)")
+    parser.add_argument('--broker', metavar='HOST:PORT',
+                        help="join a cluster through the broker at HOST:PORT "
+                             "(see chat_broker.py)")
+    parser.add_argument('--log-dir',
+                        help="directory for the durable message log (default: no log); "
+                             "with --workers or --broker each process logs only its "
+                             "own users' messages, so older history has gaps")
+    parser.add_argument('--history-size', type=int, default=HISTORY_SIZE,
+                        help=f"recent messages kept in memory per group "
+                             f"(default {HISTORY_SIZE})")
+    parser.add_argument('--spool-dir',
+                        help="directory for offline spools that outgrow memory "
+                             "(default: a temporary directory)")
+    parser.add_argument('--resume-grace', type=float, default=RESUME_GRACE,
+                        help=f"seconds a dropped client may take to resume its session "
+                             f"(default {RESUME_GRACE}, 0 to disable)")
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+                        help=f"seconds of silence before a client is pinged "
+                             f"(default {HEARTBEAT_INTERVAL})")
+    parser.add_argument('--heartbeat-timeout', type=float, default=HEARTBEAT_TIMEOUT,
+                        help=f"seconds a pinged client has to answer before it is dropped "
+                             f"(default {HEARTBEAT_TIMEOUT})")
+    parser.add_argument('--high-watermark', type=int, default=OUTBOUND_HIGH_WATERMARK,
+                        help="queued bytes at which a client counts as lagging")
+    parser.add_argument('--low-watermark', type=int, default=OUTBOUND_LOW_WATERMARK,
+                        help="queued bytes at which a lagging client recovers")
+    parser.add_argument('--compress-threshold', type=int, default=COMPRESS_THRESHOLD,
+                        help="smallest payload compressed for deflate clients")
+    parser.add_argument('--slow-consumer-timeout', type=float, default=SLOW_CONSUMER_TIMEOUT,
+                        help="seconds a client may stay lagging before it is dropped")
+    parser.add_argument('--rate-limit', action='append', default=[], metavar='ACTION=RATE:BURST',
+                        help="per-client token bucket for an action ('*' for all frames), "
+                             "e.g. exchange=20:40; repeatable, overrides the defaults")
+    parser.add_argument('--no-rate-limit', action='store_true',
+                        help="do not rate limit clients")
+    args = parser.parse_args()
+    if args.broker and args.workers > 1:
+        parser.error("--broker and --workers cannot be combined")
+    rate_limits = None
+    if not args.no_rate_limit:
+        rate_limits = dict(RATE_LIMITS)
+        try:
+            rate_limits.update(parse_limit(text) for text in args.rate_limit)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    options = {
+        'high_watermark': args.high_watermark,
+        'low_watermark': args.low_watermark,
+        'slow_consumer_timeout': args.slow_consumer_timeout,
+        'compress_threshold': args.compress_threshold,
+        'log_dir': args.log_dir,
+        'history_size': args.history_size,
+        'spool_dir': args.spool_dir,
+        'resume_grace': args.resume_grace,
+        'heartbeat_interval': args.heartbeat_interval,
+        'heartbeat_timeout': args.heartbeat_timeout,
+        'rate_limits': rate_limits,
+    }
+    raise_fd_limit()
+    if args.broker:
+        from chat_server_workers import serve_node
+        host, _, broker_port = args.broker.rpartition(':')
+        serve_node(args.port, (host or 'localhost', int(broker_port)), **options)
+        return
+    if args.workers > 1:
+        from chat_server_workers import serve_workers
+        serve_workers(args.port, args.workers, **options)
+        return
+    if args.engine == 'asyncio':
+        from chat_server_async import AsyncServer
+        server = AsyncServer(args.port, **options)
+    else:
+        server = Server(args.port, **options)
+    server.run()
+
 if __name__ == '__main__':
-    server = Server()
-    server.run()
\ No newline at end of file
+    main()
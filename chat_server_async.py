@@ -0,0 +1,129 @@
+"""
+chat_server_async.py - asyncio engine for the chat server
+Runs every connection as its own reader task so a slow client never
+stalls the others. Start it with: python chat_server.py --engine asyncio
+"""
+import asyncio
+from chat_utils import HEADER, HEADER_SIZE, CHAT_PORT, MAX_FRAME_SIZE, LOGIN_FRAME_SIZE
+from chat_server import Server, ACCEPT_BACKLOG
+from chat_session import Session
+from chat_receipts import RECEIPT_INTERVAL
+
+# Seconds between slow-consumer sweeps
+REAP_INTERVAL = 1
+
+class AsyncServer(Server):
+    """
+    asyncio flavour of Server
+
+    Every connection gets a Session whose sock is its
+    asyncio.StreamWriter, so the inherited handle_* methods work
+    unchanged. Login, connect, groups and exchange therefore behave
+    exactly as they do under the select() loop.
+    """
+
+    def __init__(self, port=CHAT_PORT, **options):
+        super().__init__(port, **options)
+        # The event loop watches the sockets itself
+        self.selector.unregister(self.server_socket)
+
+    def run(self):
+        """Main server loop"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n[SERVER] Shutting down...")
+
+        self.shutdown()
+
+    async def serve(self):
+        """Accept connections on the listening socket until cancelled"""
+        server = await asyncio.start_server(self.handle_connection,
+                                            sock=self.server_socket,
+                                            backlog=ACCEPT_BACKLOG)
+        print("[SERVER] asyncio engine running")
+        reaper = asyncio.create_task(self.reap_forever())
+        receipts = asyncio.create_task(self.flush_receipts_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reaper.cancel()
+            receipts.cancel()
+
+    async def reap_forever(self):
+        """Periodically drop slow consumers and failed connections, and run due timers"""
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            self.reap_connections()
+
+    async def flush_receipts_forever(self):
+        """Broadcast batched delivery/read receipts"""
+        while True:
+            await asyncio.sleep(RECEIPT_INTERVAL)
+            self.flush_receipts()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Reader task for one client connection
+
+        Args:
+            reader: asyncio.StreamReader for the connection
+            writer: asyncio.StreamWriter, used as the connection handle
+        """
+        address = writer.get_extra_info('peername')
+        # drain() below then pauses reading this client while its own
+        # replies are backed up past the high watermark
+        writer.transport.set_write_buffer_limits(high=self.high_watermark,
+                                                 low=self.low_watermark)
+        session = Session(writer, writer.get_extra_info('socket').fileno())
+        self.sessions.add(session)
+        self.watch(session)
+        print(f"[SERVER] New connection from {address}")
+
+        try:
+            while not session.closed and not writer.is_closing():
+                header = await reader.readexactly(HEADER_SIZE)
+                length = HEADER.unpack(header)[0]
+                # Same limits as FrameDecoder in the select() engine
+                limit = MAX_FRAME_SIZE if session.name else LOGIN_FRAME_SIZE
+                if length > limit:
+                    print(f"[SERVER] Error handling message: Frame of {length} bytes exceeds limit")
+                    break
+                payload = await reader.readexactly(length)
+
+                self.process_message(session, payload)
+                while session.held is not None and not session.closed:
+                    # Over its rate limits: this client is not read again
+                    # until its held frames have been handled
+                    await asyncio.sleep(session.limiter.wait)
+                    self.drain_held(session)
+
+                if not writer.is_closing():
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Client went away mid-frame or between frames
+            pass
+        except Exception as e:
+            print(f"[SERVER] Error handling message: {e}")
+
+        self.handle_disconnect(session)
+
+    def update_interest(self, session):
+        """Nothing to do - transports manage their own readiness"""
+
+    def schedule_drain(self, session, wait):
+        """Nothing to do - the reader task drains held frames itself"""
+
+    def send_frame(self, session, frame):
+        """Queue an encoded frame on the connection's transport buffer"""
+        if session.closed or session.sock.is_closing():
+            return
+        session.frames_out += 1
+        session.bytes_out += len(frame)
+        session.sock.write(frame)
+        self.track_backpressure(session, self.queue_depth(session))
+
+    def queue_depth(self, session):
+        """Number of outbound bytes still buffered in the transport"""
+        return session.sock.transport.get_write_buffer_size()
@@ -0,0 +1,335 @@
+"""
+chat_server_workers.py - Multi-process and multi-node engines for the chat server
+Forks several worker processes that all accept on the chat port through
+SO_REUSEPORT, plus a broker (see chat_broker.py) that keeps presence and
+groups consistent between them and relays messages across workers.
+Start it with: python chat_server.py --workers 4 (Linux only)
+
+The same worker logic also runs as a cluster node: a separate
+chat_server.py that joins a standalone broker over TCP, so users on
+different machines can chat and share groups.
+Start it with: python chat_server.py --port 1114 --broker HOST:1113
+"""
+import multiprocessing
+import os
+import selectors
+import socket
+from collections import deque
+from chat_utils import encode_frame, FrameDecoder, CHAT_PORT
+from chat_server import Server
+from chat_broker import (Broker, ClusterState, BROKER_ID, encode_op, encode_deliver,
+                         is_deliver, decode_deliver, encode_publish, is_stamped,
+                         decode_stamped)
+import chat_codec
+
+# Seconds a node waits for the broker when joining
+JOIN_TIMEOUT = 10
+
+class ReplicatedGroup:
+    """
+    Group stand-in for worker processes
+
+    Lookups read the worker's replica directly; changes are sequenced
+    through the broker so every worker applies them in the same order.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def __getattr__(self, attr):
+        # get_user_group, get_other_members, ... read the local replica
+        return getattr(self.server.state.group, attr)
+
+    def add_user(self, username):
+        """Already registered by the login op"""
+
+    def connect(self, user1, user2):
+        return self.server.sequence('connect', user1, user2)
+
+    def create_group(self, members):
+        return self.server.sequence('create_group', members)
+
+    def disconnect(self, username):
+        return self.server.sequence('disconnect', username)
+
+class WorkerServer(Server):
+    """
+    One worker process of the multi-process engine, or one cluster node
+
+    Serves its share of the connections with the normal select() loop.
+    Names and groups are claimed through the broker, and messages for
+    users connected to another worker are handed to the broker, which
+    forwards them to that worker's broadcast(). Chat messages of a group
+    with members elsewhere are numbered by the broker, which sends them
+    back to every worker of the group, this one included.
+    """
+
+    def __init__(self, port, worker_id, link, **options):
+        """
+        Args:
+            port: chat port to accept clients on
+            worker_id: index of this worker, or None to take the id (and
+                the current state) from the broker's welcome, as nodes do
+            link: connection to the broker
+            options: Server keyword options
+        """
+        super().__init__(port, **options)
+        self.worker_id = worker_id
+        self.link = link
+        self.link_decoder = FrameDecoder()
+        self.link_backlog = deque()  # frames read from the broker, not yet handled
+        self.next_req = 0
+        self.unstamped = {}  # group id -> messages published, not back from the broker yet
+        self.state = ClusterState()
+        # Server.__init__ reserved the ids in our log on a plain Group
+        next_group_id = self.group.next_group_id
+        self.group = ReplicatedGroup(self)
+        # A returning user may log in on another worker, so dropped
+        # members leave their chat here instead of being spooled or parked
+        self.spool = None
+        self.resume_grace = 0
+        self.selector.register(link, selectors.EVENT_READ, self.handle_link_ready)
+        if worker_id is None:
+            self.join()
+            print(f"[SERVER] Joined the cluster as node {self.worker_id}")
+        else:
+            print(f"[SERVER] Worker {worker_id} ready")
+        if next_group_id > 1:
+            self.sequence('reserve_group_ids', next_group_id)
+
+    def join(self):
+        """Wait for the broker's welcome and load the state it carries"""
+        while not self.link_backlog:
+            self.read_link()
+        welcome = chat_codec.loads(self.link_backlog.popleft())
+        if welcome.get('call') != 'welcome':
+            raise ConnectionError("Broker did not send a welcome")
+        self.worker_id = welcome['node']
+        self.state.load(welcome['state'])
+        self.drain_link()
+
+    def sequence(self, call, *args):
+        """
+        Run a state change through the broker and wait for its turn
+
+        Ops from other workers that arrive first are applied on the way,
+        so the result matches what every other replica computes.
+
+        Returns:
+            the op's result
+        """
+        self.next_req += 1
+        req = self.next_req
+        self.link.sendall(encode_frame(encode_op(call, args, self.worker_id, req)))
+        while True:
+            if not self.link_backlog:
+                self.read_link()
+            op = self.handle_link_frame(self.link_backlog.popleft())
+            if op and op['worker'] == self.worker_id and op['req'] == req:
+                # Frames read past our op would otherwise wait for the
+                # next readiness event, which may never come
+                self.drain_link()
+                return op['result']
+
+    def read_link(self, flags=0):
+        """Read more frames from the broker (blocking unless flags say otherwise)"""
+        if not self.link_decoder.recv_into(self.link, flags):
+            raise ConnectionError("Broker went away")
+        self.link_backlog.extend(self.link_decoder.frames())
+
+    def drain_link(self):
+        """Handle every frame already read from the broker"""
+        while self.link_backlog:
+            self.handle_link_frame(self.link_backlog.popleft())
+
+    def handle_link_ready(self):
+        """Handle every frame the broker sent since the last pass"""
+        try:
+            # A handler's sequence() may already have read what select()
+            # reported, so never block here
+            self.read_link(socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            print(f"[SERVER] Worker {self.worker_id} lost the broker: {e}")
+            self.shutdown()
+            raise SystemExit(1)
+        self.drain_link()
+
+    def handle_link_frame(self, payload):
+        """
+        Apply an op or deliver a relayed message
+
+        Returns:
+            the op dict, with its result under 'result', or None for a delivery
+        """
+        if is_deliver(payload):
+            _, names, data = decode_deliver(payload)
+            Server.broadcast(self, names, data)
+            return None
+        if is_stamped(payload):
+            self.handle_stamped(*decode_stamped(payload))
+            return None
+
+        op = chat_codec.loads(payload)
+        args = op['args']
+        affected = self.names_in(args)
+        for name in list(affected):
+            group_id = self.state.group.get_user_group(name)
+            affected.update(self.state.group.get_group_members(group_id))
+        try:
+            op['result'] = self.state.apply(op['call'], args, op['worker'])
+        except Exception as e:
+            print(f"[SERVER] Op {op['call']} failed: {e}")
+            op['result'] = None
+        self.sync_groups(affected)
+        if op['worker'] == BROKER_ID and op['call'] == 'disconnect' and op['result']:
+            # A user whose worker or node died: nobody else will tell
+            # their chat, so each worker tells the members it holds
+            name = args[0]
+            group_id, _ = op['result']
+            self.announce_left(name, group_id,
+                               [member for member in affected
+                                if member != name and self.state.presence.get(member) == self.worker_id])
+        return op
+
+    def names_in(self, args):
+        """User names mentioned by an op's arguments"""
+        names = set()
+        for arg in args:
+            if isinstance(arg, str):
+                names.add(arg)
+            elif isinstance(arg, list):
+                names.update(a for a in arg if isinstance(a, str))
+        return names
+
+    def publish_message(self, session, group_id, record, ref=None):
+        """Number locally if the whole group is here, else through the broker"""
+        if not self.unstamped.get(group_id) and self.state.workers_of(group_id) == {self.worker_id}:
+            # Members only ever leave a group, so nobody elsewhere can
+            # number a message of it any more
+            return super().publish_message(session, group_id, record, ref)
+        # Not waited for: the broker's stamped copy comes back through
+        # handle_stamped(), in the group's order
+        self.unstamped[group_id] = self.unstamped.get(group_id, 0) + 1
+        floor = max(self.history.last(group_id), self.logged_seq(group_id))
+        record['ref'] = ref
+        self.link.sendall(encode_frame(encode_publish(self.worker_id, group_id, record, floor)))
+
+    def handle_stamped(self, origin, group_id, seq, record):
+        """Store and deliver a chat message the broker numbered"""
+        ref = record.pop('ref', None)
+        session = None
+        if origin == self.worker_id:
+            # Logged by the worker its sender is on only
+            if self.unstamped.get(group_id, 0) > 1:
+                self.unstamped[group_id] -= 1
+            else:
+                self.unstamped.pop(group_id, None)
+            session = self.sessions.get_name(record['from'])
+            if self.message_log:
+                self.message_log.append(group_id, record, seq)
+        self.history.append(group_id, record, seq)
+        recipients = [name for name in self.state.group.get_group_members(group_id)
+                      if name != record['from'] and self.state.presence.get(name) == self.worker_id]
+        self.deliver_message(session, group_id, seq, record, ref, recipients)
+
+    def claim_name(self, session, name):
+        if not self.sequence('login', name):
+            return False
+        return self.sessions.login(session, name)
+
+    def release_name(self, name):
+        self.sequence('logout', name)
+
+    def is_online(self, name):
+        # Read from the replica, never waiting for the broker: a login
+        # not relayed here yet only reads as offline for a moment, and
+        # names are claimed through the sequenced login op regardless
+        return name in self.state.presence
+
+    def online_names(self):
+        return list(self.state.presence)
+
+    def broadcast(self, names, data):
+        """
+        Deliver to local users directly and to remote users via the broker
+
+        Remote recipients cost one deliver frame per worker, however
+        many of them that worker holds.
+        """
+        local = []
+        remote = {}  # worker id -> names
+        for name in names:
+            worker = self.state.presence.get(name)
+            if worker == self.worker_id:
+                local.append(name)
+            elif worker is not None:
+                remote.setdefault(worker, []).append(name)
+
+        for worker, worker_names in remote.items():
+            self.link.sendall(encode_frame(encode_deliver(worker, worker_names, data)))
+        Server.broadcast(self, local, data)
+
+    def shutdown(self):
+        super().shutdown()
+        self.link.close()
+
+def run_worker(port, worker_id, link, inherited, options):
+    """Process entry point for one worker"""
+    for sock in inherited:
+        sock.close()  # Broker ends, so this worker sees EOF if the broker dies
+    if options.get('log_dir'):
+        # One log per process; each logs the messages its users send
+        options = dict(options, log_dir=os.path.join(options['log_dir'], f'worker-{worker_id}'))
+    WorkerServer(port, worker_id, link, reuse_port=True, **options).run()
+
+def serve_workers(port=CHAT_PORT, workers=2, **options):
+    """
+    Start the broker and the worker processes, and relay until they exit
+
+    Args:
+        port: chat port every worker accepts on
+        workers: number of worker processes
+        options: Server keyword options, passed to every worker
+    """
+    context = multiprocessing.get_context('fork')
+    broker_ends = []
+    processes = []
+    for worker_id in range(workers):
+        broker_end, worker_end = socket.socketpair()
+        process = context.Process(target=run_worker,
+                                  args=(port, worker_id, worker_end,
+                                        broker_ends + [broker_end], options),
+                                  name=f'chat-worker-{worker_id}')
+        process.start()
+        worker_end.close()
+        broker_ends.append(broker_end)
+        processes.append(process)
+
+    try:
+        Broker(broker_ends).run()
+    except KeyboardInterrupt:
+        print("\n[BROKER] Shutting down...")
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+def serve_node(port, broker_address, **options):
+    """
+    Join a cluster through a standalone broker and serve clients
+
+    Args:
+        port: chat port this node accepts clients on
+        broker_address: (host, port) of the broker
+        options: Server keyword options
+    """
+    if options.get('log_dir'):
+        options = dict(options, log_dir=os.path.join(options['log_dir'], f'node-{port}'))
+    link = socket.create_connection(broker_address, timeout=JOIN_TIMEOUT)
+    link.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    server = WorkerServer(port, None, link, **options)
+    link.settimeout(None)
+    server.run()
@@ -0,0 +1,160 @@
+"""
+chat_session.py - Per-connection state for the chat server
+One compact Session record per client replaces the parallel
+name/socket dictionaries, and SessionTable indexes them by file
+descriptor and by login name so every lookup and removal is O(1).
+
+A logged in client also gets a resume token. When its connection drops
+the session is parked for RESUME_GRACE seconds, and a client that comes
+back with the token in that time resumes it instead of logging in anew.
+"""
+import secrets
+import time
+
+RESUME_GRACE = 30  # seconds a dropped session can be resumed
+
+class Session:
+    """
+    Everything the server tracks for one client connection
+
+    Uses __slots__ so an idle connection costs a fixed, small record
+    instead of a per-instance __dict__.
+    """
+
+    __slots__ = (
+        'sock',              # socket (select engine) or StreamWriter (asyncio)
+        'events',            # selectors events currently registered (select engine)
+        'fd',                # file descriptor, the primary index
+        'name',              # login name, None until logged in
+        'group_id',          # current chat group, None when not chatting
+        'decoder',           # FrameDecoder with partial inbound frames
+        'outbound',          # OutboundQueue, None while nothing is pending
+        'wire_format',       # 'binary' once negotiated, else None (JSON)
+        'compressor',        # StreamCompressor when deflate was negotiated
+        'decompressor',      # StreamDecompressor when deflate was negotiated
+        'frames_in',         # frames received
+        'frames_out',        # frames queued for sending
+        'bytes_in',          # payload bytes received
+        'bytes_out',         # frame bytes queued for sending
+        'last_active',       # time.monotonic() of the last received frame
+        'lagging_since',     # time.monotonic() the outbound queue went over the limit
+        'closed',            # True once the server has torn the connection down
+        'resume_token',      # secret the client presents to resume after a drop
+        'heartbeat',         # True once the client negotiated ping/pong
+        'ping_sent',         # time.monotonic() of an unanswered ping, else None
+        'timer',             # liveness Timer on the server's TimerWheel
+        'limiter',           # RateLimiter, created with the first frame
+        'held',              # deque of frames waiting out a rate limit, else None
+    )
+
+    def __init__(self, sock, fd, decoder=None):
+        """
+        Args:
+            sock: connection handle the server writes to
+            fd: file descriptor of the underlying socket
+            decoder: FrameDecoder, if the engine decodes frames itself
+        """
+        self.sock = sock
+        self.events = 0
+        self.fd = fd
+        self.name = None
+        self.group_id = None
+        self.decoder = decoder
+        self.outbound = None
+        self.wire_format = None
+        self.compressor = None
+        self.decompressor = None
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.last_active = time.monotonic()
+        self.lagging_since = None
+        self.closed = False
+        self.resume_token = None
+        self.heartbeat = False
+        self.ping_sent = None
+        self.timer = None
+        self.limiter = None
+        self.held = None
+
+    def __repr__(self):
+        return f"<Session fd={self.fd} name={self.name!r}>"
+
+class ParkedSession:
+    """A dropped session waiting for its client to resume it"""
+
+    __slots__ = ('name', 'token', 'group_id', 'timer')
+
+    def __init__(self, name, token, group_id):
+        self.name = name
+        self.token = token
+        self.group_id = group_id  # chat the user was in when the connection dropped
+        self.timer = None  # fires when the grace runs out
+
+    def matches(self, token):
+        """True if a presented token is this session's (constant time)"""
+        return tokens_match(token, self.token)
+
+def tokens_match(presented, token):
+    """
+    True if a token presented by a client is the given resume token
+
+    Constant time, so the token cannot be probed by timing; anything but
+    a string (including a missing token) never matches.
+    """
+    return (isinstance(presented, str) and isinstance(token, str)
+            and secrets.compare_digest(presented.encode('utf-8'), token.encode('utf-8')))
+
+def new_resume_token():
+    """Random, URL-safe resume token"""
+    return secrets.token_urlsafe(16)
+
+class SessionTable:
+    """Sessions indexed by file descriptor and by login name"""
+
+    def __init__(self):
+        self.by_fd = {}  # fd -> Session, every open connection
+        self.by_name = {}  # name -> Session, logged in connections only
+
+    def __len__(self):
+        return len(self.by_fd)
+
+    def __iter__(self):
+        return iter(list(self.by_fd.values()))
+
+    def add(self, session):
+        """Track a newly accepted connection"""
+        self.by_fd[session.fd] = session
+
+    def login(self, session, name):
+        """
+        Attach a login name to a session
+
+        Returns:
+            False if the name is already in use
+        """
+        if name in self.by_name:
+            return False
+        session.name = name
+        self.by_name[name] = session
+        return True
+
+    def remove(self, session):
+        """Forget a session in both indexes"""
+        if self.by_fd.get(session.fd) is session:
+            del self.by_fd[session.fd]
+        if session.name is not None and self.by_name.get(session.name) is session:
+            del self.by_name[session.name]
+
+    def get_fd(self, fd):
+        """Session for a file descriptor, or None"""
+        return self.by_fd.get(fd)
+
+    def get_name(self, name):
+        """Logged in session for a name, or None"""
+        return self.by_name.get(name)
+
+    def names(self):
+        """Names of every logged in client"""
+        return list(self.by_name)
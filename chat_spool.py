@@ -0,0 +1,185 @@
+"""
+chat_spool.py - Store-and-forward spools for members who went offline
+When a group member's connection drops without them leaving the chat,
+the messages addressed to them are kept here, already serialized, until
+they log back in. The whole spool is then handed over as one batch
+frame, so a returning client catches up in a single write.
+
+Each user's spool is bounded by message count and bytes; past either
+bound the oldest messages are dropped. A spool stays in memory until
+it grows past memory_bytes, then its messages are appended to a file
+in the spool directory and only the newest ones are kept in memory.
+"""
+import os
+import shutil
+import struct
+import tempfile
+from collections import deque
+
+SPOOL_MESSAGES = 1000  # messages kept per offline user
+SPOOL_BYTES = 1024 * 1024  # serialized bytes kept per offline user
+SPOOL_MEMORY_BYTES = 16 * 1024  # per-user bytes held in memory before spilling to disk
+
+RECORD_HEADER = struct.Struct('!I')  # length of one spilled message
+
+class UserSpool:
+    """One offline user's pending messages, oldest first"""
+
+    __slots__ = ('memory', 'memory_bytes', 'sizes', 'size', 'path', 'disk_count',
+                 'disk_offset', 'dropped')
+
+    def __init__(self, path):
+        self.memory = deque()  # serialized messages not spilled yet
+        self.memory_bytes = 0
+        self.sizes = deque()  # size of every kept message, disk ones first
+        self.size = 0  # sum of sizes
+        self.path = path
+        self.disk_count = 0  # kept messages in the file
+        self.disk_offset = 0  # file offset of the oldest kept one
+        self.dropped = 0  # messages lost to the bounds
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def add(self, payload):
+        """Keep a serialized message"""
+        self.memory.append(payload)
+        self.memory_bytes += len(payload)
+        self.sizes.append(len(payload))
+        self.size += len(payload)
+
+    def drop_oldest(self):
+        """Forget the oldest kept message"""
+        length = self.sizes.popleft()
+        self.size -= length
+        self.dropped += 1
+        if self.disk_count:
+            self.disk_count -= 1
+            self.disk_offset += RECORD_HEADER.size + length
+        else:
+            self.memory_bytes -= len(self.memory.popleft())
+
+    def spill(self):
+        """Move the in-memory messages to the end of the spool file"""
+        data = b''.join(RECORD_HEADER.pack(len(payload)) + payload for payload in self.memory)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self.disk_count += len(self.memory)
+        self.memory.clear()
+        self.memory_bytes = 0
+
+    def compact(self):
+        """Rewrite the spool file without the messages dropped from its head"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.disk_offset)
+            data = f.read()
+        with open(self.path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
+        self.disk_offset = 0
+
+    def take(self):
+        """
+        Read back every kept message and discard the spool's file
+
+        Returns:
+            list of serialized messages, oldest first
+        """
+        payloads = []
+        if self.disk_count:
+            with open(self.path, 'rb') as f:
+                f.seek(self.disk_offset)
+                data = f.read()
+            offset = 0
+            for _ in range(self.disk_count):
+                length = RECORD_HEADER.unpack_from(data, offset)[0]
+                offset += RECORD_HEADER.size
+                payloads.append(data[offset:offset + length])
+                offset += length
+        self.discard()
+        payloads.extend(self.memory)
+        return payloads
+
+    def discard(self):
+        """Delete the spool's file, if it has one"""
+        if self.disk_count or self.disk_offset:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.disk_count = 0
+            self.disk_offset = 0
+
+class OfflineSpool:
+    """Per-user spools of messages waiting for their recipient to return"""
+
+    def __init__(self, directory=None, max_messages=SPOOL_MESSAGES, max_bytes=SPOOL_BYTES,
+                 memory_bytes=SPOOL_MEMORY_BYTES):
+        """
+        Args:
+            directory: where spilled spools are written; None for a
+                temporary directory, removed again by close()
+            max_messages: messages kept per user
+            max_bytes: serialized bytes kept per user
+            memory_bytes: per-user bytes held in memory before spilling
+        """
+        self.owns_directory = directory is None
+        self.directory = directory
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.spools = {}  # name -> UserSpool
+        self.next_file = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def add(self, name, payload):
+        """
+        Keep a serialized message for an offline user
+
+        Args:
+            name: recipient
+            payload: JSON bytes of the message dict
+        """
+        spool = self.spools.get(name)
+        if spool is None:
+            spool = self.spools[name] = UserSpool(self.spool_path())
+        spool.add(payload)
+        while len(spool) > self.max_messages or spool.size > self.max_bytes:
+            spool.drop_oldest()
+        if spool.memory_bytes > self.memory_bytes:
+            spool.spill()
+        if spool.disk_offset > self.max_bytes:
+            spool.compact()  # Keeps the file under twice the bound
+
+    def spool_path(self):
+        """File name for a new user's spilled messages"""
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='chat_spool_')
+        self.next_file += 1
+        return os.path.join(self.directory, f'{self.next_file:08d}.spool')
+
+    def pending(self, name):
+        """Number of messages waiting for a user"""
+        spool = self.spools.get(name)
+        return len(spool) if spool else 0
+
+    def take(self, name):
+        """
+        Hand over and forget a user's spool
+
+        Returns:
+            (serialized messages oldest first, number dropped to the bounds)
+        """
+        spool = self.spools.pop(name, None)
+        if spool is None:
+            return [], 0
+        return spool.take(), spool.dropped
+
+    def close(self):
+        """Delete every spilled spool"""
+        for spool in self.spools.values():
+            spool.discard()
+        self.spools.clear()
+        if self.owns_directory and self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,148 @@
+"""
+chat_timers.py - Hierarchical timer wheel and heartbeat settings
+The server keeps a timer per connection (heartbeats, login deadline)
+and per parked session, so with many thousands of clients it cannot
+afford a sorted structure or a scan of every session per tick. A
+hierarchical timing wheel schedules and cancels in O(1) and, per tick,
+only touches the timers that are due or move one level down.
+
+Level 0 has SLOTS buckets of one tick each, level 1 SLOTS buckets of
+SLOTS ticks each, and so on. A timer goes into the coarsest bucket that
+still tells it apart from "now"; each time a lower level wraps around,
+the next bucket of the level above is emptied into the levels below.
+
+Heartbeats: clients that negotiate HEARTBEAT_CAPABILITY are pinged
+after HEARTBEAT_INTERVAL seconds without a frame from them, and
+dropped if HEARTBEAT_TIMEOUT more seconds pass without any answer.
+"""
+import time
+
+TICK = 0.1  # seconds per level 0 slot
+SLOTS = 64  # buckets per level
+LEVELS = 4  # 64**4 ticks of 0.1s: about 19 days before timers are clamped
+
+HEARTBEAT_CAPABILITY = 'heartbeat'
+HEARTBEAT_INTERVAL = 30  # seconds of silence before a ping
+HEARTBEAT_TIMEOUT = 10  # seconds a pinged peer has to answer
+LOGIN_TIMEOUT = 30  # seconds a new connection has to log in
+
+class Timer:
+    """A scheduled callback; cancel() it through the wheel or directly"""
+
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick  # wheel tick the timer fires on
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Never fire; the wheel drops it when its bucket comes up"""
+        self.cancelled = True
+
+class TimerWheel:
+    """Timers with O(1) schedule and cancel, fired by advance()"""
+
+    def __init__(self, tick=TICK, slots=SLOTS, levels=LEVELS, now=None):
+        """
+        Args:
+            tick: seconds per level 0 slot (the timers' resolution)
+            slots: buckets per level
+            levels: number of levels
+            now: time.monotonic() the wheel starts at
+        """
+        self.tick = tick
+        self.slots = slots
+        self.spans = [slots ** level for level in range(levels + 1)]  # ticks per bucket
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = int((time.monotonic() if now is None else now) / tick)
+        self.count = 0  # timers scheduled, including cancelled ones not dropped yet
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args) once delay seconds have passed
+
+        Returns:
+            Timer, to cancel it
+        """
+        timer = Timer(self.current + max(1, int(delay / self.tick + 0.999999)), callback, args)
+        self.place(timer)
+        self.count += 1
+        return timer
+
+    def place(self, timer):
+        """Put a timer in the bucket for how far away it is"""
+        spans = self.spans
+        distance = timer.tick - self.current
+        level = 0
+        while level < len(self.wheels) - 1 and distance >= spans[level + 1]:
+            level += 1
+        if distance >= spans[level + 1]:
+            # Beyond the top level: park it in the furthest bucket and
+            # place it again when that bucket cascades
+            slot = (self.current // spans[level] - 1) % self.slots
+        else:
+            slot = (timer.tick // spans[level]) % self.slots
+        self.wheels[level][slot].append(timer)
+
+    def advance(self, now=None):
+        """
+        Fire every timer that is due
+
+        Args:
+            now: time.monotonic(), or None to read the clock
+
+        Returns:
+            number of callbacks run
+        """
+        target = int((time.monotonic() if now is None else now) / self.tick)
+        if not self.count:
+            self.current = max(self.current, target)
+            return 0
+        fired = 0
+        while self.current < target:
+            self.current += 1
+            fired += self.fire_tick()
+        return fired
+
+    def fire_tick(self):
+        """Cascade the levels that wrapped, then run the current bucket"""
+        current = self.current
+        spans = self.spans
+        slots = self.slots
+        for level in range(1, len(self.wheels)):
+            if current % spans[level]:
+                break
+            bucket = self.wheels[level][(current // spans[level]) % slots]
+            if bucket:
+                self.wheels[level][(current // spans[level]) % slots] = []
+                for timer in bucket:
+                    if timer.cancelled:
+                        self.count -= 1
+                    else:
+                        self.place(timer)
+
+        bucket = self.wheels[0][current % slots]
+        if not bucket:
+            return 0
+        self.wheels[0][current % slots] = []
+        fired = 0
+        for timer in bucket:
+            self.count -= 1
+            if timer.cancelled:
+                continue
+            if timer.tick > current:
+                # Parked past the top level - not due yet
+                self.place(timer)
+                self.count += 1
+                continue
+            fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"[TIMERS] Timer callback failed: {e}")
+        return fired
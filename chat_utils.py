@@ -10,6 +10,39 @@ SERVER_PORT = 1112  # FIXED: Was 12345, now 1112
 CHAT_PORT = 1112
 SERVER = (SERVER_IP, SERVER_PORT)
 SIZE_SPEC = 'I'  # unsigned int for message length
+HEADER = struct.Struct(SIZE_SPEC)  # precompiled length header
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # refuse frames larger than this
+LOGIN_FRAME_SIZE = 64 * 1024  # refuse frames larger than this before login
+RECV_CHUNK = 4096  # smallest read into a receive buffer
+RECV_RESERVE_MAX = 16 * RECV_CHUNK  # most free space reserved ahead of one read
+RECV_SHRINK = 4  # a drained buffer over this many times its initial size shrinks back
+
+# Shared by every FrameDecoder with nothing buffered
+EMPTY_BUFFER = b''
+EMPTY_VIEW = memoryview(EMPTY_BUFFER)
+
+def encode_frame(msg):
+    """
+    Build a length-prefixed frame without sending it
+    
+    Args:
+        msg: string or bytes to frame
+        
+    Returns:
+        bytes: 4-byte length header followed by the payload
+    """
+    # Convert string to bytes if needed
+    if isinstance(msg, str):
+        msg_bytes = msg.encode('utf-8')
+    else:
+        msg_bytes = msg
+    
+    # Get length and create header
+    length = len(msg_bytes)
+    length_prefix = HEADER.pack(length)
+    
+    return length_prefix + msg_bytes
 
 def mysend(s, msg):
     """
@@ -20,56 +53,229 @@ def mysend(s, msg):
         msg: string or bytes to send
     """
     try:
-        # Convert string to bytes if needed
-        if isinstance(msg, str):
-            msg_bytes = msg.encode('utf-8')
-        else:
-            msg_bytes = msg
-        
-        # Get length and create header
-        length = len(msg_bytes)
-        length_prefix = struct.pack(SIZE_SPEC, length)
-        
         # Send length + message
-        s.sendall(length_prefix + msg_bytes)
+        s.sendall(encode_frame(msg))
         
     except Exception as e:
         print(f"[ERROR] Send failed: {e}")
         raise
 
-def myrecv(s):
+def recv_exactly(s, view):
+    """
+    Fill a writable buffer completely straight from the socket
+    
+    Args:
+        s: socket object
+        view: memoryview over the destination buffer
+        
+    Returns:
+        True when filled, False if the connection closed first
+    """
+    received = 0
+    while received < len(view):
+        n = s.recv_into(view[received:])
+        if not n:
+            return False  # Connection closed
+        received += n
+    return True
+
+def myrecv(s, decode=True):
     """
     Receive a message with a 4-byte length header
     
     Args:
         s: socket object
+        decode: return a str (True) or the raw payload bytes (False)
         
     Returns:
         Decoded string message or None if connection closed
     """
     try:
         # Read 4-byte length header
-        length_bytes = b''
-        while len(length_bytes) < 4:
-            chunk = s.recv(4 - len(length_bytes))
-            if not chunk:
-                return None  # Connection closed
-            length_bytes += chunk
+        header = bytearray(HEADER_SIZE)
+        if not recv_exactly(s, memoryview(header)):
+            return None
         
         # Unpack length
-        length = struct.unpack(SIZE_SPEC, length_bytes)[0]
+        length = HEADER.unpack(header)[0]
         
-        # Read message bytes
-        msg_bytes = b''
-        while len(msg_bytes) < length:
-            chunk = s.recv(min(length - len(msg_bytes), 4096))
-            if not chunk:
-                return None  # Connection closed
-            msg_bytes += chunk
+        # Read message bytes in place - no per-chunk concatenation
+        msg_bytes = bytearray(length)
+        if not recv_exactly(s, memoryview(msg_bytes)):
+            return None
         
         # Decode and return
+        if not decode:
+            return bytes(msg_bytes)
         return msg_bytes.decode('utf-8')
         
     except Exception as e:
         print(f"[ERROR] Receive failed: {e}")
-        return None
\ No newline at end of file
+        return None
+
+class FrameDecoder:
+    """
+    Incremental decoder for length-prefixed frames
+    
+    Feed it whatever bytes a single recv() returned and it hands back
+    every frame completed so far. Partial headers and partial payloads
+    are kept until the rest arrives, so the caller never has to block
+    inside a frame.
+    
+    Bytes live in one growable bytearray per connection. recv_into()
+    reads straight into its free tail. The buffer grows (doubling) as a
+    large frame's bytes actually arrive, never reserving more than is
+    already buffered or RECV_RESERVE_MAX, so a header alone cannot make
+    it allocate the size it announces. The buffer is reused
+    for every read while the connection is active, and shrinks back to
+    initial_size once a large frame has been consumed; release() drops
+    it once the connection goes quiet (the server calls it from the
+    liveness timer), so an idle connection holds no receive memory.
+    """
+    
+    __slots__ = ('max_frame_size', 'initial_size', 'buffer', 'view',
+                 'start', 'end', 'frame_end')
+    
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, initial_size=RECV_CHUNK):
+        """
+        Args:
+            max_frame_size: largest payload accepted before giving up
+            initial_size: capacity allocated when data starts arriving
+        """
+        self.max_frame_size = max_frame_size
+        self.initial_size = initial_size
+        self.buffer = EMPTY_BUFFER
+        self.view = EMPTY_VIEW
+        self.start = 0  # first byte not yet returned as a frame
+        self.end = 0  # one past the last byte received
+        self.frame_end = 0  # buffered bytes needed to finish the current frame
+    
+    def recv_into(self, sock, flags=0):
+        """
+        Read once from a socket directly into the buffer
+        
+        Args:
+            sock: socket with data ready (blocking or not)
+            flags: socket.recv flags, e.g. MSG_DONTWAIT
+            
+        Returns:
+            Number of bytes read; 0 means the peer closed the connection
+        """
+        # Room for the rest of the frame, but no more than what has come
+        # in so far: the buffer doubles as the bytes actually arrive
+        pending = self.end - self.start
+        self._reserve(max(RECV_CHUNK, min(self.frame_end - pending, pending, RECV_RESERVE_MAX)))
+        n = sock.recv_into(self.view[self.end:], 0, flags)
+        self.end += n
+        return n
+    
+    def feed(self, data):
+        """
+        Add received bytes and collect the frames they complete
+        
+        Args:
+            data: bytes from the socket (may be empty)
+            
+        Returns:
+            List of payloads (bytes), possibly empty
+            
+        Raises:
+            ValueError: if a header announces a frame over max_frame_size
+        """
+        self._reserve(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return self.frames()
+    
+    def frames(self):
+        """
+        Collect every complete frame currently buffered
+        
+        Returns:
+            List of payloads (bytes), possibly empty
+            
+        Raises:
+            ValueError: if a header announces a frame over max_frame_size
+                (only once the frames before it have been returned, so
+                handling them - a login - may still raise the limit)
+        """
+        frames = []
+        view = self.view
+        start, end = self.start, self.end
+        while end - start >= HEADER_SIZE:
+            length = HEADER.unpack_from(view, start)[0]
+            if length > self.max_frame_size:
+                if frames:
+                    break  # Checked again on the next call
+                raise ValueError(f"Frame of {length} bytes exceeds limit")
+            
+            frame_end = start + HEADER_SIZE + length
+            if end < frame_end:
+                break  # Rest of the payload has not arrived yet
+            
+            frames.append(bytes(view[start + HEADER_SIZE:frame_end]))
+            start = frame_end
+        
+        if start == end:
+            # Everything consumed - rewind instead of moving bytes
+            start = end = 0
+            self.frame_end = 0
+            if len(self.buffer) > RECV_SHRINK * self.initial_size:
+                # Sized for a large frame that is gone now
+                self.start = self.end = 0
+                self._resize(self.initial_size)
+        elif end - start >= HEADER_SIZE:
+            self.frame_end = HEADER_SIZE + HEADER.unpack_from(view, start)[0]
+        else:
+            self.frame_end = HEADER_SIZE
+        self.start, self.end = start, end
+        return frames
+    
+    def release(self):
+        """
+        Give the buffer back until more data arrives
+        
+        Returns:
+            False if a partial frame is buffered (nothing is released)
+        """
+        if self.end != self.start:
+            return False
+        if self.buffer:
+            self._resize(0)
+        return True
+    
+    def pending(self):
+        """Number of buffered bytes that do not yet form a whole frame"""
+        return self.end - self.start
+    
+    def _reserve(self, size):
+        """Make sure at least size bytes are free after self.end"""
+        if len(self.buffer) - self.end >= size:
+            return
+        
+        used = self.end - self.start
+        if len(self.buffer) - used >= size:
+            # Enough room once the partial frame moves to the front
+            self.view[:used] = self.view[self.start:self.end]
+            self.start, self.end = 0, used
+            return
+        
+        capacity = max(len(self.buffer), self.initial_size)
+        while capacity - used < size:
+            capacity *= 2
+        self._resize(capacity)
+    
+    def _resize(self, capacity):
+        """Move buffered bytes into a fresh buffer of the given size"""
+        used = self.end - self.start
+        old_view = self.view
+        if capacity:
+            self.buffer = bytearray(capacity)
+            self.view = memoryview(self.buffer)
+            self.view[:used] = old_view[self.start:self.end]
+        else:
+            self.buffer = EMPTY_BUFFER
+            self.view = EMPTY_VIEW
+        if old_view is not EMPTY_VIEW:
+            old_view.release()
+        self.start, self.end = 0, used
@@ -0,0 +1,203 @@
+"""
+chat_wire.py - Compact binary encoding for chat actions
+An optional alternative to JSON payloads inside the usual length-prefixed
+frames. Clients opt in by listing 'binary' in the capabilities field of
+their login; everyone else keeps speaking JSON.
+
+Payload layout:
+    marker   1 byte   BINARY_MARKER (never the first byte of JSON or UTF-8)
+    action   1 byte   code from ACTION_CODES
+    present  1 byte   bit i set -> schema field i follows; bit 7 -> extras
+    fields            in schema order, each as below
+    extras            JSON object (length-prefixed) for keys outside the schema
+
+Field types:
+    's'  varint byte length + UTF-8 text
+    'l'  varint item count + that many 's' values
+    'i'  varint (non-negative integer)
+"""
+import chat_codec
+
+BINARY_MARKER = 0xC1  # 0xC1 can never appear in valid UTF-8
+BINARY_CAPABILITY = 'binary'
+
+# Small integer codes for the existing actions
+ACTION_CODES = {
+    'login': 1,
+    'connect': 2,
+    'create_group': 3,
+    'exchange': 4,
+    'incoming': 5,
+    'disconnect': 6,
+    'who': 7,
+    'quit': 8,
+    'error': 9,
+    'group_created': 10,
+    'ack': 11,
+    'sent': 12,
+    'ping': 13,
+    'pong': 14,
+}
+CODE_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+
+# Fields carried positionally for each action (at most 7 per action).
+# Only ever append to these lists - the index is the wire identity.
+SCHEMAS = {
+    'login': [('name', 's'), ('status', 's'), ('message', 's'), ('capabilities', 'l')],
+    'connect': [('to', 's'), ('status', 's'), ('message', 's')],
+    'create_group': [('members', 'l')],
+    'exchange': [('message', 's'), ('timestamp', 's'), ('ref', 'i')],
+    'incoming': [('from', 's'), ('message', 's'), ('timestamp', 's'),
+                 ('group_id', 's'), ('seq', 'i'), ('msg_id', 's')],
+    'disconnect': [('message', 's')],
+    'who': [('users', 'l')],
+    'quit': [],
+    'error': [('message', 's')],
+    'group_created': [('group_id', 's'), ('members', 'l'), ('message', 's')],
+    'ack': [('group_id', 's'), ('delivered', 'i'), ('seen', 'i')],
+    'sent': [('ref', 'i'), ('group_id', 's'), ('seq', 'i'), ('msg_id', 's')],
+    'ping': [],
+    'pong': [],
+}
+
+EXTRAS_BIT = 0x80
+_TYPE_CHECKS = {
+    's': lambda v: isinstance(v, str),
+    'l': lambda v: isinstance(v, list) and all(isinstance(x, str) for x in v),
+    'i': lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0,
+}
+_SMALL_VARINTS = [bytes((n,)) for n in range(128)]
+
+def is_binary(payload):
+    """True if a frame payload uses this encoding rather than JSON/text"""
+    return len(payload) > 0 and payload[0] == BINARY_MARKER
+
+def _varint(n):
+    if n < 128:
+        return _SMALL_VARINTS[n]
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def encode(data):
+    """
+    Encode an action dict as a binary payload
+
+    Args:
+        data: message dict with an 'action' key
+
+    Returns:
+        bytes, or None if the action has no binary code (send JSON instead)
+    """
+    action = data.get('action')
+    code = ACTION_CODES.get(action)
+    if code is None:
+        return None
+
+    schema = SCHEMAS[action]
+    parts = []
+    present = 0
+    used = 1  # 'action' itself
+    for bit, (field, kind) in enumerate(schema):
+        if field not in data:
+            continue
+        value = data[field]
+        if not _TYPE_CHECKS[kind](value):
+            continue  # Unexpected type - let it travel in the extras
+        present |= 1 << bit
+        used += 1
+        if kind == 's':
+            raw = value.encode('utf-8')
+            parts.append(_varint(len(raw)))
+            parts.append(raw)
+        elif kind == 'l':
+            parts.append(_varint(len(value)))
+            for item in value:
+                raw = item.encode('utf-8')
+                parts.append(_varint(len(raw)))
+                parts.append(raw)
+        else:
+            parts.append(_varint(value))
+
+    if used < len(data):
+        extras = {k: v for k, v in data.items()
+                  if k != 'action' and not _in_schema(schema, k, v)}
+        raw = chat_codec.dumps(extras)
+        present |= EXTRAS_BIT
+        parts.append(_varint(len(raw)))
+        parts.append(raw)
+
+    return bytes((BINARY_MARKER, code, present)) + b''.join(parts)
+
+def _in_schema(schema, key, value):
+    for field, kind in schema:
+        if field == key:
+            return _TYPE_CHECKS[kind](value)
+    return False
+
+def decode(payload):
+    """
+    Decode a binary payload back into an action dict
+
+    Args:
+        payload: bytes-like object starting with BINARY_MARKER
+
+    Returns:
+        message dict
+
+    Raises:
+        ValueError: if the payload is truncated or uses an unknown code
+    """
+    data = bytes(payload)
+    try:
+        if data[0] != BINARY_MARKER:
+            raise ValueError("Not a binary frame")
+        action = CODE_ACTIONS.get(data[1])
+        if action is None:
+            raise ValueError(f"Unknown action code {data[1]}")
+        present = data[2]
+
+        result = {'action': action}
+        pos = 3
+        for bit, (field, kind) in enumerate(SCHEMAS[action]):
+            if not present & (1 << bit):
+                continue
+            if kind == 's':
+                length, pos = _read_varint(data, pos)
+                result[field] = data[pos:pos + length].decode('utf-8')
+                pos += length
+            elif kind == 'l':
+                count, pos = _read_varint(data, pos)
+                items = []
+                for _ in range(count):
+                    length, pos = _read_varint(data, pos)
+                    items.append(data[pos:pos + length].decode('utf-8'))
+                    pos += length
+                result[field] = items
+            else:
+                result[field], pos = _read_varint(data, pos)
+
+        if present & EXTRAS_BIT:
+            length, pos = _read_varint(data, pos)
+            result.update(chat_codec.loads(data[pos:pos + length]))
+            pos += length
+
+        if pos != len(data):
+            raise ValueError("Binary frame has the wrong length")
+        return result
+    except IndexError:
+        raise ValueError("Truncated binary frame")
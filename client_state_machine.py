@@ -2,19 +2,89 @@
 client_state_machine.py - COMPLETE VERSION WITH GROUP CHAT SUPPORT
 Ready to copy and paste - no manual edits needed!
 """
-import json
+import threading
+import chat_codec
+import chat_wire
+from chat_compress import (StreamCompressor, StreamDecompressor, is_compressed,
+                           DEFLATE_CAPABILITY)
 
 # States
 S_OFFLINE = 0
 S_LOGGEDIN = 1
 S_CHATTING = 2
 
+# Acks are sent every ACK_INTERVAL seconds, or sooner once ACK_EVERY
+# messages are waiting to be acknowledged
+ACK_INTERVAL = 0.25
+ACK_EVERY = 20
+
+class AckBatcher:
+    """
+    Cumulative acks waiting to be sent, at most one per group
+    
+    Fed by the receive thread (delivered) and the GUI (seen), drained
+    by the client's ack timer, so it is locked.
+    """
+    
+    def __init__(self, every=ACK_EVERY):
+        self.every = every
+        self.lock = threading.Lock()
+        self.pending = {}  # group id -> [delivered seq, seen seq]
+        self.count = 0  # messages noted since the last take()
+    
+    def delivered(self, group_id, seq):
+        """
+        Note that a message arrived
+        
+        Returns:
+            True once enough messages are waiting that the acks should go now
+        """
+        with self.lock:
+            position = self.pending.setdefault(group_id, [0, 0])
+            position[0] = max(position[0], seq)
+            self.count += 1
+            return self.count >= self.every
+    
+    def seen(self, group_id, seq):
+        """Note that a message was shown to the user"""
+        with self.lock:
+            position = self.pending.setdefault(group_id, [0, 0])
+            position[1] = max(position[1], seq)
+    
+    def take(self):
+        """
+        Hand over the waiting acks
+        
+        Returns:
+            list of ack message dicts
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.count = 0
+        acks = []
+        for group_id, (delivered, seen) in pending.items():
+            ack = {'action': 'ack', 'group_id': group_id, 'delivered': delivered}
+            if seen:
+                ack['seen'] = seen
+            acks.append(ack)
+        return acks
+
 class ClientStateMachine:
     def __init__(self, gui=None):
         self.state = S_OFFLINE
         self.gui = gui
         self.peer_name = None
         self.my_name = None
+        self.capabilities = []  # protocol features the server accepted
+        self.compressor = None  # deflate streams, once negotiated
+        self.decompressor = None
+        self.handlers = self.default_handlers()  # see register_action
+        self.acks = AckBatcher()
+        self.ack_due = False  # set when enough acks wait to send them early
+        self.resume_token = None  # from the login reply, to resume after a drop
+        self.last_seq = {}  # group id -> newest seq received
+        self.login_needed = False  # set when a resume was refused
+        self.pong_due = False  # set when the server pinged us
     
     def set_state(self, new_state):
         """Change state"""
@@ -29,46 +99,88 @@ class ClientStateMachine:
         Process incoming message from server
         Handles both 2-person and group chat messages
         """
-        try:
-            data = json.loads(msg)
-        except (json.JSONDecodeError, ValueError):
+        if is_compressed(msg) and self.decompressor:
+            try:
+                msg = self.decompressor.decompress(msg)
+            except ValueError as e:
+                print(f"[CLIENT] Bad compressed frame: {e}")
+                return
+        
+        if chat_wire.is_binary(msg):
+            try:
+                data = chat_wire.decode(msg)
+            except ValueError as e:
+                print(f"[CLIENT] Bad binary frame: {e}")
+                return
+        else:
+            try:
+                data = chat_codec.loads(msg)
+            except chat_codec.DecodeError:
+                data = None
+        
+        if not isinstance(data, dict):
             # Legacy text message
+            if isinstance(msg, bytes):
+                msg = msg.decode('utf-8', errors='replace')
             if self.gui:
                 self.gui.display_system_message(msg)
             return
         
-        action = data.get('action', '')
-        
-        # Route to appropriate handler based on action
-        if action == 'login':
-            self.handle_login_response(data)
-        
-        elif action == 'connect':
-            self.handle_connect_response(data)
-        
-        elif action == 'group_created':  # NEW: Handle group creation
-            self.handle_group_created(data)
-        
-        elif action == 'incoming':
-            self.handle_incoming_message(data)
-        
-        elif action == 'disconnect':
-            self.handle_disconnect(data)
+        self.dispatch(data)
+    
+    def default_handlers(self):
+        """
+        Build the action -> handler table
         
-        elif action == 'who':
-            self.handle_who_response(data)
+        Every handler is called as handler(data).
         
-        elif action == 'error':
-            self.handle_error(data)
+        Returns:
+            {action: bound handler}
+        """
+        return {
+            'login': self.handle_login_response,
+            'resume': self.handle_resume_response,
+            'connect': self.handle_connect_response,
+            'group_created': self.handle_group_created,  # NEW: Handle group creation
+            'incoming': self.handle_incoming_message,
+            'disconnect': self.handle_disconnect,
+            'who': self.handle_who_response,
+            'history': self.handle_history_response,
+            'status': self.handle_status,
+            'sent': self.handle_sent,
+            'receipts': self.handle_receipts,
+            'batch': self.handle_batch,
+            'ping': self.handle_ping,
+            'pong': self.handle_pong,
+            'error': self.handle_error,
+        }
+    
+    def register_action(self, action, handler):
+        """
+        Add or replace the handler for an incoming action
         
-        else:
-            print(f"[CLIENT] Unknown action: {action}")
+        Args:
+            action: action name as it appears in the message
+            handler: callable taking (data)
+        """
+        self.handlers[action] = handler
+    
+    def dispatch(self, data):
+        """Route a parsed message to its handler with one dict lookup"""
+        handler = self.handlers.get(data.get('action', ''))
+        if handler is None:
+            print(f"[CLIENT] Unknown action: {data.get('action', '')}")
+            return
+        handler(data)
     
     def handle_login_response(self, data):
         """Handle login response"""
         status = data.get('status')
         message = data.get('message', '')
         
+        if status == 'success':
+            self.start_session(data)
+        
         if self.gui:
             if status == 'success':
                 self.gui.display_system_message(message)
@@ -76,6 +188,39 @@ class ClientStateMachine:
             else:
                 self.gui.display_system_message(f"Login failed: {message}")
     
+    def handle_resume_response(self, data):
+        """
+        Handle the reply to a resume after reconnecting
+        
+        On success the missed messages follow as a batch; otherwise the
+        client has to log in again (see login_needed).
+        """
+        if data.get('status') == 'success':
+            self.start_session(data)
+        else:
+            self.login_needed = True
+        
+        if self.gui:
+            if data.get('status') == 'success':
+                self.gui.display_system_message(data.get('message', ''))
+            else:
+                self.gui.display_system_message(f"Could not resume ({data.get('message', '')}) - logging in again")
+    
+    def start_session(self, data):
+        """Switch to the capabilities a login/resume reply accepted"""
+        self.capabilities = data.get('capabilities', [])
+        if DEFLATE_CAPABILITY in self.capabilities:
+            self.compressor = StreamCompressor()
+            self.decompressor = StreamDecompressor()
+        self.resume_token = data.get('resume_token')
+    
+    def reset_connection(self):
+        """Forget what was negotiated on a connection that dropped"""
+        self.capabilities = []
+        self.compressor = None
+        self.decompressor = None
+        self.login_needed = False
+    
     def handle_connect_response(self, data):
         """Handle connection response (2-person chat)"""
         status = data.get('status')
@@ -129,9 +274,19 @@ class ClientStateMachine:
             'action': 'incoming',
             'from': 'alice',  # Sender name
             'message': 'Hello!',
-            'timestamp': '08:30 PM'
+            'timestamp': '08:30 PM',
+            'group_id': 'group_1',
+            'seq': 57,
+            'msg_id': 'group_1:57'
         }
         """
+        group_id = data.get('group_id')
+        seq = data.get('seq')
+        if group_id and isinstance(seq, int):
+            self.last_seq[group_id] = max(self.last_seq.get(group_id, 0), seq)
+            if self.acks.delivered(group_id, seq):
+                self.ack_due = True
+        
         if not self.gui:
             return
         
@@ -170,6 +325,92 @@ class ClientStateMachine:
         if self.gui:
             self.gui.handle_user_list(users)
     
+    def handle_history_response(self, data):
+        """
+        Handle a page of earlier messages
+        
+        Expected data:
+        {
+            'action': 'history',
+            'group_id': 'group_1',
+            'messages': [{'from': 'alice', 'message': 'Hi', 'timestamp': '08:30 PM', 'seq': 1}, ...],
+            'cursor': None  # pass back as 'before' for the page before this one
+        }
+        """
+        if self.gui:
+            self.gui.handle_history(data.get('messages', []), data.get('cursor'))
+    
+    def handle_status(self, data):
+        """Handle an informational notice (e.g. a member went offline)"""
+        if self.gui:
+            self.gui.display_system_message(data.get('message', ''))
+    
+    def handle_batch(self, data):
+        """
+        Handle several messages delivered in one frame
+        
+        Sent after login or resume with everything missed while we were offline.
+        
+        Expected data:
+        {
+            'action': 'batch',
+            'messages': [{'action': 'status', ...}, {'action': 'incoming', ...}, ...]
+        }
+        """
+        for message in data.get('messages', []):
+            if isinstance(message, dict):
+                self.dispatch(message)
+    
+    def handle_sent(self, data):
+        """
+        Handle the server's note of which seq our own message got
+        
+        Expected data:
+        {'action': 'sent', 'ref': 3, 'group_id': 'group_1', 'seq': 58, 'msg_id': 'group_1:58'}
+        """
+        if self.gui:
+            self.gui.handle_sent(data.get('ref'), data.get('seq'))
+    
+    def handle_receipts(self, data):
+        """
+        Handle the group's delivery/read positions
+        
+        Expected data:
+        {'action': 'receipts', 'group_id': 'group_1', 'positions': {'bob': [58, 57]}}
+        """
+        if self.gui:
+            positions = {name: position for name, position in data.get('positions', {}).items()
+                         if name != self.my_name}
+            self.gui.handle_receipts(positions)
+    
+    def handle_ping(self, data):
+        """Handle the server checking that we are still there (see pong_due)"""
+        self.pong_due = True
+    
+    def handle_pong(self, data):
+        """Handle the answer to our ping - its arrival is all that matters"""
+    
+    def mark_seen(self, msg_id):
+        """
+        Note that the GUI showed a message; acknowledged with the next batch
+        
+        Args:
+            msg_id: 'group_id:seq' as sent with the message
+        """
+        group_id, _, seq = msg_id.rpartition(':')
+        if group_id and seq.isdigit():
+            self.acks.seen(group_id, int(seq))
+    
+    def take_acks(self):
+        """
+        Encode the waiting acks for sending
+        
+        Returns:
+            list of payloads, one per group with something to acknowledge
+        """
+        self.ack_due = False
+        return [self.encode(ack) for ack in self.acks.take()]
+    
     def handle_error(self, data):
         """Handle error message"""
         message = data.get('message', 'An error occurred')
@@ -177,17 +418,83 @@ class ClientStateMachine:
         if self.gui:
             self.gui.display_system_message(f"❌ Error: {message}")
     
-    def format_login(self, name):
-        """Format login message"""
+    def encode(self, data):
+        """
+        Serialize an outgoing message in the negotiated wire format
+        
+        Args:
+            data: message dict
+            
+        Returns:
+            bytes payload - binary once the server accepted it, else JSON
+        """
+        if chat_wire.BINARY_CAPABILITY in self.capabilities:
+            payload = chat_wire.encode(data)
+            if payload is not None:
+                return payload
+        return chat_codec.dumps(data)
+    
+    def compress(self, payload):
+        """
+        Run an outgoing payload through the deflate stream, if negotiated
+        
+        Call this right before sending: the stream context assumes the
+        server sees frames in exactly the order they were compressed.
+        
+        Args:
+            payload: str or bytes ready to frame
+            
+        Returns:
+            payload to hand to mysend
+        """
+        if not self.compressor:
+            return payload
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        return self.compressor.compress(payload)
+    
+    def format_login(self, name, capabilities=None):
+        """
+        Format login message
+        
+        Args:
+            name: nickname to log in as
+            capabilities: optional protocol features to request, e.g. ['binary']
+        """
         self.my_name = name
-        return json.dumps({
+        data = {
             'action': 'login',
             'name': name
-        })
+        }
+        if capabilities:
+            data['capabilities'] = list(capabilities)
+        return self.encode(data)
+    
+    def format_resume(self, capabilities=None):
+        """
+        Format a request to take back our session after a reconnect
+        
+        Args:
+            capabilities: optional protocol features to request again
+        
+        Returns:
+            payload, or None when there is no session to resume
+        """
+        if not self.resume_token:
+            return None
+        data = {
+            'action': 'resume',
+            'name': self.my_name,
+            'token': self.resume_token,
+            'last_seq': dict(self.last_seq)
+        }
+        if capabilities:
+            data['capabilities'] = list(capabilities)
+        return self.encode(data)
     
     def format_connect(self, peer_name):
         """Format connection request"""
-        return json.dumps({
+        return self.encode({
             'action': 'connect',
             'to': peer_name
         })
@@ -199,34 +506,66 @@ class ClientStateMachine:
         Args:
             members: List of usernames ['alice', 'bob', 'charlie']
         """
-        return json.dumps({
+        return self.encode({
             'action': 'create_group',
             'members': members
         })
     
-    def format_message(self, message, timestamp=''):
-        """Format outgoing message"""
-        return json.dumps({
+    def format_message(self, message, timestamp='', ref=None):
+        """
+        Format outgoing message
+        
+        Args:
+            ref: optional number the server echoes in a 'sent' reply with
+                the message's seq, so receipts can be matched to it
+        """
+        data = {
             'action': 'exchange',
             'message': message,
             'timestamp': timestamp
-        })
+        }
+        if ref is not None:
+            data['ref'] = ref
+        return self.encode(data)
     
     def format_disconnect(self):
         """Format disconnect request"""
-        return json.dumps({
+        return self.encode({
             'action': 'disconnect'
         })
     
     def format_who(self):
         """Format 'who is online' request"""
-        return json.dumps({
+        return self.encode({
             'action': 'who'
         })
     
+    def format_history(self, before=None, limit=None):
+        """
+        Format a request for earlier messages of the current chat
+        
+        Args:
+            before: cursor from the previous history page, None for the newest
+            limit: page size, None for the server default
+        """
+        data = {'action': 'history'}
+        if before is not None:
+            data['before'] = before
+        if limit is not None:
+            data['limit'] = limit
+        return self.encode(data)
+    
+    def format_ping(self):
+        """Format a liveness check for a quiet connection"""
+        return self.encode({'action': 'ping'})
+    
+    def format_pong(self):
+        """Format the answer to a server ping"""
+        return self.encode({'action': 'pong'})
+    
     def format_quit(self):
         """Format quit request"""
-        return json.dumps({
+        return self.encode({
             'action': 'quit'
         })
     
@@ -241,9 +580,9 @@ class ClientStateMachine:
         """
         return self.format_message(message, timestamp)
     
-    def format_login_message(self, name):
+    def format_login_message(self, name, capabilities=None):
         """Alias for format_login - for compatibility"""
-        return self.format_login(name)
+        return self.format_login(name, capabilities)
     
     def format_connect_message(self, peer_name):
         """Alias for format_connect - for compatibility"""
@@ -3,9 +3,26 @@ feature_utils.py - Feature Manager for AI Bot and Sentiment Analysis
 Handles chatbot integration and sentiment analysis of messages
 """
 
+from collections import OrderedDict
 from textblob import TextBlob
+import queue
 import threading
 
+SENTIMENT_WORKERS = 2  # threads scoring messages off the GUI thread
+SENTIMENT_BATCH = 32  # most texts a worker takes off the queue at once
+SENTIMENT_CACHE = 4096  # distinct normalized texts whose score is kept
+
+# Result for messages that are not (or not yet) scored
+NEUTRAL = {
+    'polarity': 0.0,
+    'color': 'black',
+    'label': 'neutral'
+}
+
+def normalize(message):
+    """Cache key for a message: lowercased, whitespace collapsed"""
+    return ' '.join(message.lower().split())
+
 class FeatureManager:
     """Manages AI chatbot and sentiment analysis features"""
     
@@ -19,6 +36,13 @@ class FeatureManager:
         self.chatbot_client = chatbot_client
         self.sentiment_enabled = True
         self.chatbot_enabled = True
+        
+        # Sentiment scores: an LRU cache, and worker threads for the rest
+        self.sentiment_lock = threading.Lock()
+        self.sentiment_cache = OrderedDict()  # normalized text -> result
+        self.sentiment_waiting = {}  # normalized text -> callbacks waiting for its score
+        self.sentiment_queue = queue.Queue()  # normalized texts to score
+        self.sentiment_workers = []  # started on first use
     
     def process_message_for_bot(self, message, callback):
         """
@@ -82,15 +106,109 @@ class FeatureManager:
             Dict with sentiment info: {'polarity': float, 'color': str, 'label': str}
         """
         if not self.sentiment_enabled:
-            return {
-                'polarity': 0.0,
-                'color': 'black',
-                'label': 'neutral'
-            }
+            return dict(NEUTRAL)
+        
+        key = normalize(message)
+        with self.sentiment_lock:
+            result = self._cached_sentiment(key)
+        if result is None:
+            result = self.score_sentiment(key)
+            with self.sentiment_lock:
+                self._remember_sentiment(key, result)
+        return result
+    
+    def analyze_sentiment_async(self, message, callback):
+        """
+        Analyze sentiment of a message without blocking the caller
+        
+        Repeats of a recent message ("ok", "lol", "thanks") are answered
+        from the cache right away; anything else is queued for the worker
+        threads, and the same text waiting twice is only scored once.
+        
+        Args:
+            message: The message text
+            callback: called with the result dict from a worker thread,
+                when the result was not available right away
+            
+        Returns:
+            the result dict if it is cached (callback is not called),
+            otherwise None
+        """
+        if not self.sentiment_enabled:
+            return dict(NEUTRAL)
         
+        key = normalize(message)
+        with self.sentiment_lock:
+            result = self._cached_sentiment(key)
+            if result is not None:
+                return result
+            waiting = self.sentiment_waiting.get(key)
+            if waiting is not None:
+                waiting.append(callback)
+                return None
+            self.sentiment_waiting[key] = [callback]
+            if not self.sentiment_workers:
+                for i in range(SENTIMENT_WORKERS):
+                    worker = threading.Thread(target=self._score_batches,
+                                              name=f'sentiment-{i}', daemon=True)
+                    worker.start()
+                    self.sentiment_workers.append(worker)
+        self.sentiment_queue.put(key)
+        return None
+    
+    def _score_batches(self):
+        """
+        Sentiment worker (runs in separate thread)
+        
+        Takes whatever is queued, up to SENTIMENT_BATCH texts at a time,
+        scores it, and hands the results to the waiting callbacks.
+        """
+        while True:
+            batch = [self.sentiment_queue.get()]
+            while len(batch) < SENTIMENT_BATCH:
+                try:
+                    batch.append(self.sentiment_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            scored = [(key, self.score_sentiment(key)) for key in batch]
+            
+            done = []
+            with self.sentiment_lock:
+                for key, result in scored:
+                    self._remember_sentiment(key, result)
+                    done.append((self.sentiment_waiting.pop(key, ()), result))
+            for callbacks, result in done:
+                for callback in callbacks:
+                    try:
+                        callback(result)
+                    except Exception as e:
+                        print(f"[WARN] Sentiment callback error: {e}")
+    
+    def _cached_sentiment(self, key):
+        """Cached result for a normalized text, or None (call with the lock held)"""
+        result = self.sentiment_cache.get(key)
+        if result is not None:
+            self.sentiment_cache.move_to_end(key)
+        return result
+    
+    def _remember_sentiment(self, key, result):
+        """Cache a result, forgetting the least recently used (call with the lock held)"""
+        self.sentiment_cache[key] = result
+        self.sentiment_cache.move_to_end(key)
+        while len(self.sentiment_cache) > SENTIMENT_CACHE:
+            self.sentiment_cache.popitem(last=False)
+    
+    def score_sentiment(self, text):
+        """
+        Run TextBlob on a text - the slow part, uncached
+        
+        Returns:
+            Dict with sentiment info: {'polarity': float, 'color': str, 'label': str}
+        """
         try:
             # Use TextBlob for sentiment analysis
-            blob = TextBlob(message)
+            blob = TextBlob(text)
             polarity = blob.sentiment.polarity
             
             # Classify sentiment
@@ -111,11 +229,7 @@ class FeatureManager:
             }
         except Exception as e:
             print(f"[WARN] Sentiment analysis error: {e}")
-            return {
-                'polarity': 0.0,
-                'color': 'black',
-                'label': 'neutral'
-            }
+            return dict(NEUTRAL)
     
     def get_sentiment_color(self, message):
         """